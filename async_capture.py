@@ -0,0 +1,557 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+import itertools
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+from blocking import BlockingStats
+from changes import DocumentValidators
+from failures import classify, storable
+from metrics import CaptureResult
+from pdf import write_pdf_async
+from readiness import (
+    NetworkIdleTracker, PageReadiness, FONTS_AND_IMAGES_FUNCTION, NEXT_PAINT_FUNCTION,
+    as_expression,
+)
+from tiling import check_height
+from utils import (
+    normalize_url, default_output_path, screenshot_params, write_base64, OUTPUT_FORMATS,
+    DEFAULT_USER_AGENT,
+)
+
+CHROME_CANDIDATES = [
+    "google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome",
+    "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
+    r"C:\Program Files\Google\Chrome\Application\chrome.exe",
+    r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe",
+]
+
+
+def find_chrome():
+    """Locate a Chrome/Chromium binary, honouring the CHROME_PATH variable"""
+    candidates = [os.environ.get("CHROME_PATH")] + CHROME_CANDIDATES
+    for candidate in candidates:
+        if not candidate:
+            continue
+        path = shutil.which(candidate) or (candidate if os.path.isfile(candidate) else None)
+        if path:
+            return path
+    return None
+
+
+class CDPError(Exception):
+    """Error response to a DevTools protocol command"""
+
+
+class CDPSession:
+    """Commands and events for one attached target (tab) over a shared connection"""
+
+    def __init__(self, connection, session_id):
+        self.connection = connection
+        self.session_id = session_id
+        self.listeners = []
+
+    async def send(self, method, params=None, timeout=None):
+        return await self.connection.send(method, params, self.session_id, timeout)
+
+    async def wait_for(self, method, timeout):
+        """Wait for the next event with the given method and return its params"""
+        future = asyncio.get_running_loop().create_future()
+
+        def listener(event_method, params, timestamp):
+            if event_method == method and not future.done():
+                future.set_result(params)
+
+        self.listeners.append(listener)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.listeners.remove(listener)
+
+    def dispatch(self, method, params, timestamp):
+        for listener in list(self.listeners):
+            listener(method, params, timestamp)
+
+
+class CDPConnection:
+    """DevTools websocket connection to a browser, multiplexing flattened sessions"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.sessions = {}
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._reader = asyncio.ensure_future(self._read())
+
+    @classmethod
+    async def connect(cls, url):
+        # Screenshots of tall pages are far larger than the default frame limit
+        websocket = await websockets.connect(url, max_size=None)
+        return cls(websocket)
+
+    async def send(self, method, params=None, session_id=None, timeout=None):
+        """Send a command and wait for its result"""
+        message_id = next(self._ids)
+        message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        try:
+            await self.websocket.send(json.dumps(message))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(message_id, None)
+
+    async def attach(self, target_id):
+        """Attach to a target and return a CDPSession for it"""
+        result = await self.send("Target.attachToTarget", {"targetId": target_id, "flatten": True})
+        session = CDPSession(self, result["sessionId"])
+        self.sessions[session.session_id] = session
+        return session
+
+    def detach(self, session):
+        self.sessions.pop(session.session_id, None)
+
+    async def close(self):
+        self._reader.cancel()
+        await self.websocket.close()
+
+    async def _read(self):
+        """Route command results to their callers and events to their sessions"""
+        try:
+            async for raw in self.websocket:
+                message = json.loads(raw)
+                if "id" in message:
+                    future = self._pending.get(message["id"])
+                    if future is None or future.done():
+                        continue
+                    if "error" in message:
+                        future.set_exception(CDPError(message["error"].get("message", "CDP error")))
+                    else:
+                        future.set_result(message.get("result", {}))
+                else:
+                    session = self.sessions.get(message.get("sessionId"))
+                    if session:
+                        session.dispatch(message["method"], message.get("params", {}), time.time())
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(CDPError("Browser connection closed"))
+
+
+class AsyncWebPageCapture:
+    """
+    Capture many pages concurrently from a single Chrome over the DevTools protocol
+
+    Each capture runs in its own browser context and tab, so captures are
+    isolated from one another while sharing one browser process. Output
+    formats and auto-generated paths match WebPageCapture.capture().
+    """
+
+    def __init__(self, headless=True, timeout=30, wait_for_network=True, concurrency=4,
+                 idle_time=0.5, max_wait=None, max_inflight=0, chrome_path=None, cache=None,
+                 request_filter=None, metrics=None, pdf_options=None, retry=None):
+        """
+        Args:
+            headless (bool): Run Chrome without a window
+            timeout (int): Page load timeout in seconds
+            wait_for_network (bool): Wait for network idle, fonts and images
+            concurrency (int): Maximum number of tabs capturing at once
+            idle_time (float): Seconds of network quiet before a page is ready
+            max_wait (float): Upper bound for the readiness wait (defaults to timeout)
+            max_inflight (int): Requests allowed to stay open while idle
+            chrome_path (str): Chrome binary, or None to search for one
+            cache (CaptureCache): Serve and store captures through this cache
+            request_filter (RequestFilter): Requests to block, enforced per
+                request through Fetch interception
+            metrics (CaptureMetrics): Record every CaptureResult here
+            pdf_options (dict): Paper size, page ranges and orientation of PDF
+                output, from pdf.pdf_options()
+            retry (RetryPolicy): Retry failed captures; None captures once
+        """
+        self.headless = headless
+        self.timeout = timeout
+        self.wait_for_network = wait_for_network
+        self.concurrency = concurrency
+        self.chrome_path = chrome_path
+        self.max_inflight = max_inflight
+        self.cache = cache
+        self.request_filter = request_filter
+        # Part of cache keys, since blocked requests change what a page shows
+        self.blocked = request_filter.blocked_url_patterns() if request_filter else None
+        self.metrics = metrics
+        self.pdf_options = pdf_options
+        self.retry = retry
+        self.blocking = BlockingStats(request_filter, count_blocked_events=False) if request_filter else None
+        self.readiness = PageReadiness(
+            idle_time=idle_time,
+            max_wait=max_wait if max_wait is not None else timeout,
+            max_inflight=max_inflight,
+        )
+        self.connection = None
+        self._process = None
+        self._profile_dir = None
+        self._semaphore = None
+        self._init_seconds = None
+
+    async def start(self):
+        """Launch Chrome and connect to its DevTools websocket"""
+        if websockets is None:
+            raise RuntimeError("The async engine needs the 'websockets' package: pip install websockets")
+
+        chrome = self.chrome_path or find_chrome()
+        if not chrome:
+            raise RuntimeError("Chrome not found; set CHROME_PATH to the browser binary")
+
+        started = time.monotonic()
+        self._profile_dir = tempfile.mkdtemp(prefix="webcapture-")
+        args = [
+            chrome,
+            "--remote-debugging-port=0",
+            f"--user-data-dir={self._profile_dir}",
+            "--no-sandbox",
+            "--disable-dev-shm-usage",
+            "--disable-gpu",
+            "--no-first-run",
+            "--no-default-browser-check",
+            f"--user-agent={DEFAULT_USER_AGENT}",
+        ]
+        if self.headless:
+            args.append("--headless=new")
+        args.append("about:blank")
+
+        self._process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            url = await self._devtools_url()
+            self.connection = await CDPConnection.connect(url)
+        except Exception:
+            await self.close()
+            raise
+        # Reported as the driver_init phase of the first capture
+        self._init_seconds = time.monotonic() - started
+
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def _devtools_url(self):
+        """Read the browser websocket URL Chrome writes once it is listening"""
+        port_file = os.path.join(self._profile_dir, "DevToolsActivePort")
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self._process.returncode is not None:
+                raise RuntimeError("Chrome exited during startup")
+            try:
+                with open(port_file) as f:
+                    lines = f.read().split()
+                if len(lines) >= 2:
+                    return f"ws://127.0.0.1:{lines[0]}{lines[1]}"
+            except OSError:
+                pass
+            await asyncio.sleep(0.05)
+        raise RuntimeError("Timed out waiting for Chrome DevTools")
+
+    async def close(self):
+        """Disconnect and shut down Chrome"""
+        if self.connection:
+            try:
+                await self.connection.send("Browser.close", timeout=5)
+            except Exception:
+                pass
+            await self.connection.close()
+            self.connection = None
+        if self._process and self._process.returncode is None:
+            try:
+                await asyncio.wait_for(self._process.wait(), 5)
+            except asyncio.TimeoutError:
+                self._process.kill()
+                await self._process.wait()
+        self._process = None
+        if self._profile_dir:
+            shutil.rmtree(self._profile_dir, ignore_errors=True)
+            self._profile_dir = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def capture(self, url, output_format='png', output_path=None, quality=90, width=1920, height=None):
+        """
+        Capture a webpage screenshot or PDF in a fresh tab
+
+        Takes the same arguments as WebPageCapture.capture() and waits for a
+        free slot if `concurrency` captures are already running.
+
+        Returns:
+            str: Path to saved file, or None on failure
+        """
+        result = await self.capture_result(url, output_format, output_path, quality, width, height)
+        return result.path
+
+    async def capture_result(self, url, output_format='png', output_path=None, quality=90, width=1920,
+                             height=None):
+        """Capture like capture(), but return a CaptureResult with per-phase timings"""
+        started = time.monotonic()
+        attempt = 1
+        while True:
+            attempt_started = time.monotonic()
+            result = CaptureResult(url, output_format, output_path)
+            if self._init_seconds is not None:
+                result.add_time('driver_init', self._init_seconds)
+                self._init_seconds = None
+            await self._capture(result, url, output_format, output_path, quality, width, height)
+            result.finish()
+            failure = self.retry.failure([result], attempt) if self.retry else None
+            if failure is None:
+                break
+            # Tabs share one browser, so a crashed browser isn't restarted here
+            delay = self.retry.delay(attempt, result.retry_after if failure == 'Throttled' else None)
+            print(f"{failure} capturing {url}, retrying in {delay:.1f}s "
+                  f"(attempt {attempt + 1} of {self.retry.attempts})")
+            await asyncio.sleep(delay)
+            attempt += 1
+        result.attempts = attempt
+        if attempt > 1:
+            result.add_time('retry', attempt_started - started)
+        if self.metrics:
+            self.metrics.observe(result)
+        return result
+
+    async def _capture(self, result, url, output_format, output_path, quality, width, height):
+        if not self.connection:
+            print("Browser not started")
+            result.fail("Browser not started", 'DriverNotInitialized')
+            return
+
+        # Validate URL
+        url, parsed_url = normalize_url(url)
+        if parsed_url is None:
+            print("Invalid URL format")
+            result.fail("Invalid URL format", 'InvalidURL')
+            return
+
+        # Validate format
+        if output_format not in OUTPUT_FORMATS:
+            print(f"Invalid format: {output_format}. Using png instead.")
+            output_format = 'png'
+            result.output_format = output_format
+
+        # Generate output path if not provided
+        if not output_path:
+            output_path = default_output_path(parsed_url, output_format)
+        result.output_path = output_path
+
+        # Serve repeat captures from the cache without opening a tab
+        if self.cache:
+            with result.phase('cache'):
+                cached = self.cache.fetch(url, output_format, output_path, quality, width, height,
+                                          DEFAULT_USER_AGENT, self.pdf_options, self.blocked)
+            if cached:
+                print(f"Cache hit, saved to: {cached}")
+                result.succeed(cached, source='cache')
+                return
+
+        async with self._semaphore:
+            print(f"Loading {url}...")
+            try:
+                await self._capture_in_tab(result, url, output_format, output_path, quality, width, height)
+                if self.cache and storable(result.http_status, self.retry):
+                    self.cache.store(output_path, url, output_format, quality, width, height,
+                                     DEFAULT_USER_AGENT, self.pdf_options, self.blocked)
+                print(f"Saved to: {output_path}")
+                result.succeed(output_path)
+            except asyncio.TimeoutError:
+                print(f"Timeout loading page: {url}")
+                result.fail(f"Timeout loading page: {url}", 'Timeout')
+            except CDPError as e:
+                print(f"DevTools error: {e}")
+                result.fail(e, classify(e, 'DevToolsError'))
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+                result.fail(e, classify(e))
+
+    async def capture_many(self, jobs):
+        """
+        Capture several pages concurrently
+
+        Args:
+            jobs (list): Dicts of capture() keyword arguments, each with a 'url'
+
+        Returns:
+            list: Output path (or None) for each job, in order
+        """
+        return await asyncio.gather(*(self.capture(**job) for job in jobs))
+
+    async def _capture_in_tab(self, result, url, output_format, output_path, quality, width, height):
+        """Open an isolated tab, load the page and write the output, timing phases on result"""
+        connection = self.connection
+        context = await connection.send("Target.createBrowserContext", {"disposeOnDetach": True})
+        context_id = context["browserContextId"]
+        session = None
+        try:
+            target = await connection.send("Target.createTarget", {
+                "url": "about:blank", "browserContextId": context_id
+            })
+            session = await connection.attach(target["targetId"])
+            tracker = NetworkIdleTracker(max_inflight=self.max_inflight)
+            validators = DocumentValidators()
+            session.listeners.append(tracker.feed)
+            session.listeners.append(validators.feed)
+
+            await session.send("Page.enable")
+            await session.send("Network.enable")
+            if self.request_filter:
+                await self._enable_blocking(session)
+            await session.send("Emulation.setDeviceMetricsOverride", {
+                "width": width or 1920, "height": height or 1080,
+                "deviceScaleFactor": 1, "mobile": False
+            })
+
+            # Load the webpage
+            with result.phase('navigate'):
+                loaded = asyncio.ensure_future(session.wait_for("Page.loadEventFired", self.timeout))
+                try:
+                    navigation = await session.send("Page.navigate", {"url": url}, timeout=self.timeout)
+                    if navigation.get("errorText"):
+                        raise CDPError(f"{navigation['errorText']} loading {url}")
+                    await loaded
+                finally:
+                    loaded.cancel()
+
+            # Wait for page to be fully loaded
+            if self.wait_for_network:
+                with result.phase('wait'):
+                    if not await self._wait_ready(session, tracker):
+                        print("Timeout waiting for page to load completely")
+            result.http_status = validators.status
+            result.retry_after = validators.retry_after
+
+            # Set viewport size for full page capture
+            if width and not height:
+                with result.phase('resize'):
+                    layout = await session.send("Page.getLayoutMetrics")
+                    content = layout.get("cssContentSize") or layout["contentSize"]
+                    check_height(output_format, int(content["height"]))
+                    await session.send("Emulation.setDeviceMetricsOverride", {
+                        "width": width, "height": int(content["height"]),
+                        "deviceScaleFactor": 1, "mobile": False
+                    })
+
+            # Wait for the resize to be painted and anything it triggered to load
+            with result.phase('settle'):
+                await self._evaluate(session, as_expression(NEXT_PAINT_FUNCTION), self.readiness.max_wait)
+                if self.wait_for_network:
+                    await self._wait_network_idle(session, tracker)
+
+            # Capture based on format choice
+            if output_format == 'pdf':
+                await self._capture_pdf(session, output_path, result)
+            else:
+                await self._capture_image(session, output_path, output_format, quality, result)
+        finally:
+            if session:
+                connection.detach(session)
+                try:
+                    await connection.send("Target.closeTarget", {"targetId": target["targetId"]}, timeout=5)
+                except Exception:
+                    pass
+            try:
+                await connection.send("Target.disposeBrowserContext", {"browserContextId": context_id}, timeout=5)
+            except Exception:
+                pass
+
+    async def _enable_blocking(self, session):
+        """Fail requests matched by the filter before they are sent"""
+        def on_request_paused(method, params, timestamp):
+            if method != "Fetch.requestPaused":
+                return
+            resource_type = params.get("resourceType")
+            rule = self.request_filter.match(params["request"]["url"], resource_type)
+            if rule:
+                self.blocking.record(rule, resource_type)
+                command = session.send("Fetch.failRequest", {
+                    "requestId": params["requestId"], "errorReason": "BlockedByClient"
+                })
+            else:
+                command = session.send("Fetch.continueRequest", {"requestId": params["requestId"]})
+            asyncio.ensure_future(command).add_done_callback(lambda future: future.cancelled() or future.exception())
+
+        session.listeners.append(on_request_paused)
+        session.listeners.append(self.blocking.feed)
+        await session.send("Fetch.enable", {"patterns": [{"urlPattern": "*", "requestStage": "Request"}]})
+
+        # Fetch doesn't see websockets, so those are blocked by URL
+        sockets = [p for p in self.request_filter.blocked_url_patterns() if p.startswith(("ws://", "wss://"))]
+        if sockets:
+            await session.send("Network.setBlockedURLs", {"urls": sockets})
+
+    async def _wait_ready(self, session, tracker):
+        """Async counterpart of PageReadiness.wait() driven by session events"""
+        started = time.monotonic()
+        if not await self._wait_network_idle(session, tracker):
+            return False
+        remaining = self.readiness.max_wait - (time.monotonic() - started)
+        if remaining <= 0:
+            return False
+        expression = as_expression(
+            FONTS_AND_IMAGES_FUNCTION, self.readiness.wait_for_fonts, self.readiness.wait_for_images
+        )
+        return bool(await self._evaluate(session, expression, remaining))
+
+    async def _wait_network_idle(self, session, tracker):
+        deadline = time.monotonic() + self.readiness.max_wait
+        while tracker.idle_for() < self.readiness.idle_time:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(self.readiness.poll_interval)
+        return True
+
+    async def _evaluate(self, session, expression, timeout):
+        """Evaluate a promise-returning expression, returning its value or None"""
+        try:
+            result = await session.send("Runtime.evaluate", {
+                "expression": expression, "awaitPromise": True, "returnByValue": True
+            }, timeout=timeout)
+            return result.get("result", {}).get("value")
+        except (asyncio.TimeoutError, CDPError):
+            return None
+
+    async def _capture_image(self, session, output_path, format_choice, quality, result):
+        """Capture screenshot as PNG, JPG or WebP, encoded natively by Chrome"""
+        params = screenshot_params(format_choice, quality)
+        params.update({"captureBeyondViewport": True, "fromSurface": True})
+        with result.phase('screenshot'):
+            screenshot = await session.send("Page.captureScreenshot", params)
+        await asyncio.get_running_loop().run_in_executor(
+            None, write_base64, screenshot['data'], output_path, 1 << 20, result
+        )
+
+    async def _capture_pdf(self, session, output_path, result):
+        """Generate PDF of the webpage, streamed to disk in chunks"""
+        await write_pdf_async(session.send, output_path, self.pdf_options, timer=result)
+
+
+async def capture_urls(urls, concurrency=4, **options):
+    """Capture a list of URLs with one browser and return their output paths"""
+    async with AsyncWebPageCapture(concurrency=concurrency, **options) as capture:
+        return await capture.capture_many([{"url": url} for url in urls])
+
+
+if __name__ == "__main__":
+    paths = asyncio.run(capture_urls(sys.argv[1:]))
+    sys.exit(0 if all(paths) else 1)
@@ -0,0 +1,689 @@
+import sys
+import json
+import time
+import queue
+import asyncio
+import argparse
+import threading
+
+from blocking import filter_from_args
+from cache import cache_from_args
+from changes import ChangeTracker
+from duplicates import duplicates_from_args
+from manifest import in_shard, job_fingerprint, parse_shard, progress_from_args
+from failures import retry_from_args
+from httpcache import http_cache_from_args
+from metrics import metrics_from_args
+from pdf import pdf_options_from_args
+from scheduler import scheduler_from_args
+from screenshot import add_capture_arguments, add_render_arguments, WebPageCapture
+from utils import normalize_url, default_output_path
+from visualdiff import diffs_from_args
+
+# Keys accepted in a JSON job line, mapped to capture() keyword arguments
+JOB_FIELDS = {
+    'format': 'output_format',
+    'output': 'output_path',
+    'quality': 'quality',
+    'width': 'width',
+    'height': 'height',
+    'tile_height': 'tile_height',
+    'tiles_dir': 'tiles_dir',
+    'outputs': 'outputs',
+    'selector': 'selector',
+    'clip': 'clip',
+}
+
+
+class CaptureCancelled(Exception):
+    """Raised at the next phase of a capture whose job was cancelled"""
+
+
+class CaptureJob:
+    """A single URL to capture plus the capture() options to use for it"""
+
+    def __init__(self, url, job_id=None, **options):
+        self.url = url
+        self.id = job_id
+        self.options = options
+        # Identifies the manifest line in a ProgressStore; defaults and
+        # generated output paths aren't part of it
+        self.fingerprint = job_fingerprint(url)
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.details = None
+        self.outputs = []
+        self.worker = None
+        self.started_at = None
+        self.finished_at = None
+        self.phase = None
+        self._done = threading.Event()
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def from_line(cls, line, job_id=None, defaults=None):
+        """
+        Parse one line of a batch list
+
+        A line is either a bare URL or a JSON object with a "url" key and
+        optional "id", "format", "output", "quality", "width", "height",
+        "tile_height", "tiles_dir", "outputs" (a list of output specs
+        produced from one render), "selector" and "clip" (an element or page
+        region to capture instead of the full page). Manifest lines also carry a "status",
+        which is informational and ignored here.
+
+        Returns:
+            CaptureJob: The parsed job, or None for blank lines and comments
+        """
+        line = line.strip()
+        if not line or line.startswith('#'):
+            return None
+
+        if not line.startswith('{'):
+            return cls(line, job_id, **dict(defaults or {}))
+        return cls.from_dict(json.loads(line), job_id, defaults)
+
+    @classmethod
+    def from_dict(cls, data, job_id=None, defaults=None, fields=JOB_FIELDS):
+        """Build a job from a decoded JSON object, accepting only the given fields"""
+        if not isinstance(data, dict) or not isinstance(data.get('url'), str):
+            raise ValueError("JSON job must be an object with a 'url' key")
+
+        options = dict(defaults or {})
+        job_id = data.get('id', job_id)
+        line = {}
+        for key, value in data.items():
+            if key in ('url', 'id', 'status'):
+                continue
+            if key not in fields:
+                raise ValueError(f"Unknown job field: {key}")
+            options[fields[key]] = value
+            line[key] = value
+        job = cls(data['url'], job_id, **options)
+        job.fingerprint = job_fingerprint(data['url'], line)
+        return job
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def status(self):
+        if self.done:
+            if self.cancelled and not self.ok:
+                return 'cancelled'
+            return 'done' if self.ok else 'failed'
+        return 'running' if self.started_at is not None else 'queued'
+
+    def cancel(self):
+        """
+        Ask for the job to be dropped
+
+        A queued job is skipped; a running one stops at the start of its
+        next phase, so a page load in progress still finishes (or times
+        out) first.
+        """
+        self._cancelled.set()
+
+    @property
+    def ok(self):
+        return self.result is not None
+
+    @property
+    def seconds(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def wait(self, timeout=None):
+        """Block until the job has been processed"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'url': self.url,
+            'status': self.status,
+            'ok': self.ok,
+            'path': self.result,
+            'error': self.error,
+            'worker': self.worker,
+            'phase': self.phase,
+            'seconds': round(self.seconds, 3) if self.seconds is not None else None,
+        }
+        if self.details is not None:
+            details = self.details.to_dict()
+            data.update(source=details['source'], error_type=details['error_type'],
+                        bytes=details['bytes'], phases=details['phases'])
+            if details['phash'] is not None:
+                data.update(phash=details['phash'], duplicate_of=details['duplicate_of'])
+            if details['diff'] is not None:
+                data['diff'] = details['diff']
+        if len(self.outputs) > 1:
+            data['outputs'] = [output.to_dict() for output in self.outputs]
+        return data
+
+    def to_manifest(self, status='pending'):
+        """Manifest entry: id, url, the job's own options and its status"""
+        fields = {option: key for key, option in JOB_FIELDS.items()}
+        entry = {'id': self.id, 'url': self.url}
+        entry.update((fields[option], value) for option, value in self.options.items() if option in fields)
+        entry['status'] = status
+        return entry
+
+    def finish(self, details):
+        """
+        Take the path and error from a CaptureResult, or a list of them
+
+        A multi-output job is ok only if every output is; its path is the
+        first output's.
+        """
+        self.outputs = details if isinstance(details, list) else [details]
+        self.details = self.outputs[0] if self.outputs else None
+        failed = [output for output in self.outputs if not output.ok]
+        self.result = self.details.path if self.details is not None and not failed else None
+        self.error = failed[0].error if failed else None
+
+
+class CapturePool:
+    """
+    Fixed-size pool of worker threads, each owning a long-lived WebPageCapture
+
+    Chrome is started once per worker and reused for every job that worker
+    picks up, so the per-URL cost is only navigation and rendering.
+    """
+
+    def __init__(self, workers=2, max_queue=0, on_done=None, scheduler=None, on_progress=None,
+                 **capture_options):
+        """
+        Args:
+            workers (int): Number of worker threads (and Chrome instances)
+            max_queue (int): Maximum number of pending jobs, 0 for unbounded
+            on_done (callable): Called with each CaptureJob once it finishes
+            scheduler (HostScheduler): Hand out jobs under per-host rate and
+                concurrency limits instead of in submission order; its own
+                max_pending bounds the queue. Throttled captures are retried
+                through it rather than by the worker, so they wait for the
+                host's backoff.
+            on_progress (callable): Called with a running CaptureJob whenever
+                it enters a new phase (job.phase)
+            **capture_options: Keyword arguments for WebPageCapture()
+        """
+        self.workers = max(1, workers)
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.scheduler = scheduler
+        self.retry = capture_options.get('retry')
+        if scheduler is not None and self.retry:
+            capture_options['retry'] = self.retry.without('Throttled')
+        self.capture_options = capture_options
+        self._queue = scheduler if scheduler is not None else queue.Queue(maxsize=max_queue)
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads"""
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, args=(index,),
+                name=f"capture-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, job, block=True, timeout=None):
+        """Queue a job; raises queue.Full if the queue is bounded and full"""
+        self._queue.put(job, block=block, timeout=timeout)
+        return job
+
+    @property
+    def pending(self):
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    def close(self):
+        """Let the workers drain the queue, then shut down their browsers"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _worker(self, index):
+        """Process jobs until a shutdown sentinel is received"""
+        capture = None
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+
+                job.worker = index
+                job.started_at = time.monotonic()
+                results = []
+                try:
+                    if job.cancelled:
+                        raise CaptureCancelled("Cancelled before it started")
+                    if capture is None:
+                        self._enter(job, 'driver_init')
+                        capture = WebPageCapture(**self.capture_options)
+                    capture.on_phase = lambda name, job=job: self._enter(job, name)
+                    results = self._run(capture, job)
+                except Exception as e:
+                    job.error = str(e)
+                finally:
+                    if capture:
+                        capture.on_phase = None
+                if self.scheduler:
+                    # The host is done with us once the page is rendered
+                    self.scheduler.finished(job, results)
+                    if self._retry_throttled(job, results):
+                        continue
+                self._complete(job, results)
+        finally:
+            if capture:
+                capture.close()
+
+    def _retry_throttled(self, job, results):
+        """
+        Queue a throttled job again behind its host's backoff, if the retry policy allows
+
+        job.attempts counts the attempts of every run of the job; the
+        results of the final run carry the total.
+        """
+        job.attempts += max((result.attempts for result in results), default=1)
+        for result in results:
+            result.attempts = job.attempts
+        if not self.retry or job.cancelled or self.retry.failure(results, job.attempts) != 'Throttled':
+            return False
+        print(f"Throttled capturing {job.url}, queued again behind the host's backoff "
+              f"(attempt {job.attempts + 1} of {self.retry.attempts})")
+        self.scheduler.retry(job)
+        return True
+
+    def _enter(self, job, name):
+        """Record the phase a job is entering, aborting it if it was cancelled"""
+        if job.cancelled:
+            raise CaptureCancelled("Cancelled")
+        job.phase = name
+        if self.on_progress:
+            self.on_progress(job)
+
+    @staticmethod
+    def _run(capture, job):
+        """Capture one job, returning a CaptureResult per output"""
+        options = dict(job.options)
+        outputs = options.pop('outputs', None)
+        if not outputs:
+            return [capture.capture_result(job.url, **options)]
+        return capture.capture_outputs(
+            job.url, outputs, options.get('output_path'), options.get('width', 1920),
+            options.get('height'), options.get('tile_height')
+        )
+
+    def _complete(self, job, results):
+        """
+        Finish the job once all its results are
+
+        Results deferred to a PostProcessor finish on its threads, so the
+        worker can move on to the next job meanwhile.
+        """
+        remaining = [len(results)]
+        lock = threading.Lock()
+
+        def finished(result=None):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            if results:
+                job.finish(results)
+            job.finished_at = time.monotonic()
+            job._done.set()
+            if self.on_done:
+                self.on_done(job)
+
+        if not results:
+            finished()
+        for result in results:
+            result.add_done_callback(finished)
+
+
+def read_jobs(stream, defaults=None, output_dir=None):
+    """Yield CaptureJob objects from a stream of batch lines"""
+    for line_number, line in enumerate(stream, 1):
+        try:
+            job = CaptureJob.from_line(line, job_id=line_number, defaults=defaults)
+        except ValueError as e:
+            print(f"Skipping line {line_number}: {e}")
+            continue
+        if job is None:
+            continue
+
+        # Give auto-named outputs a job suffix so same-second captures of one
+        # domain don't overwrite each other
+        if not job.options.get('output_path'):
+            url, parsed_url = normalize_url(job.url)
+            if parsed_url is not None:
+                output_format = job.options.get('output_format', 'png')
+                job.options['output_path'] = default_output_path(
+                    parsed_url, output_format, output_dir, suffix=job.id
+                )
+        yield job
+
+
+def write_manifest(stream, out, progress=None):
+    """
+    Convert a batch list into a manifest with explicit, stable job ids
+
+    Bare URLs get their line number as id, exactly as when the list is run
+    directly, so progress recorded for the list carries over. The status of
+    each job comes from the progress store, if given.
+
+    Returns:
+        int: Number of jobs written
+    """
+    count = 0
+    for line_number, line in enumerate(stream, 1):
+        try:
+            job = CaptureJob.from_line(line, job_id=line_number)
+        except ValueError as e:
+            print(f"Skipping line {line_number}: {e}")
+            continue
+        if job is None:
+            continue
+        status = progress.status(job) if progress else 'pending'
+        out.write(json.dumps(job.to_manifest(status)) + "\n")
+        count += 1
+    return count
+
+
+# Job options that only the Selenium engine implements
+TABS_UNSUPPORTED = ('tile_height', 'tiles_dir', 'outputs', 'selector', 'clip')
+
+
+async def run_in_tabs(jobs, tabs=4, on_done=None, **capture_options):
+    """
+    Run jobs concurrently as tabs of a single browser with AsyncWebPageCapture
+
+    At most 2 * tabs jobs are read ahead of the ones running, so huge lists
+    are streamed just like with CapturePool. Options in TABS_UNSUPPORTED are
+    dropped from jobs with a notice.
+    """
+    async def run_job(capture, job):
+        job.worker = 0
+        job.started_at = time.monotonic()
+        options = dict(job.options)
+        dropped = [name for name in TABS_UNSUPPORTED if options.pop(name, None) is not None]
+        if dropped:
+            print(f"{job.url}: {', '.join(dropped)} not supported with --tabs; ignored")
+        try:
+            job.finish(await capture.capture_result(job.url, **options))
+        except Exception as e:
+            job.error = str(e)
+        job.finished_at = time.monotonic()
+        job._done.set()
+        if on_done:
+            on_done(job)
+
+    # The async engine (and websockets) only loads when tabs are used
+    from async_capture import AsyncWebPageCapture
+
+    async with AsyncWebPageCapture(concurrency=tabs, **capture_options) as capture:
+        pending = set()
+        for job in jobs:
+            if len(pending) >= tabs * 2:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.add(asyncio.ensure_future(run_job(capture, job)))
+        if pending:
+            await asyncio.wait(pending)
+
+
+def add_pool_arguments(parser):
+    """Add the browser pool and per-host scheduling options shared by --batch and --serve"""
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Number of Chrome instances to run in parallel')
+    parser.add_argument('--host-rate', type=float, metavar='R',
+                        help='Start at most R page loads per second per host, backing off on 429/503 and slow pages')
+    parser.add_argument('--host-burst', type=int, default=2, help='Page loads a host may get back to back')
+    parser.add_argument('--per-host', type=int, metavar='N', help='Capture at most N pages of one host at once')
+    parser.add_argument('--isolation', choices=['context', 'storage', 'none'], default='context',
+                        help='Clear browser state between captures with a new browser context (default), '
+                             'by clearing storage, or not at all')
+    parser.add_argument('--recycle-after', type=int, metavar='N', help='Restart each Chrome after N page loads')
+    parser.add_argument('--max-browser-mb', type=int, metavar='MB',
+                        help='Restart a Chrome whose processes use more than MB of memory')
+
+
+def add_batch_arguments(parser):
+    """Add the arguments of a --batch run; output options are the defaults of every job"""
+    parser.add_argument('--batch', required=True, metavar='FILE',
+                        help="File with one URL or JSON job per line ('-' for stdin)")
+    parser.add_argument('--tabs', type=int,
+                        help='Capture concurrently in this many tabs of one Chrome instead of a pool')
+    parser.add_argument('--output-dir', help='Directory for auto-named outputs')
+    parser.add_argument('--report', metavar='FILE', help='Write per-job results as JSON lines')
+    parser.add_argument('--shard', metavar='I/N',
+                        help='Only run the jobs of shard I of N (e.g. 2/4), split deterministically by job id')
+    parser.add_argument('--progress', metavar='DB',
+                        help='Record finished jobs in this SQLite file and skip completed ones when resuming')
+    parser.add_argument('--write-manifest', metavar='FILE',
+                        help='Write the list as a JSONL manifest with job ids and status (from --progress), then exit')
+    parser.add_argument('--postprocess-workers', type=int, metavar='N',
+                        help='Encode --output-spec variants in N processes while the browsers move on')
+    parser.add_argument('--lookahead', type=int, default=1000,
+                        help='Jobs read ahead to interleave hosts when --host-rate/--per-host is set')
+    add_render_arguments(parser)
+    add_pool_arguments(parser)
+    add_capture_arguments(parser, retries=2)
+
+
+def run_batch(argv=None):
+    """
+    Run a batch of captures from a file or stdin through a pool of drivers
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(description='Capture a list of webpages')
+    add_batch_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        request_filter = filter_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    progress = progress_from_args(args)
+
+    if args.write_manifest:
+        stream = sys.stdin if args.batch == '-' else open(args.batch)
+        try:
+            with open(args.write_manifest, 'w') as out:
+                count = write_manifest(stream, out, progress)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        print(f"Wrote {count} jobs to {args.write_manifest}")
+        return 0
+
+    defaults = {
+        'output_format': args.format,
+        'quality': args.quality,
+        'width': args.width,
+        'height': args.height,
+    }
+    if args.tile_height:
+        defaults['tile_height'] = args.tile_height
+    if args.selector:
+        defaults['selector'] = args.selector
+    if args.clip:
+        defaults['clip'] = args.clip
+    if args.output_spec:
+        defaults['outputs'] = [{'format': args.format, 'quality': args.quality}] + args.output_spec
+
+    stream = sys.stdin if args.batch == '-' else open(args.batch)
+    report = open(args.report, 'w') if args.report else None
+    lock = threading.Lock()
+    counts = {'ok': 0, 'failed': 0}
+
+    def on_done(job):
+        with lock:
+            counts['ok' if job.ok else 'failed'] += 1
+            if job.ok:
+                diff = job.details.diff if job.details is not None else None
+                change = f", {diff.score:.2%} changed" if diff is not None and diff.compared else ""
+                duplicate_of = job.details.duplicate_of if job.details is not None else None
+                if duplicate_of:
+                    change += f", duplicate of {duplicate_of['url']}"
+                print(f"[ok] {job.url} -> {job.result} ({job.seconds:.2f}s, worker {job.worker}{change})")
+            else:
+                error_type = job.details.error_type if job.details is not None else None
+                print(f"[failed] {job.url}: {error_type or 'Error'}: {job.error} "
+                      f"({job.seconds:.2f}s, worker {job.worker})")
+            if report:
+                report.write(json.dumps(job.to_dict()) + "\n")
+                report.flush()
+            if progress:
+                progress.record(job)
+
+    capture_options = {
+        'headless': True,
+        'timeout': args.timeout,
+        'idle_time': args.idle_ms / 1000.0,
+        'max_wait': args.max_wait,
+        'cache': cache_from_args(args),
+        'request_filter': request_filter,
+        'metrics': metrics_from_args(args),
+        'pdf_options': pdf_options_from_args(args),
+        'retry': retry_from_args(args),
+    }
+    if not args.tabs:
+        # The async engine isolates every capture in its own context already
+        capture_options.update(
+            isolation=None if args.isolation == 'none' else args.isolation,
+            max_captures=args.recycle_after, max_memory_mb=args.max_browser_mb,
+            http_cache=http_cache_from_args(args),
+        )
+    postprocessor = None
+    if args.tabs:
+        if args.output_spec:
+            print("--output-spec is not supported with --tabs; capturing the primary format only")
+            defaults.pop('outputs')
+    elif args.postprocess_workers:
+        from postprocess import PostProcessor
+        postprocessor = PostProcessor(workers=args.postprocess_workers)
+        capture_options['postprocessor'] = postprocessor
+    if args.tabs and args.http_cache_dir:
+        print("--http-cache-dir is not supported with --tabs; tabs use in-memory caches")
+    if args.tabs and (args.selector or args.clip):
+        print("--selector/--clip are not supported with --tabs; capturing full pages")
+        defaults.pop('selector', None)
+        defaults.pop('clip', None)
+    if args.tabs and args.tile_height:
+        print("--tile-height is not supported with --tabs; capturing pages in one piece")
+        defaults.pop('tile_height')
+    if args.tabs and (args.host_rate or args.per_host):
+        print("--host-rate/--per-host are not supported with --tabs; use --tabs to bound concurrency")
+    if args.if_changed:
+        if args.tabs:
+            print("--if-changed is not supported with --tabs; capturing every page")
+        else:
+            capture_options['changes'] = ChangeTracker(args.if_changed)
+    if args.diff_dir:
+        if args.tabs:
+            print("--diff-dir is not supported with --tabs; captures are not compared")
+        else:
+            capture_options['diffs'] = diffs_from_args(args)
+    if args.dedupe_index:
+        if args.tabs:
+            print("--dedupe-index is not supported with --tabs; captures are not hashed")
+        else:
+            capture_options['duplicates'] = duplicates_from_args(args)
+    jobs = read_jobs(stream, defaults, args.output_dir)
+    if shard:
+        jobs = in_shard(jobs, shard)
+    if progress:
+        jobs = progress.pending(jobs)
+
+    started = time.monotonic()
+    try:
+        if args.tabs:
+            asyncio.run(run_in_tabs(jobs, args.tabs, on_done, **capture_options))
+        else:
+            # Keep the queue short so huge lists are streamed rather than loaded;
+            # per-host scheduling reads further ahead to have other hosts to interleave
+            pool = CapturePool(
+                workers=args.workers, max_queue=args.workers * 2, on_done=on_done,
+                scheduler=scheduler_from_args(args, max(args.lookahead, args.workers * 2)),
+                **capture_options
+            )
+            with pool:
+                for job in jobs:
+                    pool.submit(job)
+            if postprocessor:
+                # Jobs finish once their deferred variants are encoded
+                postprocessor.close()
+    except KeyboardInterrupt:
+        print("\nOperation cancelled by user")
+        return 1
+    finally:
+        if postprocessor:
+            postprocessor.close(wait=False)
+        if stream is not sys.stdin:
+            stream.close()
+        if report:
+            report.close()
+        if progress:
+            progress.close()
+        if capture_options['metrics']:
+            capture_options['metrics'].close()
+
+    elapsed = time.monotonic() - started
+    total = counts['ok'] + counts['failed']
+    rate = total / elapsed if elapsed > 0 else 0.0
+    mode = f"{args.tabs} tabs" if args.tabs else f"{args.workers} workers"
+    print(f"\nCaptured {counts['ok']}/{total} pages in {elapsed:.1f}s "
+          f"({rate:.2f} pages/sec, {mode})")
+    if shard:
+        print(f"Shard {shard[0]}/{shard[1]}")
+    if progress and progress.skipped:
+        print(f"Skipped {progress.skipped} jobs completed in an earlier run")
+    if capture_options['cache']:
+        stats = capture_options['cache'].stats()
+        print(f"Cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%}), {stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB")
+    if capture_options.get('http_cache'):
+        capture_options['http_cache'].log()
+    if capture_options.get('changes'):
+        changes = capture_options['changes']
+        print(f"Unchanged pages skipped: {changes.skipped}, re-rendered: {changes.changed}")
+        changes.close()
+    if capture_options.get('diffs'):
+        diffs = capture_options['diffs']
+        print(f"Visual diffs: {diffs.changed} of {diffs.compared} compared pages changed")
+    if capture_options.get('duplicates'):
+        duplicates = capture_options['duplicates']
+        action = "dropped" if duplicates.drop else "flagged"
+        print(f"Near-duplicates {action}: {duplicates.duplicates}, unique: {duplicates.unique}")
+        duplicates.close()
+    return 0 if counts['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run_batch())
@@ -0,0 +1,609 @@
+#!/usr/bin/env python3
+"""
+Capture benchmark against a local fixture server
+
+Serves a fixed set of fixture pages from 127.0.0.1, captures each of them
+repeatedly in every requested mode, and writes latency percentiles,
+throughput, peak memory and output sizes as JSON. Two result files can be
+compared with --compare.
+
+    python benchmark.py --modes single,pool,tabs --iterations 10 --output before.json
+    python benchmark.py --compare before.json after.json
+
+--import-time instead measures how long `main.py --version` spends
+importing modules (python -X importtime) and fails when it is over budget
+or loads one of the heavy capture dependencies.
+
+    python benchmark.py --import-time --import-budget-ms 100
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from utils import process_tree_rss
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MODES = ['single', 'pool', 'tabs']
+
+# Startup budget for `main.py --version`, and packages it must not import
+IMPORT_BUDGET_MS = 100
+HEAVY_MODULES = ('selenium', 'PIL', 'tkinter', 'websockets', 'numpy', 'psutil')
+
+PARAGRAPH = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+             "incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud "
+             "exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat.")
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<style>body {{ font: 16px/1.5 sans-serif; margin: 0 auto; max-width: 960px; }} {style}</style>
+</head><body>{body}</body></html>"""
+
+
+def _static_page():
+    sections = "".join(
+        f"<h2>Section {index}</h2><p>{PARAGRAPH}</p><p>{PARAGRAPH}</p>" for index in range(40)
+    )
+    return PAGE.format(title="Static", style="h2 { color: #335; }", body=sections)
+
+
+def _images_page():
+    images = "".join(
+        f'<img src="/image/{index}.png?delay=50" width="200" height="150" alt="">' for index in range(60)
+    )
+    return PAGE.format(title="Images", style="img { margin: 4px; }", body=images)
+
+
+def _tall_page():
+    # Taller than tiling.AUTO_TILE_HEIGHT, so full-page captures are tiled
+    blocks = "".join(
+        f'<div style="height: 1000px; background: hsl({index * 13 % 360}, 60%, 85%)">'
+        f'<h2>Block {index}</h2><p>{PARAGRAPH}</p></div>' for index in range(24)
+    )
+    return PAGE.format(title="Tall", style="", body=blocks)
+
+
+def _spa_page():
+    script = """
+<div id="app">Loading...</div>
+<script>
+function load(delay) {
+    return fetch('/api/items?delay=' + delay).then(function (response) { return response.json(); });
+}
+load(600).then(function (first) {
+    return load(400).then(function (second) { return first.concat(second); });
+}).then(function (items) {
+    document.getElementById('app').innerHTML = items.map(function (item) {
+        return '<article><h3>' + item.title + '</h3><p>' + item.text + '</p></article>';
+    }).join('');
+});
+</script>"""
+    return PAGE.format(title="SPA", style="article { border-bottom: 1px solid #ccc; }", body=script)
+
+
+def _fonts_page():
+    faces = "".join(
+        f"@font-face {{ font-family: 'Fixture{index}'; src: url('/font/{index}.woff2?delay=300') format('woff2'); }}"
+        f" .f{index} {{ font-family: 'Fixture{index}', serif; }}"
+        for index in range(6)
+    )
+    body = "".join(f'<p class="f{index}">{PARAGRAPH}</p>' for index in range(6))
+    return PAGE.format(title="Fonts", style=faces, body=body)
+
+
+# Fixture name -> page builder
+FIXTURES = {
+    'static': _static_page,
+    'images': _images_page,
+    'tall': _tall_page,
+    'spa': _spa_page,
+    'fonts': _fonts_page,
+}
+
+
+def solid_png(width, height, color):
+    """Encode a solid RGB image as PNG without PIL"""
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+    row = b"\x00" + bytes(color) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    """Serve fixture pages plus the images, fonts and API responses they load"""
+
+    def do_GET(self):
+        path = urlparse(self.path)
+        query = parse_qs(path.query)
+        delay = int(query.get('delay', ['0'])[0])
+        if delay:
+            time.sleep(delay / 1000.0)
+
+        parts = [part for part in path.path.split('/') if part]
+        if len(parts) == 1 and parts[0] in FIXTURES:
+            return self._send(FIXTURES[parts[0]]().encode(), 'text/html; charset=utf-8')
+        if len(parts) == 2 and parts[0] == 'image':
+            index = int(parts[1].split('.')[0])
+            color = (index * 37 % 256, index * 73 % 256, index * 151 % 256)
+            return self._send(solid_png(200, 150, color), 'image/png')
+        if len(parts) == 2 and parts[0] == 'font':
+            # Not a real font: the browser still waits for it, then falls back
+            return self._send(os.urandom(40000), 'font/woff2')
+        if parts == ['api', 'items']:
+            items = [{'title': f"Item {index}", 'text': PARAGRAPH} for index in range(20)]
+            return self._send(json.dumps(items).encode(), 'application/json')
+        self.send_error(404)
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        # Every capture should do the full amount of work
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """Run the fixture pages on an ephemeral port in a background thread"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), FixtureRequestHandler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    def url(self, fixture):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/{fixture}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def python_peak_rss():
+    """Peak RSS of this Python process in bytes, or None if unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RSSSampler:
+    """Track the peak combined RSS of child processes (chromedriver and Chrome)"""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        rss = process_tree_rss(os.getpid(), include_root=False)
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def percentile(values, p):
+    """Linearly interpolated percentile of a list of numbers"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * p / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(results, elapsed):
+    """Latency, throughput and size statistics for a list of CaptureResults"""
+    ok = [result for result in results if result.ok]
+    latencies = [result.total_seconds for result in ok]
+    phases = {}
+    for result in ok:
+        for name, seconds in result.phases.items():
+            if name != 'driver_init':
+                phases.setdefault(name, []).append(seconds)
+    return {
+        'captures': len(results),
+        'ok': len(ok),
+        'errors': sorted({result.error_type for result in results if not result.ok}),
+        'seconds': round(elapsed, 3),
+        'pages_per_sec': round(len(ok) / elapsed, 3) if elapsed > 0 else None,
+        'latency': {
+            name: round(percentile(latencies, p), 4) if latencies else None
+            for name, p in (('p50', 50), ('p95', 95), ('p99', 99))
+        },
+        'latency_mean': round(sum(latencies) / len(latencies), 4) if latencies else None,
+        'phases_p50': {name: round(percentile(values, 50), 4) for name, values in phases.items()},
+        'output_bytes': sum(result.bytes or 0 for result in ok),
+    }
+
+
+def _output_path(output_dir, mode, fixture, index, output_format):
+    return os.path.join(output_dir, f"{mode}-{fixture}-{index}.{output_format}")
+
+
+def run_single(urls, iterations, output_dir, output_format, capture_options):
+    """One warm WebPageCapture, one page at a time"""
+    from screenshot import WebPageCapture
+
+    capture = WebPageCapture(**capture_options)
+    try:
+        # Warm up so driver start-up isn't counted against the first fixture
+        capture.capture_result(urls[0][1], output_format, _output_path(output_dir, 'single', 'warmup', 0, output_format))
+        for fixture, url in urls:
+            started = time.monotonic()
+            results = [
+                capture.capture_result(url, output_format, _output_path(output_dir, 'single', fixture, index, output_format))
+                for index in range(iterations)
+            ]
+            yield fixture, results, time.monotonic() - started
+    finally:
+        capture.close()
+
+
+def run_pool(urls, iterations, output_dir, output_format, capture_options, workers):
+    """CapturePool with one Chrome per worker thread"""
+    from batch import CaptureJob, CapturePool
+
+    with CapturePool(workers=workers, **capture_options) as pool:
+        warmup = [
+            pool.submit(CaptureJob(urls[0][1], output_format=output_format,
+                                   output_path=_output_path(output_dir, 'pool', 'warmup', index, output_format)))
+            for index in range(workers)
+        ]
+        for job in warmup:
+            job.wait()
+        for fixture, url in urls:
+            started = time.monotonic()
+            jobs = [
+                pool.submit(CaptureJob(url, output_format=output_format,
+                                       output_path=_output_path(output_dir, 'pool', fixture, index, output_format)))
+                for index in range(iterations)
+            ]
+            for job in jobs:
+                job.wait()
+            yield fixture, [_job_result(job) for job in jobs], time.monotonic() - started
+
+
+def _job_result(job):
+    """A pool job's CaptureResult; jobs that raised before producing one count as failures"""
+    if job.details is not None:
+        return job.details
+    from metrics import CaptureResult
+
+    result = CaptureResult(job.url)
+    result.fail(job.error or "No result", 'CaptureFailed')
+    return result
+
+
+def run_tabs(urls, iterations, output_dir, output_format, capture_options, tabs):
+    """AsyncWebPageCapture with concurrent tabs of one Chrome"""
+    from async_capture import AsyncWebPageCapture
+
+    async def run():
+        measured = []
+        async with AsyncWebPageCapture(concurrency=tabs, **capture_options) as capture:
+            await capture.capture_result(urls[0][1], output_format,
+                                         _output_path(output_dir, 'tabs', 'warmup', 0, output_format))
+            for fixture, url in urls:
+                started = time.monotonic()
+                results = await asyncio.gather(*(
+                    capture.capture_result(url, output_format,
+                                           _output_path(output_dir, 'tabs', fixture, index, output_format))
+                    for index in range(iterations)
+                ))
+                measured.append((fixture, list(results), time.monotonic() - started))
+        return measured
+
+    # Yielded lazily like the other modes, so Chrome starts inside the RSS sampler
+    yield from asyncio.run(run())
+
+
+def run_benchmark(modes, fixtures, iterations=5, output_format='png', workers=2, tabs=4,
+                  keep_output=None, **capture_options):
+    """
+    Capture every fixture in every mode and collect statistics
+
+    Args:
+        modes (list): Any of MODES
+        fixtures (list): Names of FIXTURES to capture
+        iterations (int): Captures per fixture and mode
+        output_format (str): Output format for every capture
+        workers (int): Pool size for the 'pool' mode
+        tabs (int): Concurrent tabs for the 'tabs' mode
+        keep_output (str): Keep the captured files in this directory
+        **capture_options: Keyword arguments for the capture engines
+
+    Returns:
+        dict: JSON-serializable benchmark report
+    """
+    output_dir = keep_output or tempfile.mkdtemp(prefix="webcapture-bench-")
+    os.makedirs(output_dir, exist_ok=True)
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': _environment(),
+        'config': {
+            'modes': modes, 'fixtures': fixtures, 'iterations': iterations,
+            'format': output_format, 'workers': workers, 'tabs': tabs,
+        },
+        'modes': {},
+    }
+
+    try:
+        with FixtureServer() as server:
+            urls = [(fixture, server.url(fixture)) for fixture in fixtures]
+            for mode in modes:
+                print(f"Benchmarking {mode}...")
+                if mode == 'single':
+                    runs = run_single(urls, iterations, output_dir, output_format, capture_options)
+                elif mode == 'pool':
+                    runs = run_pool(urls, iterations, output_dir, output_format, capture_options, workers)
+                else:
+                    runs = run_tabs(urls, iterations, output_dir, output_format, capture_options, tabs)
+
+                mode_report = {'fixtures': {}}
+                everything = []
+                total_elapsed = 0.0
+                with RSSSampler() as sampler:
+                    for fixture, results, elapsed in runs:
+                        stats = summarize(results, elapsed)
+                        mode_report['fixtures'][fixture] = stats
+                        everything += results
+                        total_elapsed += elapsed
+                        print(f"  {fixture:<8} p50 {_ms(stats['latency']['p50'])}  "
+                              f"p95 {_ms(stats['latency']['p95'])}  {stats['pages_per_sec']} pages/sec  "
+                              f"{stats['ok']}/{stats['captures']} ok")
+                mode_report['overall'] = summarize(everything, total_elapsed)
+                mode_report['peak_rss_browser'] = sampler.peak
+                report['modes'][mode] = mode_report
+    finally:
+        if not keep_output:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    # Measured once at the end: ru_maxrss only ever grows
+    report['peak_rss_python'] = python_peak_rss()
+    return report
+
+
+def compare(old, new):
+    """Print the relative change of the headline numbers between two reports"""
+    print(f"{'mode':<8} {'fixture':<8} {'metric':<14} {'before':>10} {'after':>10} {'change':>8}")
+    for mode, mode_report in new['modes'].items():
+        before_mode = old.get('modes', {}).get(mode)
+        if not before_mode:
+            continue
+        sections = dict(mode_report['fixtures'], overall=mode_report['overall'])
+        for fixture, stats in sections.items():
+            before = before_mode['fixtures'].get(fixture) if fixture != 'overall' else before_mode.get('overall')
+            if not before:
+                continue
+            rows = [
+                ('p50', before['latency']['p50'], stats['latency']['p50']),
+                ('p95', before['latency']['p95'], stats['latency']['p95']),
+                ('p99', before['latency']['p99'], stats['latency']['p99']),
+                ('pages/sec', before['pages_per_sec'], stats['pages_per_sec']),
+                ('output_bytes', before['output_bytes'], stats['output_bytes']),
+            ]
+            for metric, a, b in rows:
+                change = f"{(b - a) / a:+.1%}" if a and b is not None else "n/a"
+                print(f"{mode:<8} {fixture:<8} {metric:<14} {_format(a):>10} {_format(b):>10} {change:>8}")
+        for key in ('peak_rss_browser',):
+            a, b = before_mode.get(key), mode_report.get(key)
+            change = f"{(b - a) / a:+.1%}" if a and b is not None else "n/a"
+            print(f"{mode:<8} {'':<8} {'rss_browser_mb':<14} {_format(a and a / 1e6):>10} "
+                  f"{_format(b and b / 1e6):>10} {change:>8}")
+
+
+def import_time(argv=('--version',), runs=5):
+    """
+    Measure the module import cost of running main.py with argv
+
+    Every run is a fresh interpreter under `-X importtime`; the report is the
+    median over the runs, so one slow run (a cold disk cache) doesn't fail
+    the check on its own.
+
+    Returns:
+        dict: import_ms (summed top-level cumulative import time), wall_ms,
+            heavy (HEAVY_MODULES that were imported) and slowest (top-level
+            imports by cumulative milliseconds)
+
+    Raises:
+        RuntimeError: If main.py exits with an error, since its imports
+            would then stop early and look cheap
+    """
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    import_totals = []
+    wall_totals = []
+    heavy = set()
+    slowest = {}
+    for _ in range(runs):
+        started = time.monotonic()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', main_path] + list(argv),
+            capture_output=True, text=True
+        )
+        wall_totals.append((time.monotonic() - started) * 1000)
+        if process.returncode != 0:
+            errors = [line for line in process.stderr.splitlines() if not line.startswith('import time:')]
+            raise RuntimeError(f"main.py {' '.join(argv)} exited with status {process.returncode}:\n"
+                               + "\n".join(errors[-20:]))
+
+        total = 0
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            package = name.strip().split('.')[0]
+            if package in HEAVY_MODULES:
+                heavy.add(package)
+            # Nested imports are indented and already counted by their parent
+            if name.startswith('  '):
+                continue
+            total += int(cumulative)
+            slowest[name.strip()] = max(slowest.get(name.strip(), 0), int(cumulative) / 1000.0)
+        import_totals.append(total / 1000.0)
+
+    return {
+        'argv': list(argv),
+        'runs': runs,
+        'import_ms': round(percentile(import_totals, 50), 1),
+        'wall_ms': round(percentile(wall_totals, 50), 1),
+        'heavy': sorted(heavy),
+        'slowest': [(name, round(ms, 1)) for name, ms in
+                    sorted(slowest.items(), key=lambda item: item[1], reverse=True)[:5]],
+    }
+
+
+def check_import_time(budget_ms=IMPORT_BUDGET_MS, argv=('--version',), runs=5):
+    """Print the startup import cost and return 1 if it is over budget or loads heavy modules"""
+    try:
+        report = import_time(argv, runs)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"main.py {' '.join(report['argv'])}: imports {report['import_ms']:.1f}ms "
+          f"(budget {budget_ms}ms), wall {report['wall_ms']:.1f}ms, median of {report['runs']} runs")
+    for name, ms in report['slowest']:
+        print(f"  {name:<24} {ms:.1f}ms")
+
+    status = 0
+    if report['heavy']:
+        print(f"Error: startup imports {', '.join(report['heavy'])}; import them on the code path that needs them")
+        status = 1
+    if report['import_ms'] > budget_ms:
+        print(f"Error: startup imports take {report['import_ms']:.1f}ms, over the {budget_ms}ms budget")
+        status = 1
+    return status
+
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+    }
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.0f}ms" if seconds is not None else "n/a"
+
+
+def _format(value):
+    if value is None:
+        return "n/a"
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+
+def run_bench_cli():
+    """Run the benchmark, or compare two saved reports"""
+    parser = argparse.ArgumentParser(description='Benchmark webpage captures against local fixture pages')
+    parser.add_argument('--modes', default='single,pool',
+                        help=f"Comma-separated capture modes to run ({', '.join(MODES)})")
+    parser.add_argument('--fixtures', default=','.join(FIXTURES),
+                        help=f"Comma-separated fixtures to capture ({', '.join(FIXTURES)})")
+    parser.add_argument('--iterations', type=int, default=5, help='Captures per fixture and mode')
+    parser.add_argument('--format', choices=['png', 'jpg', 'webp', 'pdf'], default='png', help='Output format')
+    parser.add_argument('--workers', type=int, default=2, help='Workers for the pool mode')
+    parser.add_argument('--tabs', type=int, default=4, help='Concurrent tabs for the tabs mode')
+    parser.add_argument('--timeout', type=int, default=30, help='Page load timeout in seconds')
+    parser.add_argument('--idle-ms', type=int, default=500,
+                        help='Network quiet time (ms) before a page counts as ready')
+    parser.add_argument('--keep-output', metavar='DIR', help='Keep the captured files in DIR')
+    parser.add_argument('--output', metavar='FILE', help='Write the JSON report to FILE')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two JSON reports instead of running')
+    parser.add_argument('--import-time', action='store_true',
+                        help='Check the import time of `main.py --version` instead of running')
+    parser.add_argument('--import-budget-ms', type=float, default=IMPORT_BUDGET_MS,
+                        help=f'Import time budget for --import-time (default {IMPORT_BUDGET_MS}ms)')
+
+    args = parser.parse_args()
+
+    if args.import_time:
+        return check_import_time(args.import_budget_ms, runs=args.iterations)
+
+    if args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path) as f:
+                reports.append(json.load(f))
+        compare(*reports)
+        return 0
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    fixtures = [fixture.strip() for fixture in args.fixtures.split(',') if fixture.strip()]
+    unknown = [name for name in modes if name not in MODES] + [name for name in fixtures if name not in FIXTURES]
+    if unknown:
+        print(f"Unknown mode or fixture: {', '.join(unknown)}")
+        return 1
+
+    report = run_benchmark(
+        modes, fixtures, iterations=args.iterations, output_format=args.format,
+        workers=args.workers, tabs=args.tabs, keep_output=args.keep_output,
+        headless=True, timeout=args.timeout, idle_time=args.idle_ms / 1000.0,
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+        print(f"Report written to {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_bench_cli())
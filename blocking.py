@@ -0,0 +1,212 @@
+import re
+from urllib.parse import urlparse
+
+# Built-in blocklists of URL patterns ('*' matches anything), in the
+# wildcard syntax Network.setBlockedURLs understands
+BLOCKLISTS = {
+    'ads': [
+        '*doubleclick.net/*', '*googlesyndication.com/*', '*googleadservices.com/*',
+        '*adservice.google.com/*', '*amazon-adsystem.com/*', '*adnxs.com/*',
+        '*taboola.com/*', '*outbrain.com/*', '*criteo.com/*', '*criteo.net/*',
+        '*pubmatic.com/*', '*rubiconproject.com/*', '*openx.net/*', '*casalemedia.com/*',
+        '*moatads.com/*', '*adsrvr.org/*',
+        # Anchored: a bare '*media.net/*' would also block e.g. socialmedia.net
+        '*://*.media.net/*', '*://media.net/*',
+    ],
+    'trackers': [
+        '*google-analytics.com/*', '*googletagmanager.com/*', '*connect.facebook.net/*',
+        '*facebook.com/tr*', '*hotjar.com/*', '*segment.io/*', '*cdn.segment.com/*',
+        '*mixpanel.com/*', '*scorecardresearch.com/*', '*quantserve.com/*',
+        '*nr-data.net/*', '*js-agent.newrelic.com/*', '*fullstory.com/*', '*clarity.ms/*',
+        '*bat.bing.com/*', '*analytics.tiktok.com/*', '*snap.licdn.com/*', '*stats.wp.com/*',
+    ],
+}
+
+# Resource types and the URL patterns that approximate them for
+# setBlockedURLs, which can only match on URLs
+RESOURCE_TYPES = {
+    'font': ('Font', ['*.woff', '*.woff?*', '*.woff2', '*.woff2?*', '*.ttf', '*.ttf?*',
+                      '*.otf', '*.otf?*', '*.eot', '*.eot?*', '*fonts.googleapis.com/*',
+                      '*fonts.gstatic.com/*', '*use.typekit.net/*']),
+    'media': ('Media', ['*.mp4', '*.mp4?*', '*.webm', '*.webm?*', '*.m3u8', '*.m3u8?*',
+                        '*.mp3', '*.mp3?*', '*.ogg', '*.ogg?*', '*.mov', '*.mov?*', '*.m4s', '*.m4s?*']),
+    'websocket': ('WebSocket', ['ws://*', 'wss://*']),
+    'image': ('Image', ['*.gif', '*.gif?*', '*.png', '*.png?*', '*.jpg', '*.jpg?*', '*.jpeg',
+                        '*.jpeg?*', '*.webp', '*.webp?*', '*.avif', '*.avif?*', '*.svg', '*.svg?*']),
+}
+
+# Rough typical transfer sizes (bytes) per resource type, used to estimate
+# savings for types no unblocked request has been seen for yet
+TYPICAL_SIZES = {
+    'Script': 25000, 'Image': 15000, 'Font': 30000, 'Media': 250000,
+    'Stylesheet': 10000, 'XHR': 2000, 'Fetch': 2000, 'Document': 20000,
+}
+
+
+def wildcard_regex(pattern):
+    """Compile a '*' wildcard URL pattern the way Chrome matches it"""
+    return re.compile('^' + '.*'.join(re.escape(part) for part in pattern.split('*')) + '$')
+
+
+def host_matches(host, domain):
+    """True if host is domain or one of its subdomains"""
+    domain = domain.lower().lstrip('.')
+    return host == domain or host.endswith('.' + domain)
+
+
+class RequestFilter:
+    """
+    Decide which requests a capture doesn't need
+
+    Rules come from built-in blocklists, resource types and denied domains.
+    Allowed domains are never blocked, whichever rule would match them.
+    """
+
+    def __init__(self, block=(), deny_domains=(), allow_domains=()):
+        """
+        Args:
+            block (list): Names of BLOCKLISTS and/or RESOURCE_TYPES to block
+            deny_domains (list): Domains (and their subdomains) to block
+            allow_domains (list): Domains that are never blocked
+        """
+        unknown = [name for name in block if name not in BLOCKLISTS and name not in RESOURCE_TYPES]
+        if unknown:
+            raise ValueError(f"Unknown block rule(s): {', '.join(unknown)}")
+
+        self.allow_domains = [domain.lower() for domain in allow_domains]
+        self.rules = []
+        for name in block:
+            patterns = BLOCKLISTS[name] if name in BLOCKLISTS else RESOURCE_TYPES[name][1]
+            self.rules.append((name, RESOURCE_TYPES.get(name, (None,))[0], patterns))
+        for domain in deny_domains:
+            domain = domain.lower().lstrip('.')
+            self.rules.append((f"deny:{domain}", None, [f"*://{domain}/*", f"*.{domain}/*"]))
+        self._compiled = [
+            (name, resource_type, [wildcard_regex(pattern) for pattern in patterns])
+            for name, resource_type, patterns in self.rules
+        ]
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def blocked_url_patterns(self):
+        """
+        Patterns for Network.setBlockedURLs
+
+        That command can't express exceptions, so blocklist and domain
+        patterns that would hit an allowed domain are left out. Resource
+        type patterns are kept; only Fetch interception can exempt those.
+        """
+        patterns = []
+        for name, resource_type, rule_patterns in self.rules:
+            for pattern in rule_patterns:
+                if resource_type is None and self._pattern_allowed(pattern):
+                    continue
+                patterns.append(pattern)
+        return patterns
+
+    def match(self, url, resource_type=None):
+        """Name of the rule that blocks url, or None if it may load"""
+        host = (urlparse(url).hostname or '').lower()
+        if any(host_matches(host, domain) for domain in self.allow_domains):
+            return None
+        for name, rule_type, regexes in self._compiled:
+            if rule_type is not None and resource_type == rule_type:
+                return name
+            if any(regex.match(url) for regex in regexes):
+                return name
+        return None
+
+    def _pattern_allowed(self, pattern):
+        host = pattern.split('://')[-1].lstrip('*').lstrip('.').split('/')[0]
+        return any(host_matches(host, domain) or host_matches(domain, host)
+                   for domain in self.allow_domains if host)
+
+
+class BlockingStats:
+    """
+    Count what each rule blocked, from CDP Network events
+
+    Blocked requests never download, so bytes saved are estimated from the
+    average encoded size of requests of the same type that did load, or a
+    typical size for the type when none has.
+    """
+
+    def __init__(self, request_filter, count_blocked_events=True):
+        """
+        Args:
+            request_filter (RequestFilter): Rules used to attribute blocked requests
+            count_blocked_events (bool): Count blocked loadingFailed events;
+                turn off when requests are failed through Fetch and recorded directly
+        """
+        self.request_filter = request_filter
+        self.count_blocked_events = count_blocked_events
+        self.blocked = {}
+        self.page_blocked = {}
+        self._requests = {}
+        self._loaded = {}
+
+    def begin_page(self):
+        """Start counting a new page (totals keep accumulating)"""
+        self.page_blocked = {}
+        self._requests = {}
+
+    def feed(self, method, params, timestamp=None):
+        request_id = params.get('requestId')
+        if method == 'Network.requestWillBeSent':
+            self._requests[request_id] = (params.get('request', {}).get('url', ''), params.get('type'))
+        elif method == 'Network.loadingFinished':
+            url, resource_type = self._requests.pop(request_id, ('', None))
+            count, total = self._loaded.get(resource_type, (0, 0))
+            self._loaded[resource_type] = (count + 1, total + params.get('encodedDataLength', 0))
+        elif method == 'Network.loadingFailed':
+            url, resource_type = self._requests.pop(request_id, ('', params.get('type')))
+            if not self.count_blocked_events or not params.get('blockedReason'):
+                return
+            self.record(self.request_filter.match(url, resource_type) or 'other', resource_type)
+
+    def record(self, rule, resource_type=None):
+        """Count one blocked request against rule"""
+        for counts in (self.blocked, self.page_blocked):
+            entry = counts.setdefault(rule, {'requests': 0, 'types': {}})
+            entry['requests'] += 1
+            entry['types'][resource_type] = entry['types'].get(resource_type, 0) + 1
+
+    def estimated_bytes(self, counts):
+        """Estimated bytes saved for one rule's counts"""
+        saved = 0
+        for resource_type, requests in counts['types'].items():
+            loaded, total = self._loaded.get(resource_type, (0, 0))
+            average = total // loaded if loaded else TYPICAL_SIZES.get(resource_type, 0)
+            saved += requests * average
+        return saved
+
+    def summary(self, page=True):
+        """Per-rule requests and estimated bytes, for the last page or all pages"""
+        counts = self.page_blocked if page else self.blocked
+        return {
+            rule: {'requests': entry['requests'], 'estimated_bytes': self.estimated_bytes(entry)}
+            for rule, entry in sorted(counts.items())
+        }
+
+    def log(self, page=True):
+        summary = self.summary(page)
+        if not summary:
+            return
+        requests = sum(entry['requests'] for entry in summary.values())
+        saved = sum(entry['estimated_bytes'] for entry in summary.values())
+        rules = ", ".join(
+            f"{rule}: {entry['requests']} (~{entry['estimated_bytes'] / 1024:.0f} KB)"
+            for rule, entry in summary.items()
+        )
+        scope = "" if page else " in total"
+        print(f"Blocked {requests} requests{scope}, ~{saved / 1024:.0f} KB saved ({rules})")
+
+
+def filter_from_args(args):
+    """Build a RequestFilter from --block/--deny-domain/--allow-domain, or None"""
+    block = [name.strip() for name in (getattr(args, 'block', None) or '').split(',') if name.strip()]
+    deny = getattr(args, 'deny_domain', None) or []
+    allow = getattr(args, 'allow_domain', None) or []
+    request_filter = RequestFilter(block, deny, allow)
+    return request_filter if request_filter else None
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+from utils import canonical_url, normalize_url, default_output_path, DEFAULT_USER_AGENT
+
+
+class CaptureCache:
+    """
+    Disk-backed, content-addressed cache of capture artifacts
+
+    Entries are keyed by the canonical URL plus every option that changes the
+    output (format, quality, width, height, user agent, PDF options and the
+    URL patterns blocked by a RequestFilter). Entries expire
+    after `ttl` seconds and the least recently used ones are evicted once the
+    cache grows past `max_bytes`. The index is a SQLite database next to the
+    artifacts, so one cache can be shared by all workers of a pool.
+    """
+
+    def __init__(self, directory, ttl=3600, max_bytes=1 << 30, link=False):
+        """
+        Args:
+            directory (str): Where artifacts and the index are stored
+            ttl (float): Seconds an entry stays valid
+            max_bytes (int): Size limit for all cached artifacts
+            link (bool): Hard-link hits into place instead of copying them.
+                Faster, but the output then shares its inode with the cache,
+                so it must not be modified in place.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, url TEXT, file TEXT, size INTEGER, "
+            "created REAL, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._db.commit()
+
+    @staticmethod
+    def key(url, output_format='png', quality=90, width=1920, height=None,
+            user_agent=DEFAULT_USER_AGENT, pdf_options=None, blocked=None):
+        """
+        Cache key for a capture of url with the given options
+
+        Args:
+            blocked (list): URL patterns blocked while capturing, see
+                RequestFilter.blocked_url_patterns()
+        """
+        parts = {
+            'url': canonical_url(url),
+            'format': output_format,
+            'quality': quality if output_format in ('jpg', 'webp') else None,
+            'width': width,
+            'height': height,
+            'user_agent': user_agent,
+        }
+        # Added only when set, so keys of default PDFs stay valid
+        if output_format == 'pdf' and pdf_options:
+            parts['pdf'] = pdf_options
+        if blocked:
+            parts['blocked'] = sorted(blocked)
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def fetch(self, url, output_format='png', output_path=None, quality=90, width=1920,
+              height=None, user_agent=DEFAULT_USER_AGENT, pdf_options=None, blocked=None):
+        """
+        Place a cached capture at output_path if a fresh one exists
+
+        Takes the same options as WebPageCapture.capture(), so callers can
+        check the cache before starting Chrome at all.
+
+        Returns:
+            str: Path of the restored artifact, or None on a miss
+        """
+        if not output_path:
+            url, parsed_url = normalize_url(url)
+            if parsed_url is None:
+                return None
+            output_path = default_output_path(parsed_url, output_format)
+
+        key = self.key(url, output_format, quality, width, height, user_agent, pdf_options, blocked)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file, size, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            cached = self._path(row[0]) if row else None
+            fresh = (
+                row is not None
+                and time.time() - row[2] <= self.ttl
+                and os.path.isfile(cached)
+                and os.path.getsize(cached) == row[1]
+            )
+            if not fresh:
+                if row is not None:
+                    self._remove(key, row[0])
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+
+            # Restore under the lock so the entry can't be evicted mid-copy
+            self._restore(cached, output_path)
+        return output_path
+
+    def store(self, path, url, output_format='png', quality=90, width=1920, height=None,
+              user_agent=DEFAULT_USER_AGENT, pdf_options=None, blocked=None):
+        """Add a finished capture at path to the cache"""
+        key = self.key(url, output_format, quality, width, height, user_agent, pdf_options, blocked)
+        file_name = f"{key}.{output_format}"
+        cached = self._path(file_name)
+
+        # Copy under a temporary name so readers never see a partial file
+        partial = f"{cached}.{threading.get_ident()}.tmp"
+        shutil.copyfile(path, partial)
+        os.replace(partial, cached)
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, url, file, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, canonical_url(url), file_name, os.path.getsize(cached), now, now)
+            )
+            self._db.commit()
+            self._evict()
+
+    def stats(self):
+        """Hit/miss counters and current size, for sizing the cache"""
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        for key, file_name in self._db.execute(
+            "SELECT key, file FROM entries WHERE created < ?", (time.time() - self.ttl,)
+        ).fetchall():
+            self._remove(key, file_name)
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, file_name, size in self._db.execute(
+            "SELECT key, file, size FROM entries ORDER BY accessed"
+        ).fetchall():
+            self._remove(key, file_name)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _remove(self, key, file_name):
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._db.commit()
+        try:
+            os.remove(self._path(file_name))
+        except OSError:
+            pass
+
+    def _restore(self, cached, output_path):
+        """Copy or hard-link a cached artifact to output_path"""
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.link:
+            try:
+                if os.path.lexists(output_path):
+                    os.remove(output_path)
+                os.link(cached, output_path)
+                return
+            except OSError:
+                # Different filesystem or no hard-link support
+                pass
+        shutil.copyfile(cached, output_path)
+
+    def _path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+
+def cache_from_args(args):
+    """Build a CaptureCache from --cache-dir/--cache-ttl/--cache-size, or None"""
+    if not getattr(args, 'cache_dir', None):
+        return None
+    return CaptureCache(args.cache_dir, ttl=args.cache_ttl, max_bytes=args.cache_size * 1024 * 1024)
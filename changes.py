@@ -0,0 +1,135 @@
+import os
+import time
+import sqlite3
+import threading
+
+from cache import CaptureCache
+from utils import DEFAULT_USER_AGENT
+
+# cyrb53 over the serialized DOM: a fast 53-bit hash computed inside the page,
+# so only a short string crosses the DevTools connection
+DOM_FINGERPRINT_SCRIPT = """
+var str = document.documentElement ? document.documentElement.outerHTML : '';
+var h1 = 0xdeadbeef, h2 = 0x41c6ce57;
+for (var i = 0, ch; i < str.length; i++) {
+    ch = str.charCodeAt(i);
+    h1 = Math.imul(h1 ^ ch, 2654435761);
+    h2 = Math.imul(h2 ^ ch, 1597334677);
+}
+h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+return (4294967296 * (2097151 & h2) + (h1 >>> 0)).toString(16) + ':' + str.length;
+"""
+
+
+class DocumentValidators:
+    """Collect HTTP validators of the main document from CDP Network events"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget the previous document, e.g. before a new navigation"""
+        self.etag = None
+        self.last_modified = None
+        self.status = None
+        self.retry_after = None
+        self.seen = False
+
+    def feed(self, method, params, timestamp=None):
+        # The first Document response after navigation is the main frame's
+        # (redirects only surface as requestWillBeSent.redirectResponse)
+        if self.seen or method != 'Network.responseReceived' or params.get('type') != 'Document':
+            return
+        response = params.get('response', {})
+        headers = {key.lower(): value for key, value in response.get('headers', {}).items()}
+        self.etag = headers.get('etag')
+        self.last_modified = headers.get('last-modified')
+        self.status = response.get('status')
+        self.retry_after = headers.get('retry-after')
+        self.seen = True
+
+
+class ChangeTracker:
+    """
+    Remember what each URL looked like at its last capture
+
+    For every URL and output format the tracker stores the ETag and
+    Last-Modified headers of the main document, a fingerprint of the
+    rendered DOM, and the artifact that was written. A later capture can
+    then skip rasterization and PDF generation when nothing has changed.
+    State is kept in SQLite, so recording a capture writes one row rather
+    than the whole state, and the workers and processes of a batch run
+    can share one file like they share a ProgressStore.
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.skipped = 0
+        self.changed = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(state_path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, dom_hash TEXT, path TEXT, "
+            "captured_at REAL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(url, output_format='png', quality=90, width=1920, height=None,
+            user_agent=DEFAULT_USER_AGENT, pdf_options=None, blocked=None):
+        """
+        Key of a capture of url with the given options
+
+        Built from the same options as CaptureCache.key(), so a page is only
+        judged unchanged against a capture that was made the same way.
+        """
+        return CaptureCache.key(url, output_format, quality, width, height, user_agent, pdf_options, blocked)
+
+    def unchanged(self, key, validators, dom_hash):
+        """
+        Return the previous artifact if the page is unchanged since it was written
+
+        Validators the server doesn't send are compared as absent, so pages
+        without ETag/Last-Modified are judged on the DOM fingerprint alone.
+
+        Args:
+            key (str): The capture's key()
+            validators (DocumentValidators): Of the freshly loaded document
+            dom_hash (str): DOM fingerprint of the freshly loaded document
+
+        Returns:
+            str: Path of the previous artifact, or None if a capture is needed
+        """
+        with self._lock:
+            previous = self._db.execute(
+                "SELECT etag, last_modified, dom_hash, path FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+            same = (
+                previous is not None
+                and previous[2] == dom_hash
+                and previous[0] == validators.etag
+                and previous[1] == validators.last_modified
+                and os.path.isfile(previous[3] or '')
+            )
+            if same:
+                self.skipped += 1
+                return previous[3]
+            self.changed += 1
+            return None
+
+    def record(self, key, validators, dom_hash, path):
+        """Store the state of a fresh capture"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (key, validators.etag, validators.last_modified,
+                 dom_hash, os.path.abspath(path), time.time())
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,78 @@
+class ElementNotFound(Exception):
+    """No element matches the selector of a capture"""
+
+
+def parse_clip(spec):
+    """
+    Parse a page region into a Page.captureScreenshot clip
+
+    Args:
+        spec: 'x,y,width,height' in CSS pixels from the top left of the
+            page, a list of those four numbers, or a dict with x, y, width
+            and height keys
+
+    Returns:
+        dict: Clip with x, y, width, height and scale 1
+    """
+    if isinstance(spec, dict):
+        values = [spec.get(key) for key in ('x', 'y', 'width', 'height')]
+    elif isinstance(spec, str):
+        values = spec.split(',')
+    else:
+        values = list(spec)
+    try:
+        x, y, width, height = (float(value) for value in values)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid clip: {spec}")
+    if x < 0 or y < 0 or width <= 0 or height <= 0:
+        raise ValueError(f"Invalid clip: {spec}")
+    return {'x': x, 'y': y, 'width': width, 'height': height, 'scale': 1}
+
+
+def element_clip(execute_cdp_cmd, selector, padding=0):
+    """
+    Scroll the first element matching a CSS selector into view and return its clip
+
+    The element's border box comes from DOM.getBoxModel in viewport
+    coordinates and is shifted by the layout viewport's scroll offset, since
+    clips are relative to the page.
+
+    Args:
+        execute_cdp_cmd (callable): Runs a CDP command, e.g. driver.execute_cdp_cmd
+        selector (str): CSS selector
+        padding (int): CSS pixels of surrounding page to include on every side
+
+    Returns:
+        dict: Clip for Page.captureScreenshot
+
+    Raises:
+        ElementNotFound: If nothing matches or the element isn't rendered
+    """
+    root = execute_cdp_cmd("DOM.getDocument", {"depth": 0})['root']['nodeId']
+    node = execute_cdp_cmd("DOM.querySelector", {"nodeId": root, "selector": selector}).get('nodeId')
+    if not node:
+        raise ElementNotFound(f"No element matches {selector}")
+    try:
+        execute_cdp_cmd("DOM.scrollIntoViewIfNeeded", {"nodeId": node})
+        quad = execute_cdp_cmd("DOM.getBoxModel", {"nodeId": node})['model']['border']
+    except Exception as e:
+        # getBoxModel fails for elements without layout (display: none)
+        raise ElementNotFound(f"{selector} is not rendered: {e}")
+
+    xs, ys = quad[0::2], quad[1::2]
+    width, height = max(xs) - min(xs), max(ys) - min(ys)
+    if width <= 0 or height <= 0:
+        raise ElementNotFound(f"{selector} has no size")
+
+    viewport = execute_cdp_cmd("Page.getLayoutMetrics", {})
+    viewport = viewport.get('cssLayoutViewport') or viewport['layoutViewport']
+    left = min(xs) + viewport['pageX'] - padding
+    top = min(ys) + viewport['pageY'] - padding
+    x, y = max(0.0, left), max(0.0, top)
+    return {
+        'x': x,
+        'y': y,
+        'width': left + width + 2 * padding - x,
+        'height': top + height + 2 * padding - y,
+        'scale': 1,
+    }
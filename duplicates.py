@@ -0,0 +1,199 @@
+import os
+import time
+import sqlite3
+import threading
+
+# dHash grid: HASH_SIZE x HASH_SIZE brightness gradients, 64 bits
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+# The hash is split into BANDS equal bands, each indexed in SQLite. Two
+# hashes within BANDS - 1 bits of each other agree on at least one band, so
+# lookups up to that distance never miss a match.
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+BAND_COLUMNS = [f"band{band}" for band in range(BANDS)]
+
+# Default Hamming distance at which two captures count as the same page
+MAX_DISTANCE = 3
+
+
+def dhash(path, size=HASH_SIZE):
+    """
+    Difference hash of an image
+
+    The image is reduced to a (size + 1) x size grayscale grid and each bit
+    records whether a cell is brighter than its right neighbour. Re-encoding,
+    small shifts and scaling barely change it, so pages that render the same
+    (parked domains, error pages, login walls) get hashes a few bits apart.
+
+    Returns:
+        int: A size * size bit hash
+    """
+    from PIL import Image
+
+    with Image.open(path) as image:
+        # Lets JPEG decode at a fraction of full size; a no-op for other formats
+        image.draft('L', ((size + 1) * 4, size * 4))
+        pixels = image.convert('L').resize((size + 1, size), Image.BOX).tobytes()
+
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for column in range(size):
+            value = value << 1 | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def image_size(path):
+    """(width, height) of an image, read from its header"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return image.size
+
+
+def hamming(a, b):
+    """Number of bits in which two hashes differ"""
+    return bin(a ^ b).count('1')
+
+
+def _bands(value):
+    return [(value >> (band * BAND_BITS)) & BAND_MASK for band in range(BANDS)]
+
+
+def _signed(value):
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class DuplicateIndex:
+    """
+    SQLite index of capture hashes for near-duplicate lookups
+
+    Every capture's dHash is stored with its URL, path and dimensions.
+    Only captures of the same size count as duplicates: a dHash squeezes a
+    whole page into 64 bits, and pages that really render the same also
+    have the same height. Lookups fetch
+    the captures that share a band with the hash through the band indexes
+    and check their Hamming distance, so the cost depends on the number of
+    near matches rather than the size of the index. Like ProgressStore, one
+    file can be shared by the workers and processes of a batch run.
+    """
+
+    def __init__(self, path, max_distance=MAX_DISTANCE, drop=False):
+        """
+        Args:
+            path (str): SQLite database file, created if missing
+            max_distance (int): Hamming distance at which captures count as
+                duplicates; values of BANDS or more may miss some matches
+            drop (bool): Replace duplicate captures with a copy of the
+                earlier capture and leave them out of the index
+        """
+        self.path = path
+        self.max_distance = max_distance
+        self.drop = drop
+        self.duplicates = 0
+        self.unique = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        bands = ", ".join(f"{column} INTEGER" for column in BAND_COLUMNS)
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS captures ("
+            f"id INTEGER PRIMARY KEY, hash INTEGER, url TEXT, path TEXT UNIQUE, width INTEGER, height INTEGER, "
+            f"created REAL, {bands})"
+        )
+        for column in BAND_COLUMNS:
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS captures_{column} ON captures ({column})")
+        self._db.commit()
+
+    def find(self, value, max_distance=None, size=None):
+        """
+        Captures whose hash is within max_distance of value
+
+        Args:
+            size (tuple): Only return captures of this (width, height)
+
+        Returns:
+            list: (distance, url, path) tuples, closest first
+        """
+        with self._lock:
+            return self._find(value, self.max_distance if max_distance is None else max_distance, size)
+
+    def _find(self, value, max_distance, size):
+        where = " OR ".join(f"{column} = ?" for column in BAND_COLUMNS)
+        rows = self._db.execute(
+            f"SELECT hash, url, path, width, height FROM captures WHERE {where}", _bands(value)
+        ).fetchall()
+        matches = []
+        for stored, url, path, width, height in rows:
+            if size is not None and (width, height) != tuple(size):
+                continue
+            distance = hamming(value, _unsigned(stored))
+            if distance <= max_distance:
+                matches.append((distance, url, path))
+        return sorted(matches)
+
+    def add(self, value, url, path, size=(None, None)):
+        """Record a capture's hash, replacing an earlier capture written to the same path"""
+        with self._lock:
+            self._add(value, url, path, size)
+            self._db.commit()
+
+    def _add(self, value, url, path, size):
+        columns = ['hash', 'url', 'width', 'height', 'created'] + BAND_COLUMNS
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns)
+        self._db.execute(
+            f"INSERT INTO captures (path, {', '.join(columns)}) "
+            f"VALUES (?{', ?' * len(columns)}) ON CONFLICT(path) DO UPDATE SET {updates}",
+            [path, _signed(value), url, size[0], size[1], time.time()] + _bands(value)
+        )
+
+    def check(self, url, path):
+        """
+        Hash a capture, look up its closest earlier near-duplicate and index it
+
+        With `drop`, a duplicate whose match still exists on disk isn't
+        indexed; the caller replaces it with a copy of the match. The lookup
+        and the insert are one write transaction, so two workers capturing
+        the same page at once can't both miss each other.
+
+        Returns:
+            tuple: (hash, (distance, url, path) of the closest match or None)
+        """
+        value = dhash(path)
+        size = image_size(path)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                matches = [match for match in self._find(value, self.max_distance, size) if match[2] != path]
+                if not (matches and self.drop and os.path.isfile(matches[0][2])):
+                    self._add(value, url, path, size)
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+            if matches:
+                self.duplicates += 1
+            else:
+                self.unique += 1
+        return value, matches[0] if matches else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def duplicates_from_args(args):
+    """Build a DuplicateIndex from --dedupe-index/--dedupe-distance/--drop-duplicates, or None"""
+    if not getattr(args, 'dedupe_index', None):
+        return None
+    max_distance = getattr(args, 'dedupe_distance', None)
+    return DuplicateIndex(args.dedupe_index, MAX_DISTANCE if max_distance is None else max_distance,
+                          drop=getattr(args, 'drop_duplicates', False))
@@ -0,0 +1,158 @@
+import random
+
+# Failure classes (CaptureResult.error_type) recognised in error messages,
+# checked in order: Chrome's net:: error codes, then ChromeDriver's wording
+# for a crashed tab or a dead browser
+MESSAGE_CLASSES = (
+    ('DNS', ('ERR_NAME_NOT_RESOLVED', 'ERR_NAME_RESOLUTION_FAILED')),
+    ('TLS', ('ERR_CERT_', 'ERR_SSL_', 'ERR_BAD_SSL_')),
+    ('Network', ('ERR_CONNECTION_', 'ERR_INTERNET_DISCONNECTED', 'ERR_NETWORK_CHANGED', 'ERR_ADDRESS_UNREACHABLE',
+                 'ERR_TIMED_OUT', 'ERR_EMPTY_RESPONSE', 'ERR_PROXY_', 'ERR_TUNNEL_CONNECTION_FAILED')),
+    ('RendererCrash', ('tab crashed', 'page crash', 'target crashed', 'Target closed')),
+    ('DriverCrash', ('invalid session id', 'chrome not reachable', 'disconnected', 'no such window',
+                     'session deleted', 'Connection refused', 'Max retries exceeded',
+                     'Browser connection closed')),
+    ('Timeout', ('Timed out receiving message', 'timeout:')),
+)
+
+# Exception class names that are a failure class on their own
+EXCEPTION_CLASSES = {
+    'TimeoutException': 'Timeout',
+    'TimeoutError': 'Timeout',
+    'InvalidArgumentException': 'InvalidURL',
+}
+
+# Classes worth another attempt: transient network trouble, overloaded
+# servers and broken browsers (which are replaced first). DNS, TLS and
+# client errors fail the same way every time.
+RETRYABLE = (
+    'Timeout', 'Network', 'Throttled', 'ServerError', 'RendererCrash', 'DriverCrash',
+    'DriverNotInitialized', 'WebDriverError', 'DevToolsError',
+)
+
+# Classes after which the browser is replaced before retrying
+DRIVER_FAILURES = ('RendererCrash', 'DriverCrash', 'DriverNotInitialized')
+
+# Main document statuses that are retried even though the page rendered
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def classify(error, default=None):
+    """
+    Failure class of an exception raised while capturing
+
+    Args:
+        error (Exception): The exception
+        default (str): Class for unrecognised errors, defaults to the
+            exception's class name
+
+    Returns:
+        str: E.g. 'DNS', 'TLS', 'Network', 'Timeout', 'RendererCrash' or 'DriverCrash'
+    """
+    message = getattr(error, 'msg', None) or str(error)
+    for failure, needles in MESSAGE_CLASSES:
+        if any(needle in message for needle in needles):
+            return failure
+    for cls in type(error).__mro__:
+        if cls.__name__ in EXCEPTION_CLASSES:
+            return EXCEPTION_CLASSES[cls.__name__]
+    return default or type(error).__name__
+
+
+def classify_status(status):
+    """Failure class of a main document HTTP status, or None if it succeeded"""
+    if not status or status < 400:
+        return None
+    if status in (429, 503):
+        return 'Throttled'
+    return 'ServerError' if status >= 500 else 'HTTPError'
+
+
+def storable(status, retry=None):
+    """
+    Whether a page captured with this main document status may be cached
+
+    Error pages must not be stored in the capture cache, the change tracker
+    or the visual diff baselines: the next attempt (or the next run) would
+    be served the error page instead of loading the URL again.
+
+    Args:
+        status (int): Main document HTTP status, None if unknown
+        retry (RetryPolicy): Its retry_statuses are never stored either
+    """
+    if classify_status(status):
+        return False
+    return not (retry and status in retry.retry_statuses)
+
+
+class RetryPolicy:
+    """
+    When and how soon to retry a failed capture
+
+    Delays grow exponentially from `backoff` up to `max_backoff` with full
+    jitter (a uniformly random fraction of the step), so workers that failed
+    together don't retry in lockstep.
+    """
+
+    def __init__(self, attempts=3, backoff=1.0, max_backoff=30.0, retry_on=RETRYABLE,
+                 retry_statuses=RETRY_STATUSES):
+        """
+        Args:
+            attempts (int): Total attempts per capture, 1 to never retry
+            backoff (float): Base delay in seconds before the first retry
+            max_backoff (float): Upper bound for any delay
+            retry_on (iterable): Failure classes to retry
+            retry_statuses (iterable): Main document statuses to retry even
+                though the page was captured
+        """
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_on = set(retry_on)
+        self.retry_statuses = set(retry_statuses)
+
+    def failure(self, results, attempt):
+        """
+        The failure class that warrants another attempt, or None
+
+        Args:
+            results (list): Finished CaptureResults of the attempt
+            attempt (int): Number of the attempt, from 1
+        """
+        if attempt >= self.attempts or any(result.deferred for result in results):
+            return None
+        for result in results:
+            if not result.ok:
+                failure = result.error_type
+            elif result.source == 'capture' and result.http_status in self.retry_statuses:
+                failure = classify_status(result.http_status)
+            else:
+                continue
+            if failure in self.retry_on:
+                return failure
+        return None
+
+    def without(self, *failures):
+        """Copy of this policy that leaves the given failure classes to the caller"""
+        return RetryPolicy(self.attempts, self.backoff, self.max_backoff, self.retry_on - set(failures),
+                           self.retry_statuses)
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait after the given attempt, at least Retry-After if the server sent one"""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+        try:
+            delay = max(delay, min(self.max_backoff, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+        return delay
+
+
+def retry_from_args(args):
+    """Build a RetryPolicy from --retries/--retry-backoff/--retry-on, or None"""
+    retries = getattr(args, 'retries', None)
+    if not retries:
+        return None
+    retry_on = RETRYABLE
+    if getattr(args, 'retry_on', None):
+        retry_on = [name.strip() for name in args.retry_on.split(',') if name.strip()]
+    return RetryPolicy(attempts=retries + 1, backoff=args.retry_backoff, retry_on=retry_on)
@@ -1,19 +1,46 @@
 import os
+import queue
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
 import threading
 import platform
 from urllib.parse import urlparse
 
-# Import the WebPageCapture class from your existing script
-from screenshot import WebPageCapture
+from batch import CaptureJob, CapturePool
+from utils import normalize_url, default_output_path
+
+# Browsers kept warm for the queue; each runs one capture at a time
+WORKERS = 2
+
+# Capture phases as shown in the queue's progress column
+PHASE_LABELS = {
+    'driver_init': "Starting Chrome",
+    'cache': "Checking cache",
+    'reset': "Loading",
+    'navigate': "Loading",
+    'wait': "Waiting for page",
+    'fingerprint': "Waiting for page",
+    'resize': "Rendering",
+    'settle': "Rendering",
+    'screenshot': "Rendering",
+    'pdf': "Rendering",
+    'decode': "Saving",
+    'encode': "Saving",
+    'write': "Saving",
+    'dedupe': "Comparing",
+    'diff': "Comparing",
+    'retry': "Retrying",
+}
+
+# Milliseconds between checks for worker events
+POLL_INTERVAL = 100
 
 class WebCaptureGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Web Page Capture Tool")
-        self.root.geometry("650x450")
-        self.root.minsize(600, 400)
+        self.root.geometry("760x640")
+        self.root.minsize(640, 520)
         
         # Set app icon (if available)
         try:
@@ -50,24 +77,32 @@ class WebCaptureGUI:
         )
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
         
-        # Progress bar
+        # Progress bar (finished jobs out of all queued since the last clear)
         self.progress = ttk.Progressbar(
-            root, orient=tk.HORIZONTAL, length=100, mode='indeterminate'
+            root, orient=tk.HORIZONTAL, length=100, mode='determinate'
         )
         self.progress.pack(side=tk.BOTTOM, fill=tk.X, padx=20, pady=5)
         
-        # Capture instance
-        self.capture = None
+        # Capture pool for the current timeout, started on first use and kept
+        # warm; workers report through self.events, drained on the Tk thread
+        self.pool = None
+        self.pool_timeout = None
+        self.retiring = []
+        self.jobs = {}
+        self.rows = {}
+        self.next_id = 1
+        self.events = queue.Queue()
+        self.root.after(POLL_INTERVAL, self._poll_events)
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
         
     def _create_form(self):
         """Create the input form elements"""
-        # URL input
-        ttk.Label(self.main_frame, text="Website URL:").grid(
-            column=0, row=1, sticky=tk.W
+        # URL input, one per line
+        ttk.Label(self.main_frame, text="Website URLs:").grid(
+            column=0, row=1, sticky=(tk.W, tk.N)
         )
-        self.url_var = tk.StringVar()
-        self.url_entry = ttk.Entry(self.main_frame, width=50, textvariable=self.url_var)
-        self.url_entry.grid(column=1, row=1, sticky=(tk.W, tk.E), padx=5, pady=5, columnspan=2)
+        self.url_text = tk.Text(self.main_frame, width=50, height=3, font=("Helvetica", 11))
+        self.url_text.grid(column=1, row=1, sticky=(tk.W, tk.E), padx=5, pady=5, columnspan=2)
         
         # Format selection
         ttk.Label(self.main_frame, text="Output Format:").grid(
@@ -88,13 +123,18 @@ class WebCaptureGUI:
             command=self._toggle_quality_visibility
         ).pack(side=tk.LEFT, padx=5)
         
+        ttk.Radiobutton(
+            format_frame, text="WebP", variable=self.format_var, value="webp",
+            command=self._toggle_quality_visibility
+        ).pack(side=tk.LEFT, padx=5)
+        
         ttk.Radiobutton(
             format_frame, text="PDF", variable=self.format_var, value="pdf",
             command=self._toggle_quality_visibility
         ).pack(side=tk.LEFT, padx=5)
         
-        # Quality slider for JPG
-        self.quality_label = ttk.Label(self.main_frame, text="JPEG Quality:")
+        # Quality slider for JPG and WebP
+        self.quality_label = ttk.Label(self.main_frame, text="Image Quality:")
         self.quality_label.grid(column=0, row=3, sticky=tk.W)
         
         quality_frame = ttk.Frame(self.main_frame)
@@ -165,16 +205,46 @@ class WebCaptureGUI:
         
         # Capture button
         self.capture_button = ttk.Button(
-            self.main_frame, text="Capture Webpage", command=self._start_capture
+            self.main_frame, text="Add to Queue", command=self._start_capture
+        )
+        self.capture_button.grid(column=0, row=7, columnspan=3, pady=10)
+        
+        # Job queue
+        queue_frame = ttk.Frame(self.main_frame)
+        queue_frame.grid(column=0, row=8, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
+        self.queue_view = ttk.Treeview(
+            queue_frame, columns=("url", "format", "status", "progress"),
+            show="headings", height=6
         )
-        self.capture_button.grid(column=0, row=7, columnspan=3, pady=20)
+        for column, heading, width in (("url", "URL", 260), ("format", "Format", 60),
+                                       ("status", "Status", 80), ("progress", "Progress", 240)):
+            self.queue_view.heading(column, text=heading)
+            self.queue_view.column(column, width=width, stretch=column in ("url", "progress"))
+        scrollbar = ttk.Scrollbar(queue_frame, orient=tk.VERTICAL, command=self.queue_view.yview)
+        self.queue_view.configure(yscrollcommand=scrollbar.set)
+        self.queue_view.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        queue_buttons = ttk.Frame(self.main_frame)
+        queue_buttons.grid(column=0, row=9, columnspan=3, sticky=tk.E, pady=(5, 0))
+        ttk.Button(
+            queue_buttons, text="Cancel Selected", command=self._cancel_selected
+        ).pack(side=tk.LEFT, padx=5)
+        ttk.Button(
+            queue_buttons, text="Cancel All", command=self._cancel_all
+        ).pack(side=tk.LEFT, padx=5)
+        ttk.Button(
+            queue_buttons, text="Clear Finished", command=self._clear_finished
+        ).pack(side=tk.LEFT, padx=5)
         
         # Configure grid to expand properly
         self.main_frame.columnconfigure(1, weight=1)
+        self.main_frame.rowconfigure(8, weight=1)
         
     def _toggle_quality_visibility(self):
         """Show/hide quality slider based on format selection"""
-        if self.format_var.get() == "jpg":
+        if self.format_var.get() in ("jpg", "webp"):
             self.quality_label.grid(column=0, row=3, sticky=tk.W)
             self.quality_slider.master.grid(column=1, row=3, sticky=(tk.W, tk.E), padx=5, pady=5)
         else:
@@ -200,6 +270,9 @@ class WebCaptureGUI:
         elif format_choice == "jpg":
             filetypes = [("JPEG Images", "*.jpg"), ("All Files", "*.*")]
             default_ext = ".jpg"
+        elif format_choice == "webp":
+            filetypes = [("WebP Images", "*.webp"), ("All Files", "*.*")]
+            default_ext = ".webp"
         elif format_choice == "pdf":
             filetypes = [("PDF Documents", "*.pdf"), ("All Files", "*.*")]
             default_ext = ".pdf"
@@ -207,7 +280,8 @@ class WebCaptureGUI:
         # Try to extract domain for default filename
         default_filename = ""
         try:
-            url = self.url_var.get()
+            urls = self._urls()
+            url = urls[0] if urls else ""
             if url:
                 if not url.startswith(("http://", "https://")):
                     url = "https://" + url
@@ -230,13 +304,37 @@ class WebCaptureGUI:
         if filename:
             self.output_var.set(filename)
             
+    def _urls(self):
+        """URLs entered in the text box, skipping blank lines"""
+        return [line.strip() for line in self.url_text.get("1.0", tk.END).splitlines() if line.strip()]
+        
+    def _pool(self, timeout):
+        """
+        Warm capture pool for a page load timeout, started on first use
+
+        A pool for another timeout is retired: its queued jobs still run,
+        then its browsers shut down on a background thread.
+        """
+        if self.pool is not None and self.pool_timeout != timeout:
+            closer = threading.Thread(target=self.pool.close, daemon=True)
+            closer.start()
+            self.retiring.append(closer)
+            self.pool = None
+        if self.pool is None:
+            self.pool = CapturePool(
+                workers=WORKERS, on_done=self._job_done, on_progress=self._job_progress,
+                headless=True, timeout=timeout, wait_for_network=True
+            ).start()
+            self.pool_timeout = timeout
+        return self.pool
+        
     def _start_capture(self):
-        """Begin the webpage capture process"""
-        url = self.url_var.get().strip()
-        if not url:
+        """Queue a capture job for every URL entered"""
+        urls = self._urls()
+        if not urls:
             messagebox.showerror("Error", "Please enter a URL")
             return
-            
+        
         # Get form values
         format_choice = self.format_var.get()
         quality = self.quality_var.get()
@@ -245,66 +343,133 @@ class WebCaptureGUI:
         output_path = self.output_var.get().strip() or None
         timeout = self.timeout_var.get()
         
-        # Disable UI during capture
-        self.capture_button.config(state="disabled")
-        self.progress.start()
-        self.status_var.set("Initializing capture...")
-        self.root.update()
-        
-        # Run capture in a separate thread
-        thread = threading.Thread(
-            target=self._capture_thread,
-            args=(url, format_choice, output_path, quality, width, height, timeout),
-            daemon=True
-        )
-        thread.start()
-        
-    def _capture_thread(self, url, format_choice, output_path, quality, width, height, timeout):
-        """Worker thread for capturing webpage"""
-        try:
-            self._update_status("Starting Chrome...")
+        pool = self._pool(timeout)
+        for url in urls:
+            url, parsed_url = normalize_url(url)
+            if parsed_url is None:
+                self.status_var.set(f"Skipped invalid URL: {url}")
+                continue
             
-            # Create new WebPageCapture instance
-            capture = WebPageCapture(headless=True, timeout=timeout, wait_for_network=True)
+            job_id = self.next_id
+            self.next_id += 1
+            job_output = output_path
+            if len(urls) > 1 or output_path is None:
+                # The save location only names the folder when queueing several pages
+                directory = os.path.dirname(output_path) if output_path else None
+                job_output = default_output_path(parsed_url, format_choice, directory, suffix=job_id)
             
-            self._update_status(f"Loading {url}...")
-            
-            # Perform the capture
-            result = capture.capture(
-                url, format_choice, output_path, quality, width, height
+            job = CaptureJob(
+                url, job_id, output_format=format_choice, output_path=job_output,
+                quality=quality, width=width, height=height
             )
+            item = self.queue_view.insert(
+                "", tk.END, values=(url, format_choice.upper(), "Queued", "")
+            )
+            self.jobs[item] = job
+            self.rows[job.id] = item
+            pool.submit(job)
+        
+        self.url_text.delete("1.0", tk.END)
+        self._update_progress()
+        
+    def _job_progress(self, job):
+        """Called on a worker thread as a job enters each capture phase"""
+        self.events.put(job)
+        
+    def _job_done(self, job):
+        """Called on a worker thread once a job has finished"""
+        self.events.put(job)
+        
+    def _poll_events(self):
+        """Apply job updates reported by the workers"""
+        try:
+            while True:
+                job = self.events.get_nowait()
+                if job is None:
+                    # The browsers are closed (see _on_close)
+                    self.root.destroy()
+                    return
+                if job.id in self.rows:
+                    self._show_job(job)
+        except queue.Empty:
+            pass
+        self.root.after(POLL_INTERVAL, self._poll_events)
+        
+    def _show_job(self, job):
+        """Refresh the queue row of a job"""
+        status = job.status
+        if status == 'done':
+            detail = job.result
+        elif status == 'failed':
+            detail = job.error or "Failed to capture webpage"
+        elif status == 'running':
+            detail = PHASE_LABELS.get(job.phase, "Starting")
+        else:
+            detail = ""
+        if job.cancelled and not job.done:
+            status = 'cancelling'
+        item = self.rows[job.id]
+        self.queue_view.set(item, "status", status.capitalize())
+        self.queue_view.set(item, "progress", detail)
+        
+        if job.done:
+            self._update_progress()
+            if status == 'done':
+                self.status_var.set(f"Saved to: {job.result}")
+            elif status == 'failed':
+                self.status_var.set(f"Capture failed: {job.url}")
+                
+    def _update_progress(self):
+        """Show how many of the listed jobs have finished"""
+        total = len(self.jobs)
+        finished = sum(1 for job in self.jobs.values() if job.done)
+        self.progress.config(maximum=max(total, 1), value=finished)
+        running = sum(1 for job in self.jobs.values() if job.status == 'running')
+        if total and finished == total:
+            self.status_var.set(f"Finished {total} capture(s)")
+        elif total:
+            self.status_var.set(f"{finished}/{total} finished, {running} running")
             
-            # Always close the browser
-            capture.close()
-            
-            # Update UI based on result
-            if result:
-                self._update_status(f"Saved to: {result}")
-                self.root.after(0, lambda: messagebox.showinfo(
-                    "Success", f"Screenshot saved to:\n{result}"
-                ))
-            else:
-                self._update_status("Capture failed")
-                self.root.after(0, lambda: messagebox.showerror(
-                    "Error", "Failed to capture webpage"
-                ))
+    def _cancel(self, items):
+        for item in items:
+            job = self.jobs.get(item)
+            if job is not None and not job.done:
+                job.cancel()
+                self._show_job(job)
                 
-        except Exception as e:
-            error_message = str(e)
-            self._update_status(f"Error: {error_message}")
-            self.root.after(0, lambda: messagebox.showerror("Error", error_message))
+    def _cancel_selected(self):
+        """Cancel the jobs selected in the queue"""
+        self._cancel(self.queue_view.selection())
+        
+    def _cancel_all(self):
+        """Cancel every queued or running job"""
+        self._cancel(list(self.jobs))
+        
+    def _clear_finished(self):
+        """Remove finished jobs from the queue"""
+        for item, job in list(self.jobs.items()):
+            if job.done:
+                self.queue_view.delete(item)
+                del self.jobs[item]
+                del self.rows[job.id]
+        self._update_progress()
+        
+    def _on_close(self):
+        """Cancel outstanding jobs and shut the browsers down before exiting"""
+        self._cancel_all()
+        self.status_var.set("Closing browsers...")
+        pool, retiring = self.pool, list(self.retiring)
+        
+        def close_pools():
+            # Tk may only be called from its own thread, so the poll loop
+            # destroys the window once it sees the None
+            if pool:
+                pool.close()
+            for closer in retiring:
+                closer.join()
+            self.events.put(None)
             
-        # Reset UI state
-        self.root.after(0, self._reset_ui)
-        
-    def _update_status(self, message):
-        """Thread-safe status update"""
-        self.root.after(0, lambda: self.status_var.set(message))
-        
-    def _reset_ui(self):
-        """Reset UI after capture completes"""
-        self.progress.stop()
-        self.capture_button.config(state="normal")
+        threading.Thread(target=close_pools, daemon=True).start()
 
 def run_gui():
     """Launch the GUI application"""
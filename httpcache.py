@@ -0,0 +1,158 @@
+import os
+import time
+import shutil
+import itertools
+import threading
+
+from utils import pid_running
+
+# Chrome's own limit for each worker's disk cache
+DEFAULT_CACHE_MB = 512
+
+_worker_ids = itertools.count(1)
+
+
+class SharedHttpCache:
+    """
+    Persistent Chrome disk cache shared by the workers of a run
+
+    Chrome's default profile is thrown away with the browser, so every new
+    driver downloads the same CSS, JS and fonts again. Here each browser
+    gets its own --disk-cache-dir (Chrome's cache can't be opened by two
+    browsers at once), seeded from a template copy of an earlier browser's
+    cache and capped with --disk-cache-size. When a browser shuts down its
+    cache replaces the template if it grew, so the template warms up over
+    runs while workers only read it at start-up.
+
+    Templates are versioned directories under templates/, newest name
+    first. A retired cache is renamed in as a new version before older
+    ones are removed, so browsers in this or another process always find
+    a complete template without any locking.
+
+    Hit rates come from the fromDiskCache flag of CDP Network responses.
+    """
+
+    def __init__(self, directory, max_mb=DEFAULT_CACHE_MB):
+        """
+        Args:
+            directory (str): Holds the template cache and the live worker caches
+            max_mb (int): Size cap of each browser's disk cache in MB
+        """
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.templates = os.path.join(directory, "templates")
+        self.workers = os.path.join(directory, "workers")
+        self.responses = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.workers, exist_ok=True)
+        os.makedirs(self.templates, exist_ok=True)
+        self._prune_workers()
+
+    def _prune_workers(self):
+        """Remove caches left behind by processes that died without checking them in"""
+        for name in os.listdir(self.workers):
+            pid = name.split('-', 1)[0]
+            if pid.isdigit() and int(pid) != os.getpid() and pid_running(int(pid)) is False:
+                shutil.rmtree(os.path.join(self.workers, name), ignore_errors=True)
+
+    def _templates(self):
+        """Complete template directories, newest first"""
+        return [os.path.join(self.templates, name)
+                for name in sorted(os.listdir(self.templates), reverse=True)]
+
+    def checkout(self):
+        """
+        Create a browser's cache directory, seeded from the newest template
+
+        Returns:
+            str: Directory for --disk-cache-dir
+        """
+        path = os.path.join(self.workers, f"{os.getpid()}-{next(_worker_ids)}")
+        shutil.rmtree(path, ignore_errors=True)
+        error = None
+        for _ in range(3):
+            templates = self._templates()
+            if not templates:
+                break
+            try:
+                shutil.copytree(templates[0], path)
+                return path
+            except (OSError, shutil.Error) as e:
+                # A newer template replaced this one while it was copied
+                error = e
+                shutil.rmtree(path, ignore_errors=True)
+        if error is not None:
+            print(f"Starting with an empty HTTP cache: {error}")
+        os.makedirs(path)
+        return path
+
+    def checkin(self, path):
+        """
+        Retire a browser's cache directory once Chrome has exited
+
+        The cache becomes the new template if it holds more than the current
+        one; otherwise it is removed.
+        """
+        try:
+            templates = self._templates()
+            if _tree_size(path) > (_tree_size(templates[0]) if templates else 0):
+                self._promote(path)
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _promote(self, path):
+        """Move path in as the newest template, then remove the older ones"""
+        name = f"{time.time_ns():020d}-{os.path.basename(path)}"
+        # Both live under self.directory, so this is an atomic rename
+        os.rename(path, os.path.join(self.templates, name))
+        for old in self._templates()[1:]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def chrome_arguments(self, path):
+        """Chrome flags that put a browser's disk cache in path"""
+        return [f"--disk-cache-dir={path}", f"--disk-cache-size={self.max_bytes}"]
+
+    def feed(self, method, params, timestamp=None):
+        """Count HTTP responses and the ones served from the disk cache"""
+        if method != 'Network.responseReceived':
+            return
+        response = params.get('response', {})
+        if not response.get('url', '').startswith(('http://', 'https://')):
+            return
+        with self._lock:
+            self.responses += 1
+            if response.get('fromDiskCache'):
+                self.hits += 1
+
+    def stats(self):
+        """Responses seen, disk cache hits and the hit rate"""
+        with self._lock:
+            return {
+                'responses': self.responses,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.responses if self.responses else 0.0,
+            }
+
+    def log(self):
+        stats = self.stats()
+        print(f"HTTP cache: {stats['hits']} of {stats['responses']} responses from disk "
+              f"({stats['hit_rate']:.0%})")
+
+
+def http_cache_from_args(args):
+    """Build a SharedHttpCache from --http-cache-dir/--http-cache-mb, or None"""
+    if not getattr(args, 'http_cache_dir', None):
+        return None
+    return SharedHttpCache(args.http_cache_dir, getattr(args, 'http_cache_mb', None) or DEFAULT_CACHE_MB)
+
+
+def _tree_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
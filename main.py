@@ -5,38 +5,44 @@ Web Page Capture Tool - Main Entry Point
 
 import sys
 import argparse
+import importlib.util
 
-# Import functionality from existing scripts
-from screenshot import run_interactive, run_cli, WebPageCapture
+# The capture modules (Selenium, PIL, tkinter) are imported only on the code
+# path that needs them, so --version and --help start instantly; run
+# `python benchmark.py --import-time` to check startup against its budget.
 
-# Try importing GUI (will fail gracefully if tkinter is not available)
-try:
-    from gui import run_gui
-    HAS_GUI = True
-except ImportError:
-    HAS_GUI = False
 
-def main():
-    """Main entry point for the application"""
-    # Create command line parser
+def has_gui():
+    """True if tkinter is available, without importing it"""
+    return all(importlib.util.find_spec(name) is not None for name in ('tkinter', '_tkinter'))
+
+
+def main(argv=None):
+    """
+    Main entry point for the application
+
+    Only the mode flags are parsed here; the arguments are handed to the
+    mode's own parser (screenshot.run_cli, batch.run_batch or
+    server.run_server), which defines every option of that mode.
+    """
+    argv = sys.argv[1:] if argv is None else argv
     parser = argparse.ArgumentParser(
-        description='Web Page Capture Tool - Take screenshots of webpages and save as PNG, JPG, or PDF'
+        description='Web Page Capture Tool - Take screenshots of webpages and save as PNG, JPG, WebP, or PDF',
+        usage='%(prog)s [URL [options] | --batch FILE [options] | --serve [options] | --gui | --version]',
+        epilog="Run '%(prog)s URL --help', '%(prog)s --batch FILE --help' or '%(prog)s --serve --help' "
+               "for the options of each mode.",
+        add_help=False, allow_abbrev=False
     )
-    
-    # Add basic arguments
-    parser.add_argument('url', nargs='?', help='URL of the webpage to capture')
+    parser.add_argument('-h', '--help', action='store_true', help='Show this help message and exit')
     parser.add_argument('--gui', action='store_true', help='Launch the graphical user interface')
-    parser.add_argument('--format', choices=['png', 'jpg', 'pdf'], help='Output format (png, jpg, or pdf)')
-    parser.add_argument('--output', help='Custom output path')
-    parser.add_argument('--quality', type=int, help='JPEG quality (1-100)')
-    parser.add_argument('--width', type=int, help='Viewport width')
-    parser.add_argument('--height', type=int, help='Viewport height (defaults to full page)')
-    parser.add_argument('--timeout', type=int, help='Page load timeout in seconds')
+    parser.add_argument('--batch', metavar='FILE',
+                        help="Capture every URL or JSON job listed in FILE ('-' for stdin)")
+    parser.add_argument('--serve', action='store_true', help='Run a local HTTP capture service')
     parser.add_argument('--version', action='store_true', help='Show version information')
     
     # Parse arguments
-    if len(sys.argv) > 1:
-        args = parser.parse_args()
+    if argv:
+        args, rest = parser.parse_known_args(argv)
         
         # Handle version request
         if args.version:
@@ -45,30 +51,46 @@ def main():
             
         # GUI mode takes precedence if explicitly requested
         if args.gui:
-            if not HAS_GUI:
+            if not has_gui():
                 print("Error: GUI mode is not available. Please install tkinter.")
                 return 1
+            from gui import run_gui
             return run_gui()
             
-        # If URL is provided, run in CLI mode
-        if args.url:
-            # Only pass along arguments that were actually provided
-            cli_args = sys.argv[1:]
-            return run_cli()
+        # Service mode keeps a pool of warm drivers behind an HTTP API
+        if args.serve:
+            from server import run_server
+            return run_server(argv)
+            
+        # Batch mode runs a list of URLs through a pool of warm drivers
+        if args.batch:
+            from batch import run_batch
+            return run_batch(argv)
+            
+        # Without a mode flag there's nothing but --help to show
+        if args.help and not rest:
+            parser.print_help()
+            return 0
             
-        # No URL and no --gui, show help
-        parser.print_help()
-        return 1
+        # Otherwise the arguments are a single capture (URL and options)
+        from screenshot import run_cli
+        return run_cli(argv)
     else:
         # No arguments provided, check if GUI is available
-        if HAS_GUI:
+        if has_gui():
             print("Starting in GUI mode. Use --help for command line options.")
+            from gui import run_gui
             return run_gui()
         else:
             # Fall back to interactive mode
             print("Starting in interactive mode. Use --help for command line options.")
+            from screenshot import run_interactive
             run_interactive()
             return 0
 
 if __name__ == "__main__":
+    # Post-processing worker processes re-enter here in frozen builds
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()
     sys.exit(main())
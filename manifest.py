@@ -0,0 +1,133 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Job statuses kept in a ProgressStore and written to manifests
+STATUSES = ('pending', 'done', 'failed')
+
+
+def parse_shard(spec):
+    """
+    Parse a shard spec 'i/N' (1 <= i <= N) into (i, N)
+
+    Every job belongs to exactly one of the N shards, decided by its id
+    alone, so N machines given the same manifest split it without overlap.
+    """
+    index, _, count = spec.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"Invalid shard: {spec}")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard: {spec}")
+    return index, count
+
+
+def shard_of(job_id, count):
+    """1-based shard of a job id; stable across machines and Python versions"""
+    digest = hashlib.sha1(str(job_id).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % count + 1
+
+
+def in_shard(jobs, shard):
+    """Yield the jobs whose id falls into shard (i, N)"""
+    index, count = shard
+    for job in jobs:
+        if shard_of(job.id, count) == index:
+            yield job
+
+
+def job_fingerprint(url, fields=None):
+    """Hash of a job's URL and the fields of its manifest line, to notice lines edited between runs"""
+    spec = json.dumps({'url': url, 'fields': fields or {}}, sort_keys=True, default=str)
+    return hashlib.sha1(spec.encode()).hexdigest()
+
+
+class ProgressStore:
+    """
+    SQLite record of finished batch jobs, so an interrupted run can resume
+
+    Jobs are identified by their manifest id plus a fingerprint of their URL
+    and line (CaptureJob.fingerprint), since ids are often just line numbers. Completed jobs are
+    skipped when the same manifest is run again; failed ones, and jobs whose
+    line changed since they were recorded, are run again. SQLite's
+    own file locking lets several processes (e.g. one per shard) share one
+    store on a local disk.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): SQLite database file, created if missing
+        """
+        self.path = path
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, url TEXT, status TEXT, path TEXT, error TEXT, "
+            "attempts INTEGER, updated REAL, fingerprint TEXT)"
+        )
+        self._db.commit()
+
+    def status(self, job):
+        """
+        Recorded status of a CaptureJob, 'pending' if it never finished
+
+        A record for the same id but another URL or other fields belongs to
+        an earlier version of the manifest; the job counts as pending again.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, url, fingerprint FROM jobs WHERE id = ?", (str(job.id),)
+            ).fetchone()
+        if not row:
+            return 'pending'
+        status, url, fingerprint = row
+        if fingerprint != job.fingerprint:
+            print(f"Job {job.id} changed since it was recorded ({url}), capturing it again")
+            return 'pending'
+        return status
+
+    def pending(self, jobs):
+        """Yield the jobs that haven't completed yet, counting the others in `skipped`"""
+        for job in jobs:
+            if self.status(job) == 'done':
+                self.skipped += 1
+                continue
+            yield job
+
+    def record(self, job):
+        """Record a finished CaptureJob as done or failed"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, url, status, path, error, attempts, updated, fingerprint) "
+                "VALUES (?, ?, ?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET url = excluded.url, status = excluded.status, "
+                "path = excluded.path, error = excluded.error, attempts = attempts + 1, "
+                "updated = excluded.updated, fingerprint = excluded.fingerprint",
+                (str(job.id), job.url, 'done' if job.ok else 'failed', job.result, job.error, time.time(),
+                 job.fingerprint)
+            )
+            self._db.commit()
+
+    def stats(self):
+        """Number of recorded jobs per status"""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def progress_from_args(args):
+    """Build a ProgressStore from --progress, or None"""
+    if not getattr(args, 'progress', None):
+        return None
+    return ProgressStore(args.progress)
@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+
+# Histogram buckets (seconds) for capture and phase durations
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Seconds between rewrites of the Prometheus file; close() writes the final state
+WRITE_INTERVAL = 10.0
+
+# Hosts exported with their own label, by number of captures; the others
+# are summed into host="other" so the label's cardinality stays bounded.
+# At most HOST_TRACKING times as many hosts are counted individually.
+MAX_HOSTS = 20
+HOST_TRACKING = 50
+
+# Phases in the order a capture goes through them
+PHASES = (
+    'driver_init', 'cache', 'reset', 'navigate', 'wait', 'fingerprint', 'resize', 'settle',
+    'screenshot', 'decode', 'encode', 'write', 'pdf', 'dedupe', 'diff', 'retry',
+)
+
+
+class CaptureResult:
+    """
+    Outcome of one capture
+
+    Carries the artifact path (or the error), where it came from (a fresh
+    capture, the cache, or an unchanged earlier capture) and the time spent
+    in every phase, measured with a monotonic clock. Truthy when ok.
+
+    A result whose encoding was handed to a PostProcessor is `deferred` and
+    finishes later; wait() blocks until it has.
+    """
+
+    def __init__(self, url, output_format=None, output_path=None, on_phase=None):
+        """
+        Args:
+            on_phase (callable): Called with each phase's name as it begins;
+                an exception it raises aborts the capture
+        """
+        self.url = url
+        self.output_format = output_format
+        self.output_path = output_path
+        self.viewport = None
+        self.http_status = None
+        self.retry_after = None
+        self.path = None
+        self.source = None
+        self.error = None
+        self.error_type = None
+        self.bytes = None
+        self.phases = {}
+        self.started_at = time.time()
+        self.total_seconds = None
+        self.deferred = False
+        self.attempts = 1
+        self.diff = None
+        self.phash = None
+        self.duplicate_of = None
+        self.on_phase = on_phase
+        self._start = time.monotonic()
+        self._finished = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def ok(self):
+        return self.path is not None
+
+    @property
+    def host(self):
+        return (urlparse(self.url).hostname or '').lower()
+
+    def enter(self, name):
+        """Report that the named phase is beginning"""
+        if self.on_phase:
+            self.on_phase(name)
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block and add it to the named phase"""
+        self.enter(name)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.monotonic() - started)
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def succeed(self, path, source='capture'):
+        self.path = path
+        self.source = source
+        try:
+            self.bytes = os.path.getsize(path)
+        except OSError:
+            pass
+        return self.finish()
+
+    def fail(self, error, error_type=None):
+        self.error = str(error)
+        self.error_type = error_type or type(error).__name__
+        return self.finish()
+
+    def finish(self):
+        with self._lock:
+            if self.total_seconds is None:
+                self.total_seconds = time.monotonic() - self._start
+            self._finished.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+        return self
+
+    def add_done_callback(self, callback):
+        """Call callback(result) once finished, right away if it already is"""
+        with self._lock:
+            if not self._finished.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout=None):
+        """Block until the result is finished, including deferred post-processing"""
+        self._finished.wait(timeout)
+        return self
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'ok': self.ok,
+            'path': self.path,
+            'format': self.output_format,
+            'viewport': self.viewport,
+            'http_status': self.http_status,
+            'source': self.source,
+            'error': self.error,
+            'error_type': self.error_type,
+            'attempts': self.attempts,
+            'bytes': self.bytes,
+            'phash': self.phash,
+            'duplicate_of': self.duplicate_of,
+            'diff': self.diff.to_dict() if self.diff is not None else None,
+            'started_at': round(self.started_at, 3),
+            'total_seconds': round(self.total_seconds, 4) if self.total_seconds is not None else None,
+            'phases': {name: round(seconds, 4) for name, seconds in self.phases.items()},
+        }
+
+
+class Histogram:
+    """Cumulative Prometheus histogram"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def render(self, name, labels):
+        lines = []
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f"{name}_bucket{_labels(labels, le=_number(bound))} {count}")
+        lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {self.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(self.sum)}")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}")
+        return lines
+
+
+class CaptureMetrics:
+    """
+    Collect CaptureResults into a JSON-lines log and Prometheus metrics
+
+    One instance can be shared by every worker of a pool. The Prometheus
+    text exposition is available from render() and can be written to a
+    file for node_exporter's textfile collector. Call close() when done so
+    the file has the final counts.
+    """
+
+    def __init__(self, log_path=None, prometheus_path=None, write_interval=WRITE_INTERVAL, max_hosts=MAX_HOSTS):
+        """
+        Args:
+            log_path (str): Append one JSON object per capture to this file
+            prometheus_path (str): Rewrite this file with the current metrics
+                at most every write_interval seconds, and on close()
+            write_interval (float): Seconds between rewrites of prometheus_path
+            max_hosts (int): Hosts exported with their own label; the rest
+                are reported as host="other"
+        """
+        self.log_path = log_path
+        self.prometheus_path = prometheus_path
+        self.write_interval = write_interval
+        self.max_hosts = max_hosts
+        self._lock = threading.Lock()
+        self._captures = {}
+        self._bytes = {}
+        self._durations = {}
+        self._phases = {}
+        self._hosts = {}
+        self._other_host = [0, 0.0]
+        self._written = None
+
+    def observe(self, result):
+        """Record one finished capture"""
+        status = 'ok' if result.ok else 'error'
+        with self._lock:
+            key = (result.output_format or '', status, result.source or result.error_type or '')
+            self._captures[key] = self._captures.get(key, 0) + 1
+            if result.bytes:
+                self._bytes[result.output_format] = self._bytes.get(result.output_format, 0) + result.bytes
+            if result.total_seconds is not None:
+                self._durations.setdefault(status, Histogram()).observe(result.total_seconds)
+                host = self._hosts.get(result.host)
+                if host is None:
+                    if len(self._hosts) < self.max_hosts * HOST_TRACKING:
+                        host = self._hosts[result.host] = [0, 0.0]
+                    else:
+                        host = self._other_host
+                host[0] += 1
+                host[1] += result.total_seconds
+            for name, seconds in result.phases.items():
+                self._phases.setdefault(name, Histogram()).observe(seconds)
+
+            if self.log_path:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(result.to_dict()) + "\n")
+
+            now = time.monotonic()
+            write = self.prometheus_path and (self._written is None or now - self._written >= self.write_interval)
+            if write:
+                self._written = now
+        if write:
+            self.write_prometheus(self.prometheus_path)
+
+    def close(self):
+        """Write the final metrics to the Prometheus file, if there is one"""
+        if self.prometheus_path:
+            self.write_prometheus(self.prometheus_path)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                "# HELP webcapture_captures_total Captures by format, status and source or error type.",
+                "# TYPE webcapture_captures_total counter",
+            ]
+            for (output_format, status, source), count in sorted(self._captures.items()):
+                lines.append("webcapture_captures_total"
+                             f"{_labels({'format': output_format, 'status': status, 'source': source})} {count}")
+
+            lines += [
+                "# HELP webcapture_output_bytes_total Bytes of artifacts produced.",
+                "# TYPE webcapture_output_bytes_total counter",
+            ]
+            for output_format, size in sorted(self._bytes.items()):
+                lines.append(f"webcapture_output_bytes_total{_labels({'format': output_format})} {size}")
+
+            lines += [
+                "# HELP webcapture_capture_seconds End-to-end capture duration.",
+                "# TYPE webcapture_capture_seconds histogram",
+            ]
+            for status, histogram in sorted(self._durations.items()):
+                lines += histogram.render("webcapture_capture_seconds", {'status': status})
+
+            lines += [
+                "# HELP webcapture_phase_seconds Time spent in each capture phase.",
+                "# TYPE webcapture_phase_seconds histogram",
+            ]
+            for name, histogram in sorted(self._phases.items(), key=lambda item: _phase_order(item[0])):
+                lines += histogram.render("webcapture_phase_seconds", {'phase': name})
+
+            lines += [
+                "# HELP webcapture_host_capture_seconds Total capture time per host.",
+                "# TYPE webcapture_host_capture_seconds summary",
+            ]
+            for host, (count, seconds) in sorted(self._top_hosts().items()):
+                lines.append(f"webcapture_host_capture_seconds_sum{_labels({'host': host})} {_number(seconds)}")
+                lines.append(f"webcapture_host_capture_seconds_count{_labels({'host': host})} {count}")
+        return "\n".join(lines) + "\n"
+
+    def _top_hosts(self):
+        """Totals of the max_hosts busiest hosts plus 'other' for the rest"""
+        ranked = sorted(self._hosts.items(), key=lambda item: item[1][0], reverse=True)
+        hosts = dict(ranked[:self.max_hosts])
+        other = list(self._other_host)
+        for _, (count, seconds) in ranked[self.max_hosts:]:
+            other[0] += count
+            other[1] += seconds
+        if other[0]:
+            hosts['other'] = other
+        return hosts
+
+    def write_prometheus(self, path):
+        """Atomically write the exposition to path"""
+        partial = f"{path}.tmp"
+        with open(partial, "w") as f:
+            f.write(self.render())
+        os.replace(partial, path)
+
+
+def timed(timer, name):
+    """timer.phase(name), or a no-op context when there is no timer"""
+    return timer.phase(name) if timer is not None else nullcontext()
+
+
+def metrics_from_args(args):
+    """Build CaptureMetrics from --metrics-log/--prometheus, or None"""
+    log_path = getattr(args, 'metrics_log', None)
+    prometheus_path = getattr(args, 'prometheus', None)
+    if not log_path and not prometheus_path:
+        return None
+    return CaptureMetrics(log_path, prometheus_path)
+
+
+def _phase_order(name):
+    return PHASES.index(name) if name in PHASES else len(PHASES)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
@@ -0,0 +1,208 @@
+import re
+import time
+import base64
+import asyncio
+
+from utils import write_base64
+
+# Paper sizes in inches (width, height), portrait
+PAPER_SIZES = {
+    'letter': (8.5, 11),
+    'legal': (8.5, 14),
+    'tabloid': (11, 17),
+    'a3': (11.69, 16.54),
+    'a4': (8.27, 11.69),
+    'a5': (5.83, 8.27),
+}
+
+MM_PER_INCH = 25.4
+
+# Page.printToPDF pageRanges syntax, e.g. '1-5, 8, 11-13'
+PAGE_RANGES = re.compile(r"^\s*\d*\s*(-\s*\d*\s*)?(,\s*\d*\s*(-\s*\d*\s*)?)*$")
+
+# Bytes requested per IO.read of a PDF stream
+STREAM_CHUNK = 1 << 20
+
+
+def parse_paper_size(spec):
+    """
+    Paper size as (width, height) in inches
+
+    A spec is a PAPER_SIZES name or a size in inches ('8.5x11') or
+    millimetres ('210x297mm').
+    """
+    name = spec.strip().lower()
+    if name in PAPER_SIZES:
+        return PAPER_SIZES[name]
+    unit = 1.0
+    if name.endswith('mm'):
+        name, unit = name[:-2], 1 / MM_PER_INCH
+    elif name.endswith('in'):
+        name = name[:-2]
+    width, _, height = name.partition('x')
+    try:
+        width, height = float(width) * unit, float(height) * unit
+    except ValueError:
+        raise ValueError(f"Invalid paper size: {spec}")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid paper size: {spec}")
+    return width, height
+
+
+def pdf_options(paper=None, page_ranges=None, landscape=False):
+    """
+    Validated PDF options for WebPageCapture and AsyncWebPageCapture
+
+    Args:
+        paper (str): Paper size (see parse_paper_size()); the page's own CSS
+            page size is used when None
+        page_ranges (str): Pages to print, e.g. '1-5, 8, 11-13'
+        landscape (bool): Print in landscape orientation
+
+    Returns:
+        dict: Options for print_params()
+    """
+    if page_ranges and not PAGE_RANGES.match(page_ranges):
+        raise ValueError(f"Invalid page ranges: {page_ranges}")
+    return {
+        'paper': parse_paper_size(paper) if paper else None,
+        'page_ranges': page_ranges.replace(' ', '') if page_ranges else None,
+        'landscape': bool(landscape),
+    }
+
+
+def pdf_options_from_args(args):
+    """Build PDF options from --paper/--page-ranges/--landscape, or None"""
+    paper = getattr(args, 'paper', None)
+    page_ranges = getattr(args, 'page_ranges', None)
+    landscape = getattr(args, 'landscape', False)
+    if not paper and not page_ranges and not landscape:
+        return None
+    return pdf_options(paper, page_ranges, landscape)
+
+
+def print_params(options=None):
+    """
+    Page.printToPDF parameters for PDF options
+
+    The PDF is always returned as a stream so it can be read to disk in
+    chunks instead of arriving as one base64 string.
+    """
+    options = options or {}
+    params = {
+        "printBackground": True,
+        "preferCSSPageSize": not options.get('paper'),
+        "marginTop": 0,
+        "marginBottom": 0,
+        "marginLeft": 0,
+        "marginRight": 0,
+        "scale": 1.0,
+        "landscape": bool(options.get('landscape')),
+        "transferMode": "ReturnAsStream",
+    }
+    if options.get('paper'):
+        params["paperWidth"], params["paperHeight"] = options['paper']
+    if options.get('page_ranges'):
+        params["pageRanges"] = options['page_ranges']
+    return params
+
+
+def write_chunk(f, response):
+    """Decode one IO.read response into f and return the number of bytes written"""
+    data = response.get('data', '')
+    if response.get('base64Encoded'):
+        return f.write(base64.b64decode(data))
+    return f.write(data.encode('latin-1'))
+
+
+def write_pdf(execute_cdp_cmd, output_path, options=None, chunk_size=STREAM_CHUNK, timer=None):
+    """
+    Print the current page to a PDF file without holding it in memory
+
+    Chrome renders the PDF into a stream handle, which is read chunk by
+    chunk with IO.read and appended to the file, so memory use is the same
+    for a one-page receipt and a thousand-page report. Chrome versions that
+    ignore transferMode return the data inline, which is still decoded in
+    chunks.
+
+    Args:
+        execute_cdp_cmd (callable): Runs a CDP command, e.g. driver.execute_cdp_cmd
+        output_path (str): PDF file to write
+        options (dict): PDF options from pdf_options()
+        chunk_size (int): Bytes requested per IO.read
+        timer (CaptureResult): Accumulates pdf/decode/write phase times
+
+    Returns:
+        int: Number of bytes written
+    """
+    started = time.monotonic()
+    printed = execute_cdp_cmd("Page.printToPDF", print_params(options))
+    if timer is not None:
+        timer.add_time('pdf', time.monotonic() - started)
+    if 'stream' not in printed:
+        return write_base64(printed['data'], output_path, timer=timer)
+
+    handle = printed['stream']
+    written = 0
+    reading = writing = 0.0
+    try:
+        with open(output_path, "wb") as f:
+            while True:
+                started = time.monotonic()
+                response = execute_cdp_cmd("IO.read", {"handle": handle, "size": chunk_size})
+                read = time.monotonic()
+                written += write_chunk(f, response)
+                reading += read - started
+                writing += time.monotonic() - read
+                if response.get('eof'):
+                    break
+    finally:
+        try:
+            execute_cdp_cmd("IO.close", {"handle": handle})
+        except Exception:
+            pass
+    if timer is not None:
+        timer.add_time('pdf', reading)
+        timer.add_time('write', writing)
+    return written
+
+
+async def write_pdf_async(send, output_path, options=None, chunk_size=STREAM_CHUNK, timer=None):
+    """
+    write_pdf() for the async engine
+
+    Args:
+        send (coroutine function): Sends a CDP command, e.g. CDPSession.send
+    """
+    started = time.monotonic()
+    printed = await send("Page.printToPDF", print_params(options))
+    if timer is not None:
+        timer.add_time('pdf', time.monotonic() - started)
+    if 'stream' not in printed:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, write_base64, printed['data'], output_path, chunk_size, timer
+        )
+
+    handle = printed['stream']
+    written = 0
+    reading = writing = 0.0
+    try:
+        with open(output_path, "wb") as f:
+            while True:
+                started = time.monotonic()
+                response = await send("IO.read", {"handle": handle, "size": chunk_size})
+                read = time.monotonic()
+                written += write_chunk(f, response)
+                reading += read - started
+                writing += time.monotonic() - read
+                if response.get('eof'):
+                    break
+    finally:
+        try:
+            await send("IO.close", {"handle": handle})
+        except Exception:
+            pass
+    if timer is not None:
+        timer.add_time('pdf', reading)
+        timer.add_time('write', writing)
+    return written
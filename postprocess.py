@@ -0,0 +1,74 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import CaptureResult
+from variants import write_variants
+
+
+def render_variants(source, specs, paths):
+    """
+    Write image variants in a worker process
+
+    Returns:
+        list: Phase timings (dict) for each spec, the shared decode counted
+            against the first
+    """
+    timers = [CaptureResult(path) for path in paths]
+    write_variants(source, specs, paths, timer=timers[0], timers=timers)
+    return [timer.phases for timer in timers]
+
+
+class PostProcessor:
+    """
+    Process pool for image encoding, resizing and optimization
+
+    Capture threads render a page, hand the PNG to the pool and move on to
+    the next URL while other cores encode the variants. At most
+    `max_pending` renders are queued or in progress; submit() blocks beyond
+    that, so a slow encoder holds the browsers back instead of letting
+    renders pile up on disk.
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        """
+        Args:
+            workers (int): Encoder processes, defaults to the number of CPUs
+            max_pending (int): Renders allowed in flight, defaults to 2 * workers
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def submit(self, source, specs, paths):
+        """
+        Queue the variants of one render, blocking while the pool is full
+
+        Args:
+            source (str): Path of the full-size PNG render
+            specs (list): Parsed image output specs
+            paths (list): Output path for each spec
+
+        Returns:
+            Future: Resolves to the phase timings from render_variants()
+        """
+        # A path rather than the bytes, so megabytes of pixels aren't pickled
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(render_variants, source, specs, paths)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        return future
+
+    def close(self, wait=True):
+        """Finish queued work (if wait) and stop the worker processes"""
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
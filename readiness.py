@@ -0,0 +1,197 @@
+import json
+import time
+
+# Resolves to true once web fonts are loaded and every eagerly loaded image is
+# decoded. Incomplete lazy images are skipped since they may never start loading.
+FONTS_AND_IMAGES_FUNCTION = """
+function (waitFonts, waitImages) {
+    var waits = [];
+    if (waitFonts && document.fonts && document.fonts.ready) {
+        waits.push(document.fonts.ready);
+    }
+    if (waitImages) {
+        Array.prototype.forEach.call(document.images, function (img) {
+            var decode = function () {
+                return img.decode && img.naturalWidth ? img.decode().catch(function () {}) : null;
+            };
+            if (img.complete) {
+                waits.push(decode());
+            } else if (img.loading !== 'lazy') {
+                waits.push(new Promise(function (resolve) {
+                    img.addEventListener('load', resolve, {once: true});
+                    img.addEventListener('error', resolve, {once: true});
+                }).then(decode));
+            }
+        });
+    }
+    return Promise.all(waits).then(function () { return true; }, function () { return false; });
+}
+"""
+
+# Resolves to true after two animation frames, i.e. once pending layout is painted
+NEXT_PAINT_FUNCTION = """
+function () {
+    return new Promise(function (resolve) {
+        requestAnimationFrame(function () { requestAnimationFrame(function () { resolve(true); }); });
+    });
+}
+"""
+
+
+def as_async_script(function):
+    """Wrap a promise-returning JS function for Selenium's execute_async_script"""
+    return (
+        "var done = arguments[arguments.length - 1];"
+        f"({function}).apply(null, Array.prototype.slice.call(arguments, 0, -1))"
+        ".then(done, function () { done(false); });"
+    )
+
+
+def as_expression(function, *args):
+    """Wrap a promise-returning JS function as a CDP Runtime.evaluate expression"""
+    return f"({function})({', '.join(json.dumps(arg) for arg in args)})"
+
+
+FONTS_AND_IMAGES_SCRIPT = as_async_script(FONTS_AND_IMAGES_FUNCTION)
+NEXT_PAINT_SCRIPT = as_async_script(NEXT_PAINT_FUNCTION)
+
+
+class NetworkIdleTracker:
+    """
+    Track in-flight requests from CDP Network events
+
+    Events are fed in with the wall-clock time they were recorded at, so idle
+    time is measured from the last real network activity rather than from
+    when the events happened to be read.
+    """
+
+    def __init__(self, max_inflight=0):
+        self.max_inflight = max_inflight
+        self.inflight = set()
+        self.idle_since = time.time()
+
+    def reset(self):
+        """Forget all requests, e.g. before a new navigation"""
+        self.inflight.clear()
+        self.idle_since = time.time()
+
+    def feed(self, method, params, timestamp=None):
+        """Update the in-flight set from a single CDP event"""
+        if timestamp is None:
+            timestamp = time.time()
+
+        request_id = params.get('requestId')
+        if method == 'Network.requestWillBeSent':
+            url = params.get('request', {}).get('url', '')
+            if url.startswith('data:'):
+                return
+            self.inflight.add(request_id)
+        elif method in ('Network.loadingFinished', 'Network.loadingFailed'):
+            if request_id not in self.inflight:
+                return
+            self.inflight.discard(request_id)
+        else:
+            return
+
+        if len(self.inflight) > self.max_inflight:
+            self.idle_since = None
+        elif self.idle_since is None:
+            self.idle_since = timestamp
+
+    def idle_for(self, now=None):
+        """Seconds the network has been idle, or 0 while requests are in flight"""
+        if self.idle_since is None:
+            return 0.0
+        return max(0.0, (now or time.time()) - self.idle_since)
+
+
+class PageReadiness:
+    """
+    Decide when a loaded page is ready to capture
+
+    A page is ready once the document has loaded, no more than max_inflight
+    requests have been outstanding for idle_time seconds, and web fonts and
+    images have finished decoding. Everything is bounded by max_wait.
+    """
+
+    def __init__(self, idle_time=0.5, max_wait=30, max_inflight=0, poll_interval=0.05,
+                 wait_for_fonts=True, wait_for_images=True):
+        """
+        Args:
+            idle_time (float): Seconds of network quiet required
+            max_wait (float): Upper bound in seconds for the whole wait
+            max_inflight (int): Requests allowed to stay open (long-polling, beacons)
+            poll_interval (float): Seconds between checks
+            wait_for_fonts (bool): Wait for document.fonts.ready
+            wait_for_images (bool): Wait for images to load and decode
+        """
+        self.idle_time = idle_time
+        self.max_wait = max_wait
+        self.max_inflight = max_inflight
+        self.poll_interval = poll_interval
+        self.wait_for_fonts = wait_for_fonts
+        self.wait_for_images = wait_for_images
+
+    def wait(self, driver, poll_events, tracker):
+        """
+        Block until the page is ready or max_wait expires
+
+        Args:
+            driver: Selenium WebDriver for the page
+            poll_events (callable): Reads pending CDP events into the tracker
+            tracker (NetworkIdleTracker): In-flight request state for the page
+
+        Returns:
+            bool: True if the page became ready, False if max_wait expired
+        """
+        deadline = time.monotonic() + self.max_wait
+
+        # Document load
+        while driver.execute_script("return document.readyState") != "complete":
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+        if not self.wait_for_network_idle(poll_events, tracker, deadline):
+            return False
+
+        # Web fonts and image decode
+        if self.wait_for_fonts or self.wait_for_images:
+            if not self._run_async(driver, FONTS_AND_IMAGES_SCRIPT, deadline,
+                                   self.wait_for_fonts, self.wait_for_images):
+                return False
+
+        return True
+
+    def settle(self, driver, poll_events=None, tracker=None):
+        """
+        Wait for work triggered by a resize (relayout, lazy images) to finish
+
+        Without a tracker only the next paint is awaited.
+        """
+        deadline = time.monotonic() + self.max_wait
+        painted = self._run_async(driver, NEXT_PAINT_SCRIPT, deadline)
+        if tracker is None:
+            return painted
+        return self.wait_for_network_idle(poll_events, tracker, deadline)
+
+    def wait_for_network_idle(self, poll_events, tracker, deadline):
+        """Poll CDP events until the tracker reports idle_time of quiet"""
+        while True:
+            poll_events()
+            if tracker.idle_for() >= self.idle_time:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+    def _run_async(self, driver, script, deadline, *args):
+        """Run an async script bounded by the remaining time"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        try:
+            driver.set_script_timeout(remaining)
+            return bool(driver.execute_async_script(script, *args))
+        except Exception:
+            return False
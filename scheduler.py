@@ -0,0 +1,233 @@
+import time
+import queue
+import threading
+from collections import deque
+
+from utils import normalize_url
+
+# Responses that mean the host wants us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+
+class HostState:
+    """Token bucket, concurrency limit and pending jobs of one host"""
+
+    def __init__(self, rate, burst, max_active):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.max_active = max_active
+        self.active = 0
+        self.blocked_until = 0.0
+        self.latency = None
+        self.baseline = None
+        self.jobs = deque()
+        self.throttled = 0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until this host may start another job, None if it waits for one to finish"""
+        if self.active >= self.max_active:
+            return None
+        waits = [self.blocked_until - now, (1 - self.tokens) / self.rate]
+        return max(0.0, *waits)
+
+
+class HostScheduler:
+    """
+    Queue in front of capture workers that is polite to every host
+
+    Each host gets a token bucket (`rate` page loads per second, bursts of
+    `burst`) and at most `max_per_host` captures at once. get() hands out
+    jobs round-robin over the hosts that are allowed to start one, so a list
+    sorted by site still interleaves domains and no single origin sees the
+    whole pool.
+
+    Limits adapt to how the host responds (additive increase, multiplicative
+    decrease): a 429 or 503 halves the host's rate, drops its concurrency by
+    one and pauses it for Retry-After (or one token interval); a page load
+    more than twice as slow as the host's usual cuts the rate by a quarter;
+    every clean capture wins back a tenth of the configured rate, up to it.
+
+    Drop-in replacement for the queue of a CapturePool: put(), get() and
+    qsize() behave like queue.Queue's, including None shutdown sentinels,
+    which are only handed out once no jobs are left.
+    """
+
+    def __init__(self, rate=1.0, burst=2, max_per_host=2, max_pending=0, min_rate=0.05):
+        """
+        Args:
+            rate (float): Page loads per second allowed per host
+            burst (int): Page loads a host may receive back to back
+            max_per_host (int): Captures of one host running at once
+            max_pending (int): Jobs buffered before put() blocks, 0 for
+                unbounded; a larger buffer interleaves hosts better
+            min_rate (float): Floor for the adaptive rate of a host
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_per_host = max(1, max_per_host)
+        self.max_pending = max_pending
+        self.min_rate = min(min_rate, rate)
+        self._hosts = {}
+        self._ready = deque()
+        self._pending = 0
+        self._sentinels = 0
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def host(job):
+        url, parsed_url = normalize_url(job.url)
+        return (parsed_url.hostname or '').lower() if parsed_url is not None else ''
+
+    def put(self, job, block=True, timeout=None):
+        """Queue a job (or a None shutdown sentinel); raises queue.Full like queue.Queue"""
+        with self._cond:
+            if job is None:
+                self._sentinels += 1
+                self._cond.notify_all()
+                return
+            if self.max_pending:
+                deadline = time.monotonic() + timeout if timeout is not None else None
+                while self._pending >= self.max_pending:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if not block or (remaining is not None and remaining <= 0):
+                        raise queue.Full
+                    self._cond.wait(remaining)
+
+            host = self.host(job)
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = HostState(self.rate, self.burst, self.max_per_host)
+            if not state.jobs:
+                self._ready.append(host)
+            state.jobs.append(job)
+            self._pending += 1
+            self._cond.notify_all()
+
+    def retry(self, job):
+        """
+        Queue a job again after finished() reported it throttled
+
+        It goes to the front of its host's jobs and waits out the host's
+        pause like any other, so the retry can't outrun the backoff. The
+        max_pending bound doesn't apply: workers call this and must not block.
+        """
+        with self._cond:
+            host = self.host(job)
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = HostState(self.rate, self.burst, self.max_per_host)
+            if not state.jobs:
+                self._ready.append(host)
+            state.jobs.appendleft(job)
+            self._pending += 1
+            self._cond.notify_all()
+
+    def get(self):
+        """Block until some host may start its next job and return it (or a None sentinel)"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = None
+                for _ in range(len(self._ready)):
+                    host = self._ready.popleft()
+                    state = self._hosts[host]
+                    state.refill(now)
+                    host_wait = state.wait_time(now)
+                    if host_wait == 0:
+                        job = state.jobs.popleft()
+                        state.tokens -= 1
+                        state.active += 1
+                        self._pending -= 1
+                        if state.jobs:
+                            self._ready.append(host)
+                        self._cond.notify_all()
+                        return job
+                    self._ready.append(host)
+                    if host_wait is not None:
+                        wait = host_wait if wait is None else min(wait, host_wait)
+
+                if not self._pending and self._sentinels:
+                    self._sentinels -= 1
+                    return None
+                # Woken early by put() and finished(); otherwise when a token is due
+                self._cond.wait(wait)
+
+    def qsize(self):
+        with self._cond:
+            return self._pending
+
+    def finished(self, job, results):
+        """
+        Release a job's slot and adapt its host's limits to how it went
+
+        Args:
+            job (CaptureJob): A job returned by get()
+            results (list): Its CaptureResults (empty if the capture raised)
+        """
+        result = results[0] if results else None
+        status = getattr(result, 'http_status', None)
+        seconds = None
+        if result is not None and 'navigate' in result.phases:
+            seconds = result.phases['navigate'] + result.phases.get('wait', 0.0)
+
+        with self._cond:
+            state = self._hosts.get(self.host(job))
+            if state is None:
+                return
+            state.active = max(0, state.active - 1)
+            now = time.monotonic()
+            state.refill(now)
+
+            if status in THROTTLE_STATUSES:
+                state.throttled += 1
+                state.rate = max(self.min_rate, state.rate / 2)
+                state.max_active = max(1, state.max_active - 1)
+                pause = _seconds(getattr(result, 'retry_after', None)) or 1 / state.rate
+                state.blocked_until = max(state.blocked_until, now + pause)
+                state.tokens = min(state.tokens, 0.0)
+                print(f"{job.url}: HTTP {status}, slowing {self.host(job) or 'host'} to "
+                      f"{state.rate:.2f}/s for {pause:.1f}s")
+            elif seconds is not None and state.baseline and seconds > 2 * state.baseline:
+                state.rate = max(self.min_rate, state.rate * 0.75)
+            elif result is not None and result.ok:
+                state.rate = min(self.rate, state.rate + self.rate / 10)
+                if state.rate >= self.rate:
+                    state.max_active = min(self.max_per_host, state.max_active + 1)
+
+            if seconds is not None and status not in THROTTLE_STATUSES:
+                state.latency = seconds if state.latency is None else 0.8 * state.latency + 0.2 * seconds
+                state.baseline = state.latency if state.baseline is None else min(state.baseline, state.latency)
+
+            # Idle hosts keep their state so backoff survives a gap in the list
+            self._cond.notify_all()
+
+    def stats(self):
+        """Current rate, concurrency and queue length of every known host"""
+        with self._cond:
+            return {host: {'rate': round(state.rate, 3), 'max_active': state.max_active,
+                           'active': state.active, 'pending': len(state.jobs), 'throttled': state.throttled}
+                    for host, state in self._hosts.items()}
+
+
+def scheduler_from_args(args, max_pending=0):
+    """Build a HostScheduler from --host-rate/--host-burst/--per-host, or None"""
+    if not getattr(args, 'host_rate', None) and not getattr(args, 'per_host', None):
+        return None
+    return HostScheduler(
+        rate=args.host_rate or 1.0, burst=args.host_burst, max_per_host=args.per_host or 2,
+        max_pending=max_pending
+    )
+
+
+def _seconds(retry_after):
+    """Retry-After in seconds; HTTP dates are ignored"""
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        return None
@@ -1,20 +1,79 @@
 import os
-import datetime
+import json
 import time
+import shutil
 import argparse
-from urllib.parse import urlparse
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import WebDriverException, TimeoutException
-import base64
-from PIL import Image
-from io import BytesIO
+
+from blocking import BlockingStats, filter_from_args
+from cache import cache_from_args
+from changes import ChangeTracker, DocumentValidators, DOM_FINGERPRINT_SCRIPT
+from clip import element_clip, parse_clip, ElementNotFound
+from duplicates import duplicates_from_args, MAX_DISTANCE
+from failures import classify, retry_from_args, storable, DRIVER_FAILURES, RETRYABLE
+from httpcache import http_cache_from_args, DEFAULT_CACHE_MB
+from metrics import CaptureResult, metrics_from_args
+from pdf import write_pdf, pdf_options_from_args, PAPER_SIZES
+from readiness import NetworkIdleTracker, PageReadiness
+from tiling import capture_tiled, check_height, AUTO_TILE_HEIGHT, DEFAULT_TILE_HEIGHT
+from variants import parse_output_spec, passthrough, variant_output_path, write_variants
+from visualdiff import diffs_from_args
+from utils import (
+    normalize_url, default_output_path, screenshot_params, write_base64, parse_viewport, origin,
+    process_tree_rss,
+    viewport_output_path, OUTPUT_FORMATS, VIEWPORTS, DEFAULT_USER_AGENT,
+)
+
+# Ways of clearing browser state between captures (see WebPageCapture)
+ISOLATION_MODES = ('context', 'storage', None)
+
+PAGE_HEIGHT_SCRIPT = (
+    "return Math.max(document.body.scrollHeight, "
+    "document.documentElement.scrollHeight, "
+    "document.body.offsetHeight, "
+    "document.documentElement.offsetHeight, "
+    "document.body.clientHeight, "
+    "document.documentElement.clientHeight);"
+)
 
 class WebPageCapture:
-    def __init__(self, headless=True, timeout=30, wait_for_network=True):
+    def __init__(self, headless=True, timeout=30, wait_for_network=True,
+                 idle_time=0.5, max_wait=None, max_inflight=0,
+                 user_agent=DEFAULT_USER_AGENT, cache=None, changes=None, request_filter=None,
+                 metrics=None, postprocessor=None, isolation='context', max_captures=None,
+                 max_memory_mb=None, pdf_options=None, retry=None, diffs=None, duplicates=None,
+                 http_cache=None):
+        """
+        Args:
+            isolation (str): How browser state is cleared between captures:
+                'context' opens every page in a fresh browser context (cookies,
+                cache, storage and service workers all start empty), 'storage'
+                clears cookies, cache and the storage of visited origins, and
+                None keeps state between captures
+            max_captures (int): Restart Chrome after this many page loads
+            max_memory_mb (int): Restart Chrome once chromedriver and its
+                browser processes use more than this much memory
+            pdf_options (dict): Paper size, page ranges and orientation of PDF
+                output, from pdf.pdf_options()
+            retry (RetryPolicy): Retry failed captures, replacing Chrome
+                first if it crashed; None captures once
+            diffs (VisualDiffStore): Compare every fresh image capture with
+                the previous capture of the same page
+            duplicates (DuplicateIndex): Hash every fresh image capture and
+                flag (or drop) near-duplicates of earlier captures
+            http_cache (SharedHttpCache): Give Chrome a persistent disk cache
+                seeded from earlier browsers. Browser contexts keep their
+                cache in memory, so 'context' isolation becomes 'storage',
+                which then keeps the HTTP cache.
+        """
+        if isolation not in ISOLATION_MODES:
+            raise ValueError(f"Invalid isolation mode: {isolation}")
+        if http_cache and isolation == 'context':
+            isolation = 'storage'
+            
         # Configure Chrome options
         chrome_options = Options()
         if headless:
@@ -26,176 +85,923 @@ class WebPageCapture:
         chrome_options.add_argument("--start-maximized")
         
         # Add user agent to prevent anti-bot measures
-        chrome_options.add_argument("--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36")
+        chrome_options.add_argument(f"--user-agent={user_agent}")
         
+        # Record CDP Network/Page events so readiness can be event driven
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        
+        # A disk cache outside Chrome's throwaway profile
+        self.http_cache = http_cache
+        self._http_cache_dir = None
+        if http_cache:
+            self._http_cache_dir = http_cache.checkout()
+            for argument in http_cache.chrome_arguments(self._http_cache_dir):
+                chrome_options.add_argument(argument)
+        
+        self.chrome_options = chrome_options
+        self.timeout = timeout
         self.driver = None
+        self._init_seconds = None
+        try:
+            self._start_driver()
+        except Exception:
+            if self._http_cache_dir:
+                http_cache.checkin(self._http_cache_dir)
+            raise
+            
+        self.isolation = isolation
+        self.max_captures = max_captures
+        self.max_memory_mb = max_memory_mb
+        self.page_loads = 0
+        self.recycled = 0
+        self._context_id = None
+        self._origins = set()
+        self.wait_for_network = wait_for_network
+        self.user_agent = user_agent
+        self.cache = cache
+        self.changes = changes
+        self.metrics = metrics
+        self.postprocessor = postprocessor
+        self.pdf_options = pdf_options
+        self.retry = retry
+        self.diffs = diffs
+        self.duplicates = duplicates
+        # Passed to every CaptureResult, e.g. to report progress (see CapturePool)
+        self.on_phase = None
+        self.readiness = PageReadiness(
+            idle_time=idle_time,
+            max_wait=max_wait if max_wait is not None else timeout,
+            max_inflight=max_inflight,
+        )
+        self.network = NetworkIdleTracker(max_inflight=max_inflight)
+        self.validators = DocumentValidators()
+        self.event_listeners = [self.network.feed, self.validators.feed]
+        if http_cache:
+            self.event_listeners.append(http_cache.feed)
+        
+        # Block requests the capture doesn't need before they are sent
+        self.request_filter = request_filter
+        # Part of cache keys, since blocked requests change what a page shows
+        self.blocked = request_filter.blocked_url_patterns() if request_filter else None
+        self.blocking = None
+        if request_filter:
+            self.blocking = BlockingStats(request_filter)
+            self.event_listeners.append(self.blocking.feed)
+        self._setup_target()
+        
+    def _start_driver(self):
+        """Start Chrome; the time taken is reported as the next capture's driver_init phase"""
+        started = time.monotonic()
         try:
-            self.driver = webdriver.Chrome(service=Service(), options=chrome_options)
-            self.driver.set_page_load_timeout(timeout)
+            self.driver = webdriver.Chrome(service=Service(), options=self.chrome_options)
+            self.driver.set_page_load_timeout(self.timeout)
         except Exception as e:
             print(f"Error initializing Chrome driver: {e}")
             raise
+        self._init_seconds = (self._init_seconds or 0) + time.monotonic() - started
+        
+    def _setup_target(self):
+        """Per-tab setup, repeated whenever captures move to a new tab"""
+        if self.request_filter:
+            self.driver.execute_cdp_cmd("Network.enable", {})
+            self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.request_filter.blocked_url_patterns()})
             
-        self.timeout = timeout
-        self.wait_for_network = wait_for_network
+    def reset(self):
+        """
+        Give the next capture a clean browser without restarting Chrome
+        
+        Recycles Chrome instead when it has served max_captures page loads,
+        grown past max_memory_mb or stopped responding.
+        """
+        reason = self._recycle_reason()
+        if reason:
+            print(f"Restarting Chrome ({reason})")
+            self.recycle()
+            return
+            
+        if self.isolation == 'context':
+            self._new_context()
+        elif self.isolation == 'storage':
+            self._clear_storage()
+        # Undo the previous capture's full-page resize before the next layout
+        self.driver.execute_cdp_cmd("Emulation.clearDeviceMetricsOverride", {})
+        self.driver.set_window_size(1920, 1080)
+        
+    def recycle(self):
+        """Replace Chrome with a fresh instance, keeping its disk cache"""
+        self._quit()
+        self._context_id = None
+        self._origins.clear()
+        self.page_loads = 0
+        self.recycled += 1
+        self._start_driver()
+        self._setup_target()
+        
+    def _recycle_reason(self):
+        """Why Chrome should be restarted before the next capture, or None"""
+        if self.max_captures and self.page_loads >= self.max_captures:
+            return f"{self.page_loads} page loads"
+        if self.max_memory_mb:
+            rss = self.browser_memory()
+            if rss is not None and rss > self.max_memory_mb * 1024 * 1024:
+                return f"{rss / 1e6:.0f} MB in use"
+        try:
+            self.driver.execute_script("return 1")
+        except WebDriverException:
+            return "not responding"
+        return None
         
-    def capture(self, url, output_format='png', output_path=None, quality=90, width=1920, height=None):
+    def browser_memory(self):
+        """Resident memory in bytes of chromedriver and the browser it started, or None"""
+        try:
+            pid = self.driver.service.process.pid
+        except AttributeError:
+            return None
+        return process_tree_rss(pid)
+        
+    def _new_context(self):
+        """Move to a blank tab in a new browser context and drop the previous one"""
+        old_target = self.driver.current_window_handle
+        old_context = self._context_id
+        context = self.driver.execute_cdp_cmd("Target.createBrowserContext", {})
+        target = self.driver.execute_cdp_cmd("Target.createTarget", {
+            "url": "about:blank", "browserContextId": context["browserContextId"],
+        })
+        # ChromeDriver's window handles are DevTools target ids
+        self.driver.switch_to.window(target["targetId"])
+        self._context_id = context["browserContextId"]
+        try:
+            self.driver.execute_cdp_cmd("Target.closeTarget", {"targetId": old_target})
+            if old_context:
+                self.driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": old_context})
+        except WebDriverException as e:
+            print(f"Could not dispose of the previous browser context: {e}")
+        self._setup_target()
+        
+    def _clear_storage(self):
+        """Clear cookies, the HTTP cache (unless shared) and all storage of the origins visited so far"""
+        self.driver.get("about:blank")
+        self.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        if not self.http_cache:
+            self.driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        for origin in self._origins:
+            # 'all' includes service workers, Cache Storage and IndexedDB
+            self.driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        self._origins.clear()
+        
+    def capture(self, url, output_format='png', output_path=None, quality=90, width=1920, height=None,
+                tile_height=None, tiles_dir=None, outputs=None, selector=None, clip=None):
         """
         Capture a webpage screenshot or PDF
         
         Args:
             url (str): URL to capture
-            output_format (str): 'png', 'jpg', or 'pdf'
+            output_format (str): 'png', 'jpg', 'webp', or 'pdf'
             output_path (str): Custom output path, or None for auto-generated
-            quality (int): JPEG quality (1-100) if jpg format
+            quality (int): JPEG/WebP quality (1-100) if jpg or webp format
             width (int): Viewport width
             height (int): Viewport height (None for full page)
+            tile_height (int): Capture full pages in clips of this height instead
+                of resizing the window to the whole page (automatic above
+                AUTO_TILE_HEIGHT px)
+            tiles_dir (str): Also save each tile of a tiled capture here
+            outputs (list): Output specs to produce from one render instead of a
+                single output_format (see capture_outputs())
+            selector (str): Capture only the first element matching this CSS
+                selector, scrolled into view at the viewport size
+            clip: Capture only this page region (see clip.parse_clip());
+                like selector, the page isn't resized to its full height
         
         Returns:
-            str: Path to saved file
+            str: Path to saved file, or a list of paths (None for failures) if
+                outputs was given; capture_result() tells failures apart
         """
-        if not self.driver:
-            print("Driver not initialized")
-            return None
+        if outputs:
+            return [result.wait().path for result in
+                    self.capture_outputs(url, outputs, output_path, width, height, tile_height)]
+        return self.capture_result(url, output_format, output_path, quality, width, height,
+                                   tile_height, tiles_dir, selector, clip).path
+        
+    def capture_result(self, url, output_format='png', output_path=None, quality=90, width=1920,
+                       height=None, tile_height=None, tiles_dir=None, selector=None, clip=None):
+        """
+        Capture like capture(), but return a CaptureResult
+        
+        The result has the path or the error and its class (error_type, e.g.
+        'DNS', 'Timeout' or 'RendererCrash', see failures.classify()), where
+        the artifact came from ('capture', 'cache' or 'unchanged'), the
+        number of attempts and the time spent in each phase.
+        It is also passed to the metrics collector, if there is one.
+        """
+        def attempt():
+            result = self._take_init_time(CaptureResult(url, output_format, output_path, self.on_phase))
+            self._capture(result, url, output_format, output_path, quality, width, height,
+                          tile_height, tiles_dir, selector, clip)
+            return [result.finish()]
             
+        result, = self._retrying(attempt)
+        if self.metrics:
+            self.metrics.observe(result)
+        return result
+        
+    def _take_init_time(self, result):
+        """Charge pending Chrome start-up time to result's driver_init phase"""
+        if self._init_seconds is not None:
+            result.add_time('driver_init', self._init_seconds)
+            self._init_seconds = None
+        return result
+        
+    def _retrying(self, attempt):
+        """
+        Run attempt() under the retry policy and return the last attempt's results
+        
+        attempt() captures once and returns its finished CaptureResults.
+        Between attempts Chrome is replaced if it crashed, and the backoff
+        delay is slept. The final results carry the number of attempts, and
+        the time spent on earlier ones as their 'retry' phase.
+        """
+        started = time.monotonic()
+        number = 1
+        while True:
+            attempt_started = time.monotonic()
+            results = attempt()
+            failure = self.retry.failure(results, number) if self.retry else None
+            if failure is None:
+                break
+            delay = self.retry.delay(number, results[0].retry_after if failure == 'Throttled' else None)
+            print(f"{failure} capturing {results[0].url}, retrying in {delay:.1f}s "
+                  f"(attempt {number + 1} of {self.retry.attempts})")
+            if failure in DRIVER_FAILURES or not self.driver:
+                try:
+                    self.recycle()
+                except Exception as e:
+                    # The next attempt fails as DriverNotInitialized and tries again
+                    print(f"Could not replace Chrome: {e}")
+            time.sleep(delay)
+            number += 1
+        for result in results:
+            result.attempts = number
+            if number > 1:
+                result.add_time('retry', attempt_started - started)
+        return results
+        
+    def _capture(self, result, url, output_format, output_path, quality, width, height,
+                 tile_height, tiles_dir, selector=None, clip=None):
         # Validate URL
-        if not url.startswith(("http://", "https://")):
-            url = "https://" + url
-            
-        try:
-            parsed_url = urlparse(url)
-            if not parsed_url.netloc:
-                print("Invalid URL format")
-                return None
-        except Exception:
-            print("Invalid URL")
-            return None
+        url, parsed_url = normalize_url(url)
+        if parsed_url is None:
+            print("Invalid URL format")
+            result.fail("Invalid URL format", 'InvalidURL')
+            return
             
         # Validate format
-        if output_format not in ['png', 'jpg', 'pdf']:
+        if output_format not in OUTPUT_FORMATS:
             print(f"Invalid format: {output_format}. Using png instead.")
             output_format = 'png'
+            result.output_format = output_format
+            
+        # Element and region captures are images of part of the page
+        region = selector or clip
+        if region and output_format == 'pdf':
+            print("Selector and clip captures need an image format")
+            result.fail("Selector and clip captures need an image format", 'InvalidOptions')
+            return
+        if region and (tile_height or tiles_dir):
+            print("Selector and clip captures can't be tiled")
+            result.fail("Selector and clip captures can't be tiled", 'InvalidOptions')
+            return
+        if clip:
+            try:
+                clip = parse_clip(clip)
+            except ValueError as e:
+                print(e)
+                result.fail(e, 'InvalidOptions')
+                return
             
         # Generate output path if not provided
+        requested_path = output_path
         if not output_path:
-            domain = parsed_url.netloc.replace("www.", "")
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            desktop = os.path.join(os.path.expanduser("~"), "Desktop")
+            output_path = default_output_path(parsed_url, output_format)
+        result.output_path = output_path
             
-            if output_format == 'pdf':
-                output_path = os.path.join(desktop, f"{domain}_{timestamp}.pdf")
-            else:
-                output_path = os.path.join(desktop, f"{domain}_{timestamp}.{output_format}")
+        # Serve repeat captures from the cache without touching Chrome
+        # (cache, change and diff state are keyed on whole pages)
+        if self.cache and not region:
+            with result.phase('cache'):
+                cached = self.cache.fetch(url, output_format, output_path, quality, width, height,
+                                          self.user_agent, self.pdf_options, self.blocked)
+            if cached:
+                print(f"Cache hit, saved to: {cached}")
+                result.succeed(cached, source='cache')
+                return
+                
+        if not self.driver:
+            print("Driver not initialized")
+            result.fail("Driver not initialized", 'DriverNotInitialized')
+            return
                 
         # Load the webpage
         print(f"Loading {url}...")
         try:
-            self.driver.get(url)
-            
-            # Wait for page to be fully loaded
-            if self.wait_for_network:
-                self._wait_for_page_load()
-                
-            # Set viewport size
-            if width and height:
-                self.driver.set_window_size(width, height)
-            elif width:
-                # Get page height for full page capture
-                total_height = self.driver.execute_script(
-                    "return Math.max(document.body.scrollHeight, "
-                    "document.documentElement.scrollHeight, "
-                    "document.body.offsetHeight, "
-                    "document.documentElement.offsetHeight, "
-                    "document.body.clientHeight, "
-                    "document.documentElement.clientHeight);"
-                )
-                self.driver.set_window_size(width, total_height)
-                
-            # Small delay to ensure rendering is complete
-            time.sleep(1)
-                
-            # Capture based on format choice
-            if output_format == 'pdf':
-                success = self._capture_pdf(output_path)
-            else:
-                success = self._capture_image(output_path, output_format, quality)
+            self._load(url, result)
                 
+            # Skip rendering entirely if neither the validators nor the DOM changed
+            dom_hash = None
+            keep = storable(result.http_status, self.retry)
+            # Change state and diff baselines are kept per set of capture options
+            key = ChangeTracker.key(url, output_format, quality, width, height,
+                                    self.user_agent, self.pdf_options, self.blocked)
+            if self.changes and not region and keep:
+                with result.phase('fingerprint'):
+                    self._poll_cdp_events()
+                    dom_hash = self.driver.execute_script(DOM_FINGERPRINT_SCRIPT)
+                    previous = self.changes.unchanged(key, self.validators, dom_hash)
+                if previous:
+                    if requested_path and os.path.abspath(requested_path) != previous:
+                        shutil.copyfile(previous, requested_path)
+                        previous = requested_path
+                    print(f"Unchanged since last capture: {previous}")
+                    result.succeed(previous, source='unchanged')
+                    return
+                    
+            success = self._render(result, output_path, output_format, quality, width, height,
+                                   tile_height, tiles_dir, selector=selector, clip=clip)
+            # Diffed before a dropped duplicate is replaced by its original
+            if success and not region and keep and self.diffs and output_format != 'pdf':
+                with result.phase('diff'):
+                    result.diff = self.diffs.compare(key, output_format, output_path)
+                if result.diff and result.diff.compared:
+                    print(f"Visual change: {result.diff.score:.2%} of pixels in "
+                          f"{len(result.diff.boxes)} region(s)")
+            source = 'capture'
+            if success and self.duplicates and output_format != 'pdf':
+                with result.phase('dedupe'):
+                    if self._dedupe(result, url, output_path):
+                        print(f"Duplicate of {result.duplicate_of['url']}, "
+                              f"replaced with a copy of {result.duplicate_of['path']}")
+                        source = 'duplicate'
+            if success and not region and keep:
+                if self.cache:
+                    self.cache.store(output_path, url, output_format, quality, width, height,
+                                     self.user_agent, self.pdf_options, self.blocked)
+                if self.changes:
+                    self.changes.record(key, self.validators, dom_hash, output_path)
             if success:
+                if self.blocking:
+                    self._poll_cdp_events()
+                    self.blocking.log()
                 print(f"Saved to: {output_path}")
-                return output_path
+                result.succeed(output_path, source=source)
+            else:
+                result.fail(f"Could not write {output_format} output", 'CaptureFailed')
                 
-        except TimeoutException:
+        except TimeoutException as e:
             print(f"Timeout loading page: {url}")
+            result.fail(e.msg or f"Timeout loading page: {url}", 'Timeout')
+        except ElementNotFound as e:
+            print(e)
+            result.fail(e, 'ElementNotFound')
         except WebDriverException as e:
             print(f"WebDriver error: {e}")
+            result.fail(e, classify(e, 'WebDriverError'))
         except Exception as e:
             print(f"Unexpected error: {e}")
+            result.fail(e, classify(e))
             
-        return None
+    def _dedupe(self, result, url, output_path):
+        """
+        Look a fresh capture up in the duplicate index
+        
+        A dropped duplicate is replaced with a copy of the earlier capture,
+        so output_path stays the result's path either way. Not a hard link:
+        a later capture to either path would overwrite both.
+        
+        Returns:
+            bool: True if the capture was dropped in favour of the earlier one
+        """
+        try:
+            value, match = self.duplicates.check(url, output_path)
+        except Exception as e:
+            print(f"Could not hash {output_path}: {e}")
+            return False
+        result.phash = f"{value:016x}"
+        if match is None:
+            return False
+        distance, original_url, original_path = match
+        result.duplicate_of = {'url': original_url, 'path': original_path, 'distance': distance}
+        if not self.duplicates.drop or not os.path.isfile(original_path):
+            return False
+        partial = f"{output_path}.tmp"
+        shutil.copyfile(original_path, partial)
+        os.replace(partial, output_path)
+        return True
+        
+    def capture_viewports(self, url, viewports, output_format='png', output_path=None, quality=90,
+                          full_page=True, tile_height=None):
+        """
+        Capture one page load at several viewport sizes
+        
+        The page is loaded and waited for once; every viewport is then applied
+        with Emulation.setDeviceMetricsOverride, re-laid out, settled and
+        captured. Viewports that can be served from the cache are skipped, and
+        if all of them are, the page isn't loaded at all.
+        
+        Args:
+            url (str): URL to capture
+            viewports (list): Viewport dicts from parse_viewport() or specs
+                it accepts, e.g. 'mobile', '1280' or '1440x900@2'
+            output_format (str): 'png', 'jpg', 'webp', or 'pdf'
+            output_path (str): Path template; each viewport's name is inserted
+                before the extension. None for auto-generated paths.
+            quality (int): JPEG/WebP quality (1-100) if jpg or webp format
+            full_page (bool): Capture the whole page height at each width
+            tile_height (int): Tile full pages in clips of this height
+        
+        Returns:
+            list: A CaptureResult per viewport, in order
+        """
+        viewports = [parse_viewport(viewport) for viewport in viewports]
+        
+        def attempt():
+            results = [CaptureResult(url, output_format, on_phase=self.on_phase) for viewport in viewports]
+            for result, viewport in zip(results, viewports):
+                result.viewport = viewport['name']
+            self._take_init_time(results[0])
+            try:
+                self._capture_viewports(results, url, viewports, output_format, output_path, quality,
+                                        full_page, tile_height)
+            finally:
+                self._fail_unfinished(results, "Not captured", 'CaptureFailed')
+            return results
             
-    def _wait_for_page_load(self):
-        """Wait for page to be fully loaded including network idle"""
+        results = self._retrying(attempt)
+        for result in results:
+            if self.metrics:
+                self.metrics.observe(result)
+        return results
+        
+    def _capture_viewports(self, results, url, viewports, output_format, output_path, quality,
+                           full_page, tile_height):
+        url, parsed_url = normalize_url(url)
+        if parsed_url is None:
+            print("Invalid URL format")
+            for result in results:
+                result.fail("Invalid URL format", 'InvalidURL')
+            return
+        if output_format not in OUTPUT_FORMATS:
+            print(f"Invalid format: {output_format}. Using png instead.")
+            output_format = 'png'
+            
+        # Emulated devices render differently from a plain window of the same
+        # width, so only plain viewports share cache entries with capture()
+        pending = []
+        for result, viewport in zip(results, viewports):
+            result.output_format = output_format
+            result.output_path = viewport_output_path(output_path, parsed_url, output_format, viewport['name'])
+            height = None if full_page else viewport['height']
+            plain = viewport['scale'] == 1 and not viewport['mobile']
+            if self.cache and plain:
+                with result.phase('cache'):
+                    cached = self.cache.fetch(url, output_format, result.output_path, quality, viewport['width'],
+                                              height, self.user_agent, self.pdf_options, self.blocked)
+                if cached:
+                    print(f"Cache hit, saved to: {cached}")
+                    result.succeed(cached, source='cache')
+                    continue
+            pending.append((result, viewport, height, plain))
+        if not pending:
+            return
+        if not self.driver:
+            print("Driver not initialized")
+            for result, viewport, height, plain in pending:
+                result.fail("Driver not initialized", 'DriverNotInitialized')
+            return
+            
+        print(f"Loading {url}...")
         try:
-            # First wait for document ready state
-            WebDriverWait(self.driver, self.timeout).until(
-                lambda d: d.execute_script("return document.readyState") == "complete"
+            # Load at the first viewport so the initial layout is already a useful one
+            first = pending[0][1]
+            self._load(url, pending[0][0], prepare=lambda: self._emulate(first, first['height']))
+            keep = storable(pending[0][0].http_status, self.retry)
+            
+            for result, viewport, height, plain in pending:
+                try:
+                    if not self._render(result, result.output_path, output_format, quality,
+                                        viewport['width'], height, tile_height, device=viewport):
+                        result.fail(f"Could not write {output_format} output", 'CaptureFailed')
+                        continue
+                except WebDriverException as e:
+                    print(f"WebDriver error at {viewport['name']}: {e}")
+                    result.fail(e, classify(e, 'WebDriverError'))
+                    continue
+                except Exception as e:
+                    print(f"Error capturing {viewport['name']}: {e}")
+                    result.fail(e, classify(e))
+                    continue
+                if self.cache and plain and keep:
+                    self.cache.store(result.output_path, url, output_format, quality, viewport['width'],
+                                     height, self.user_agent, self.pdf_options, self.blocked)
+                print(f"Saved {viewport['name']} to: {result.output_path}")
+                result.succeed(result.output_path)
+                
+            if self.blocking:
+                self._poll_cdp_events()
+                self.blocking.log()
+        except TimeoutException as e:
+            print(f"Timeout loading page: {url}")
+            self._fail_unfinished(results, e.msg or f"Timeout loading page: {url}", 'Timeout')
+        except WebDriverException as e:
+            print(f"WebDriver error: {e}")
+            self._fail_unfinished(results, e, classify(e, 'WebDriverError'))
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+            self._fail_unfinished(results, e, classify(e))
+        finally:
+            try:
+                self.driver.execute_cdp_cmd("Emulation.clearDeviceMetricsOverride", {})
+                self.driver.execute_cdp_cmd("Emulation.setTouchEmulationEnabled", {"enabled": False})
+            except WebDriverException:
+                pass
+            
+    @staticmethod
+    def _fail_unfinished(results, error, error_type):
+        for result in results:
+            if result.total_seconds is None and not result.deferred:
+                result.fail(error, error_type)
+                
+    def capture_outputs(self, url, outputs, output_path=None, width=1920, height=None, tile_height=None):
+        """
+        Produce several artifacts of one page from a single load and render
+        
+        The page is loaded, sized and settled once. Image outputs are derived
+        from one full-size PNG render, decoded at most once; a single
+        full-size image output is encoded natively by Chrome instead. PDFs are
+        printed afterwards from the same DOM state.
+        
+        With a postprocessor, derived variants are encoded in its worker
+        processes while this capture moves on; their results are `deferred`
+        and finish later (see CaptureResult.wait()).
+        
+        Args:
+            url (str): URL to capture
+            outputs (list): Output specs, as dicts or strings accepted by
+                parse_output_spec(), e.g. ['png', 'jpg:quality=70,width=400', 'pdf']
+            output_path (str): Path template for specs without their own path
+            width (int): Viewport width
+            height (int): Viewport height (None for full page)
+            tile_height (int): Tile full pages in clips of this height
+        
+        Returns:
+            list: A CaptureResult per output spec, in order
+        """
+        specs = [parse_output_spec(spec) for spec in outputs]
+        
+        def attempt():
+            results = [CaptureResult(url, spec['format'], on_phase=self.on_phase) for spec in specs]
+            self._take_init_time(results[0])
+            try:
+                self._capture_outputs(results, url, specs, output_path, width, height, tile_height)
+            finally:
+                self._fail_unfinished(results, "Not captured", 'CaptureFailed')
+            return results
+            
+        results = self._retrying(attempt)
+        for result in results:
+            if self.metrics and not result.deferred:
+                self.metrics.observe(result)
+        return results
+        
+    def _capture_outputs(self, results, url, specs, output_path, width, height, tile_height):
+        url, parsed_url = normalize_url(url)
+        if parsed_url is None:
+            print("Invalid URL format")
+            self._fail_unfinished(results, "Invalid URL format", 'InvalidURL')
+            return
+            
+        # Full-size outputs are the same artifact capture() would produce, so
+        # they share its cache entries
+        pending = []
+        for result, spec in zip(results, specs):
+            result.output_path = variant_output_path(output_path, parsed_url, spec)
+            if self.cache and passthrough(spec):
+                with result.phase('cache'):
+                    cached = self.cache.fetch(url, spec['format'], result.output_path, spec['quality'], width,
+                                              height, self.user_agent, self.pdf_options, self.blocked)
+                if cached:
+                    print(f"Cache hit, saved to: {cached}")
+                    result.succeed(cached, source='cache')
+                    continue
+            pending.append((result, spec))
+        if not pending:
+            return
+        if not self.driver:
+            print("Driver not initialized")
+            self._fail_unfinished(results, "Driver not initialized", 'DriverNotInitialized')
+            return
+            
+        print(f"Loading {url}...")
+        first = pending[0][0]
+        images = [(result, spec) for result, spec in pending if spec['format'] != 'pdf']
+        pdfs = [(result, spec) for result, spec in pending if spec['format'] == 'pdf']
+        try:
+            self._load(url, first)
+            keep = storable(first.http_status, self.retry)
+            
+            if len(images) == 1 and passthrough(images[0][1]):
+                result, spec = images[0]
+                if not self._render(first, result.output_path, spec['format'], spec['quality'],
+                                    width, height, tile_height):
+                    result.fail(f"Could not write {spec['format']} output", 'CaptureFailed')
+            elif images:
+                # Render into the full-size PNG output if there is one, else a scratch file
+                source = next((result.output_path for result, spec in images
+                               if spec['format'] == 'png' and passthrough(spec)), None)
+                scratch = None
+                if source is None:
+                    scratch = source = f"{images[0][0].output_path}.render.png"
+                try:
+                    if not self._render(first, source, 'png', 90, width, height, tile_height):
+                        raise RuntimeError("Could not render the page")
+                    variants = [(result, spec) for result, spec in images if result.output_path != source]
+                    if self.postprocessor and variants:
+                        self._defer_variants(url, source, scratch, variants, width, height, keep)
+                        scratch = None
+                    else:
+                        write_variants(source, [spec for result, spec in images],
+                                       [result.output_path for result, spec in images],
+                                       timer=first, timers=[result for result, spec in images])
+                finally:
+                    if scratch and os.path.exists(scratch):
+                        os.remove(scratch)
+            elif pdfs:
+                result = pdfs[0][0]
+                if not self._render(result, result.output_path, 'pdf', 90, width, height):
+                    result.fail("Could not write pdf output", 'CaptureFailed')
+                
+            for result, spec in pdfs:
+                # The first PDF was written by _render() when there are no images
+                if images or result is not pdfs[0][0]:
+                    if not self._capture_pdf(result.output_path, result):
+                        result.fail("Could not write pdf output", 'CaptureFailed')
+                        
+            for result, spec in pending:
+                if result.total_seconds is not None or result.deferred:
+                    continue
+                if self.cache and passthrough(spec) and keep:
+                    self.cache.store(result.output_path, url, spec['format'], spec['quality'],
+                                     width, height, self.user_agent, self.pdf_options, self.blocked)
+                print(f"Saved {spec['format']} to: {result.output_path}")
+                result.succeed(result.output_path)
+                
+            if self.blocking:
+                self._poll_cdp_events()
+                self.blocking.log()
+        except TimeoutException as e:
+            print(f"Timeout loading page: {url}")
+            self._fail_unfinished(results, e.msg or f"Timeout loading page: {url}", 'Timeout')
+        except WebDriverException as e:
+            print(f"WebDriver error: {e}")
+            self._fail_unfinished(results, e, classify(e, 'WebDriverError'))
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+            self._fail_unfinished(results, e, classify(e))
+            
+    def _defer_variants(self, url, source, scratch, variants, width, height, keep=True):
+        """Hand variant encoding to the post-processor; the results finish when it does"""
+        for result, spec in variants:
+            result.deferred = True
+        future = self.postprocessor.submit(source, [spec for result, spec in variants],
+                                           [result.output_path for result, spec in variants])
+        
+        def done(future):
+            try:
+                timings = future.result()
+                error = None
+            except Exception as e:
+                timings = None
+                error = e
+            for index, (result, spec) in enumerate(variants):
+                if error is not None:
+                    print(f"Post-processing error for {result.output_path}: {error}")
+                    result.fail(error)
+                else:
+                    for name, seconds in timings[index].items():
+                        result.add_time(name, seconds)
+                    if self.cache and passthrough(spec) and keep:
+                        self.cache.store(result.output_path, url, spec['format'], spec['quality'],
+                                         width, height, self.user_agent, self.pdf_options, self.blocked)
+                    print(f"Saved {spec['format']} to: {result.output_path}")
+                    result.succeed(result.output_path)
+                if self.metrics:
+                    self.metrics.observe(result)
+            if scratch and os.path.exists(scratch):
+                os.remove(scratch)
+                
+        future.add_done_callback(done)
+        
+    def _load(self, url, result, prepare=None):
+        """
+        Reset the browser, navigate to url and wait until it is ready, timing all on result
+        
+        prepare() is called after the reset, just before navigating.
+        """
+        if self.page_loads:
+            with result.phase('reset'):
+                self.reset()
+            self._take_init_time(result)
+        if prepare:
+            prepare()
+        self.page_loads += 1
+        
+        # Discard events left over from the previous page
+        with result.phase('navigate'):
+            self._poll_cdp_events()
+            self.network.reset()
+            self.validators.reset()
+            if self.blocking:
+                self.blocking.begin_page()
+            self.driver.get(url)
+            for visited in (url, self.driver.current_url):
+                if visited.startswith(('http://', 'https://')):
+                    self._origins.add(origin(visited))
+            
+        # Wait for page to be fully loaded
+        if self.wait_for_network:
+            with result.phase('wait'):
+                self._wait_for_page_load()
+        else:
+            self._poll_cdp_events()
+        result.http_status = self.validators.status
+        result.retry_after = self.validators.retry_after
+                
+    def _render(self, result, output_path, output_format, quality, width, height,
+                tile_height=None, tiles_dir=None, device=None, selector=None, clip=None):
+        """
+        Size the viewport, let it settle and write the output
+        
+        Without a device the browser window is resized; with one (a viewport
+        dict) the size, scale and mobile mode are emulated instead. With a
+        selector or clip only that part of the page is captured, at the
+        viewport size.
+        
+        Returns:
+            bool: True if the output was written
+        """
+        if selector or clip:
+            return self._render_region(result, output_path, output_format, quality, width, height,
+                                       selector, clip)
+            
+        # Set viewport size
+        result.enter('resize')
+        tiled_height = None
+        resize_started = time.monotonic()
+        if width and height:
+            self._resize(width, height, device)
+        elif width:
+            if device:
+                # Lay the page out at the device width before measuring it
+                self._resize(width, device['height'], device)
+            # Get page height for full page capture
+            total_height = self.driver.execute_script(PAGE_HEIGHT_SCRIPT)
+            # Before resizing the window or capturing any tiles
+            check_height(output_format, total_height)
+            if output_format != 'pdf' and (tile_height or tiles_dir or total_height > AUTO_TILE_HEIGHT):
+                # Tiled capture keeps the viewport and clips the page piecewise
+                tiled_height = total_height
+                if not device:
+                    self._resize(width, self.driver.get_window_size()['height'])
+            else:
+                self._resize(width, total_height, device)
+        result.add_time('resize', time.monotonic() - resize_started)
+            
+        # Wait for the resize to be painted and anything it triggered to load
+        with result.phase('settle'):
+            self._settle()
+            
+        # Capture based on format choice
+        if output_format == 'pdf':
+            return self._capture_pdf(output_path, result)
+        if tiled_height:
+            capture_tiled(
+                self.driver.execute_cdp_cmd, output_path, width, tiled_height,
+                output_format, quality, tile_height or DEFAULT_TILE_HEIGHT, tiles_dir,
+                timer=result
             )
+            return True
+        return self._capture_image(output_path, output_format, quality, result)
+        
+    def _render_region(self, result, output_path, output_format, quality, width, height, selector, clip):
+        """
+        Capture one element or page region without laying out the full page height
+        
+        The window keeps its height (or takes the requested one) and is only
+        resized if the width differs. Chrome renders the clip, scrolled into
+        view for an element, with captureBeyondViewport covering any part
+        that is taller than the viewport.
+        """
+        with result.phase('resize'):
+            size = self.driver.get_window_size()
+            if size['width'] != width or (height and size['height'] != height):
+                self._resize(width, height or size['height'])
+                
+        # Lazy content of the element is loaded once it's scrolled into view
+        with result.phase('settle'):
+            if selector:
+                element_clip(self.driver.execute_cdp_cmd, selector)
+            self._settle()
+        if selector:
+            # Settling can move the element, e.g. when images above it load
+            clip = element_clip(self.driver.execute_cdp_cmd, selector)
+        return self._capture_image(output_path, output_format, quality, result, clip)
+        
+    def _resize(self, width, height, device=None):
+        if device:
+            self._emulate(device, height, width)
+        else:
+            self.driver.set_window_size(width, height)
             
-            # Then check for network idle (optional but helps with SPAs)
-            time.sleep(2)  # Additional buffer for network requests
+    def _emulate(self, device, height, width=None):
+        """Emulate a viewport dict's scale and mobile mode at the given size"""
+        self.driver.execute_cdp_cmd("Emulation.setDeviceMetricsOverride", {
+            "width": width or device['width'],
+            "height": height,
+            "deviceScaleFactor": device['scale'],
+            "mobile": device['mobile'],
+        })
+        self.driver.execute_cdp_cmd("Emulation.setTouchEmulationEnabled", {"enabled": device['mobile']})
             
-        except TimeoutException:
+    def _wait_for_page_load(self):
+        """Wait for page to be fully loaded including network idle"""
+        ready = self.readiness.wait(self.driver, self._poll_cdp_events, self.network)
+        if not ready:
             print("Timeout waiting for page to load completely")
             # Continue anyway, we'll capture what we have
             
-    def _capture_image(self, output_path, format_choice, quality=90):
-        """Capture screenshot as PNG or JPG"""
+    def _settle(self):
+        """Wait for pending paint and, if enabled, network activity to finish"""
+        if self.wait_for_network:
+            self.readiness.settle(self.driver, self._poll_cdp_events, self.network)
+        else:
+            self.readiness.settle(self.driver)
+            
+    def _poll_cdp_events(self):
+        """Read pending CDP events from Chrome's performance log and dispatch them"""
         try:
-            # Try to use CDP for full page screenshot first (better quality)
+            entries = self.driver.get_log("performance")
+        except WebDriverException:
+            return
+        for entry in entries:
+            message = json.loads(entry["message"])["message"]
+            method = message.get("method", "")
+            params = message.get("params", {})
+            timestamp = entry.get("timestamp", 0) / 1000.0 or None
+            for listener in self.event_listeners:
+                listener(method, params, timestamp)
+            
+    def _capture_image(self, output_path, format_choice, quality=90, result=None, clip=None):
+        """Capture screenshot as PNG, JPG or WebP (only the clip if given), timing phases on result"""
+        if result is not None:
+            result.enter('screenshot')
+        started = time.monotonic()
+        try:
+            # Try to use CDP for full page screenshot first (better quality).
+            # Chrome encodes the requested format itself, so the bytes are
+            # written out as-is instead of being decoded and re-encoded.
             self.driver.execute_cdp_cmd("Page.enable", {})
-            screenshot = self.driver.execute_cdp_cmd("Page.captureScreenshot", 
-                                                    {"captureBeyondViewport": True,
-                                                     "fromSurface": True})
-            image_data = base64.b64decode(screenshot['data'])
-            image = Image.open(BytesIO(image_data))
-
-            # Save as PNG or JPG
-            if format_choice == 'jpg':
-                image = image.convert('RGB')
-                image.save(output_path, 'JPEG', quality=quality)
-            else:
-                image.save(output_path, 'PNG')
-                
+            params = screenshot_params(format_choice, quality)
+            params.update({"captureBeyondViewport": True, "fromSurface": True})
+            if clip:
+                params["clip"] = clip
+            screenshot = self.driver.execute_cdp_cmd("Page.captureScreenshot", params)
+            if result is not None:
+                result.add_time('screenshot', time.monotonic() - started)
+            write_base64(screenshot['data'], output_path, timer=result)
             return True
             
         except Exception as e:
+            if clip:
+                # The WebDriver screenshot can't be clipped; the caller
+                # records the DevTools error on the result
+                raise
             print(f"Error in CDP screenshot, falling back to default: {e}")
             try:
                 # Fallback to regular screenshot
+                started = time.monotonic()
                 self.driver.save_screenshot(output_path)
+                if result is not None:
+                    result.add_time('screenshot', time.monotonic() - started)
                 return True
             except Exception as e2:
                 print(f"Screenshot error: {e2}")
                 return False
 
-    def _capture_pdf(self, output_path):
-        """Generate PDF of the webpage"""
+    def _capture_pdf(self, output_path, result=None):
+        """Generate PDF of the webpage, timing phases on result if given"""
+        if result is not None:
+            result.enter('pdf')
         try:
-            # Advanced PDF options
-            pdf_options = {
-                "printBackground": True,
-                "preferCSSPageSize": True,
-                "marginTop": 0,
-                "marginBottom": 0,
-                "marginLeft": 0,
-                "marginRight": 0,
-                "scale": 1.0
-            }
-            
-            result = self.driver.execute_cdp_cmd("Page.printToPDF", pdf_options)
-            
-            with open(output_path, "wb") as f:
-                f.write(base64.b64decode(result['data']))
+            # Streamed from Chrome to disk in chunks, however long the document
+            write_pdf(self.driver.execute_cdp_cmd, output_path, self.pdf_options, timer=result)
             return True
             
         except Exception as e:
@@ -204,6 +1010,15 @@ class WebPageCapture:
 
     def close(self):
         """Close browser and clean up resources"""
+        self._quit()
+        if self._http_cache_dir:
+            try:
+                self.http_cache.checkin(self._http_cache_dir)
+            except Exception as e:
+                print(f"Could not keep the HTTP cache: {e}")
+            self._http_cache_dir = None
+            
+    def _quit(self):
         if self.driver:
             try:
                 self.driver.quit()
@@ -221,10 +1036,10 @@ def run_interactive():
             if url.lower() in ['exit', 'quit', 'q']:
                 break
                 
-            format_choice = input("Choose output format (png, jpg, pdf) [default: png]: ").lower() or 'png'
+            format_choice = input("Choose output format (png, jpg, webp, pdf) [default: png]: ").lower() or 'png'
             
-            if format_choice == 'jpg':
-                quality = input("JPEG quality (1-100) [default: 90]: ") or 90
+            if format_choice in ('jpg', 'webp'):
+                quality = input("Image quality (1-100) [default: 90]: ") or 90
                 try:
                     quality = int(quality)
                     if quality < 1 or quality > 100:
@@ -248,27 +1063,170 @@ def run_interactive():
         if 'capture' in locals() and capture.driver:
             capture.close()
 
-def run_cli():
-    """Run as command line tool with arguments"""
-    parser = argparse.ArgumentParser(description='Capture webpage screenshots or PDFs')
-    parser.add_argument('url', help='URL of the webpage to capture')
-    parser.add_argument('--format', choices=['png', 'jpg', 'pdf'], default='png',
-                        help='Output format (png, jpg, or pdf)')
-    parser.add_argument('--output', help='Custom output path')
-    parser.add_argument('--quality', type=int, default=90, help='JPEG quality (1-100)')
+def add_capture_arguments(parser, retries=0):
+    """
+    Add the page loading, PDF, request blocking, retry and metrics options
+    every mode (CLI, --batch and --serve) shares
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend
+        retries (int): Default of --retries
+    """
+    parser.add_argument('--timeout', type=int, default=30, help='Page load timeout in seconds')
+    parser.add_argument('--idle-ms', type=int, default=500,
+                        help='Network quiet time (ms) before a page counts as ready')
+    parser.add_argument('--max-wait', type=float,
+                        help='Maximum seconds to wait for a page to become ready (defaults to timeout)')
+    parser.add_argument('--paper', metavar='SIZE',
+                        help=f"PDF paper size: {', '.join(PAPER_SIZES)}, or WxH in inches or mm "
+                             "(e.g. 8.5x11, 210x297mm); defaults to the page's CSS page size")
+    parser.add_argument('--page-ranges', metavar='RANGES', help="PDF pages to print, e.g. '1-5,8,11-13'")
+    parser.add_argument('--landscape', action='store_true', help='Print PDFs in landscape orientation')
+    parser.add_argument('--block', metavar='RULES',
+                        help='Comma-separated request rules to block: ads, trackers, font, media, websocket, image')
+    parser.add_argument('--deny-domain', action='append', metavar='DOMAIN',
+                        help='Block requests to DOMAIN and its subdomains (repeatable)')
+    parser.add_argument('--allow-domain', action='append', metavar='DOMAIN',
+                        help='Never block requests to DOMAIN (repeatable)')
+    parser.add_argument('--http-cache-dir', metavar='DIR',
+                        help="Keep Chrome's HTTP disk cache in DIR across browsers and runs "
+                             "(implies --isolation storage instead of context)")
+    parser.add_argument('--http-cache-mb', type=int, default=DEFAULT_CACHE_MB, metavar='MB',
+                        help=f"Size cap of each browser's HTTP disk cache (default {DEFAULT_CACHE_MB})")
+    parser.add_argument('--retries', type=int, default=retries, metavar='N',
+                        help=f'Retry failed captures up to N times, replacing crashed browsers (default {retries})')
+    parser.add_argument('--retry-backoff', type=float, default=1.0, metavar='SECONDS',
+                        help='Base delay before a retry, doubled every attempt, with jitter')
+    parser.add_argument('--retry-on', metavar='CLASSES',
+                        help=f"Comma-separated failure classes to retry (default: {', '.join(RETRYABLE)})")
+    parser.add_argument('--metrics-log', metavar='FILE', help='Append per-capture timings as JSON lines to FILE')
+    parser.add_argument('--prometheus', metavar='FILE', help='Write capture metrics in Prometheus text format to FILE')
+
+
+def add_render_arguments(parser):
+    """
+    Add the output and post-capture options shared by the CLI and --batch,
+    where they are the defaults of every job
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend
+    """
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='png',
+                        help='Output format (png, jpg, webp, or pdf)')
+    parser.add_argument('--quality', type=int, default=90, help='JPEG/WebP quality (1-100)')
     parser.add_argument('--width', type=int, default=1920, help='Viewport width')
     parser.add_argument('--height', type=int, help='Viewport height (defaults to full page)')
-    parser.add_argument('--timeout', type=int, default=30, help='Page load timeout in seconds')
-    
-    args = parser.parse_args()
+    parser.add_argument('--tile-height', type=int,
+                        help='Capture full pages in tiles of this height; bounds memory for png, '
+                             'jpg and webp are still stitched in memory')
+    parser.add_argument('--selector', metavar='CSS',
+                        help='Capture only the first element matching this CSS selector, at the viewport size')
+    parser.add_argument('--clip', metavar='X,Y,W,H',
+                        help='Capture only this page region (CSS pixels from the top left of the page)')
+    parser.add_argument('--output-spec', action='append', metavar='SPEC',
+                        help="Also produce this output from the same render, e.g. 'jpg:quality=70,width=400' "
+                             "or 'pdf:path=page.pdf' (repeatable)")
+    parser.add_argument('--if-changed', metavar='STATE',
+                        help='Only re-render pages whose validators or DOM changed since the run recorded in STATE')
+    parser.add_argument('--diff-dir', metavar='DIR',
+                        help='Compare each image capture with the previous one of the same page, kept in DIR')
+    parser.add_argument('--diff-highlight', action='store_true',
+                        help="Write '<output>.diff.png' with changed pixels highlighted when a page changed")
+    parser.add_argument('--dedupe-index', metavar='DB',
+                        help='Flag captures that look like an earlier capture recorded in this SQLite index')
+    parser.add_argument('--dedupe-distance', type=int, default=MAX_DISTANCE, metavar='BITS',
+                        help=f'Perceptual hash distance at which captures count as duplicates (default {MAX_DISTANCE})')
+    parser.add_argument('--drop-duplicates', action='store_true',
+                        help='Replace duplicate captures with a copy of the earlier capture and leave them unindexed')
+    parser.add_argument('--cache-dir', help='Reuse recent captures stored in this directory')
+    parser.add_argument('--cache-ttl', type=float, default=3600, help='Seconds a cached capture stays valid')
+    parser.add_argument('--cache-size', type=int, default=1024, help='Cache size limit in MB')
+
+
+def add_cli_arguments(parser):
+    """Add the arguments of a single capture from the command line"""
+    parser.add_argument('url', help='URL of the webpage to capture')
+    parser.add_argument('--output', help='Custom output path')
+    parser.add_argument('--save-tiles', metavar='DIR', help='Also save the individual tiles to DIR')
+    parser.add_argument('--viewports', metavar='LIST',
+                        help="Capture one page load at several viewports, e.g. 'mobile,tablet,1280,1440x900@2' "
+                             f"(presets: {', '.join(VIEWPORTS)})")
+    add_render_arguments(parser)
+    add_capture_arguments(parser)
+
+
+def run_cli(argv=None):
+    """
+    Run as command line tool with arguments
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(description='Capture webpage screenshots or PDFs')
+    add_cli_arguments(parser)
+    args = parser.parse_args(argv)
     
+    metrics = None
     try:
-        capture = WebPageCapture(headless=True, timeout=args.timeout)
-        capture.capture(args.url, args.format, args.output, args.quality, args.width, args.height)
+        cache = cache_from_args(args)
+        metrics = metrics_from_args(args)
+        pdf_options = pdf_options_from_args(args)
+        request_filter = filter_from_args(args)
+        viewports = [parse_viewport(spec) for spec in args.viewports.split(',') if spec.strip()] \
+            if args.viewports else None
+            
+        # A cache hit doesn't need Chrome at all
+        if cache and not viewports and not args.output_spec and not args.selector and not args.clip:
+            result = CaptureResult(args.url, args.format, args.output)
+            with result.phase('cache'):
+                cached = cache.fetch(args.url, args.format, args.output, args.quality, args.width, args.height,
+                                     pdf_options=pdf_options,
+                                     blocked=request_filter.blocked_url_patterns() if request_filter else None)
+            if cached:
+                if metrics:
+                    metrics.observe(result.succeed(cached, source='cache'))
+                print("Served from cache")
+                return 0
+            
+        capture = WebPageCapture(
+            headless=True, timeout=args.timeout,
+            idle_time=args.idle_ms / 1000.0, max_wait=args.max_wait, cache=cache,
+            changes=ChangeTracker(args.if_changed) if args.if_changed else None,
+            request_filter=request_filter, metrics=metrics, pdf_options=pdf_options,
+            retry=retry_from_args(args), diffs=diffs_from_args(args),
+            duplicates=duplicates_from_args(args), http_cache=http_cache_from_args(args)
+        )
+        if viewports:
+            results = capture.capture_viewports(
+                args.url, viewports, args.format, args.output, args.quality,
+                full_page=args.height is None, tile_height=args.tile_height
+            )
+            capture.close()
+            return 0 if all(results) else 1
+        if args.output_spec:
+            # --format/--quality describe the primary output, the specs the extra ones
+            primary = {'format': args.format, 'quality': args.quality, 'path': args.output}
+            results = capture.capture_outputs(
+                args.url, [primary] + args.output_spec, args.output, args.width, args.height,
+                tile_height=args.tile_height
+            )
+            capture.close()
+            return 0 if all(results) else 1
+        result = capture.capture_result(args.url, args.format, args.output, args.quality, args.width,
+                                        args.height, tile_height=args.tile_height, tiles_dir=args.save_tiles,
+                                        selector=args.selector, clip=args.clip)
         capture.close()
+        if capture.http_cache:
+            capture.http_cache.log()
+        if not result:
+            print(f"Capture failed ({result.error_type}): {result.error}")
+            return 1
     except Exception as e:
         print(f"Error: {e}")
         return 1
+    finally:
+        if metrics:
+            metrics.close()
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,309 @@
+import os
+import sys
+import json
+import queue
+import uuid
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from batch import add_pool_arguments, CaptureJob, CapturePool, JOB_FIELDS
+from blocking import filter_from_args
+from failures import retry_from_args
+from httpcache import http_cache_from_args
+from metrics import CaptureMetrics, metrics_from_args
+from pdf import pdf_options_from_args
+from scheduler import scheduler_from_args
+from screenshot import add_capture_arguments
+from utils import normalize_url, default_output_path
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'webp': 'image/webp',
+    'pdf': 'application/pdf',
+}
+
+# Clients choose capture options but never file system paths (output specs can carry paths)
+API_FIELDS = {key: value for key, value in JOB_FIELDS.items() if key not in ('output', 'tiles_dir', 'outputs')}
+
+STREAM_CHUNK = 1 << 16
+
+
+class CaptureService:
+    """
+    Job registry and bounded queue in front of a pool of warm WebPageCapture workers
+
+    Finished jobs are kept (with their artifacts) until `keep_jobs` newer
+    jobs have been submitted, so asynchronous clients have time to poll.
+    """
+
+    def __init__(self, output_dir, workers=2, queue_size=16, keep_jobs=1000, metrics=None,
+                 **capture_options):
+        self.output_dir = output_dir
+        self.keep_jobs = keep_jobs
+        self.metrics = metrics or CaptureMetrics()
+        self.pool = CapturePool(workers=workers, max_queue=queue_size, metrics=self.metrics,
+                                on_done=self._job_done, **capture_options)
+        self._jobs = OrderedDict()
+        # Ids of jobs dropped while still running; their artifacts are
+        # removed as soon as they finish
+        self._orphans = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.pool.start()
+        return self
+
+    def close(self):
+        self.pool.close()
+        self.metrics.close()
+
+    def submit(self, data):
+        """
+        Validate a JSON job and queue it without blocking
+
+        Raises:
+            ValueError: The job is malformed
+            queue.Full: The queue is full and the client should back off
+        """
+        job = CaptureJob.from_dict(data, uuid.uuid4().hex, fields=API_FIELDS)
+        url, parsed_url = normalize_url(job.url)
+        if parsed_url is None:
+            raise ValueError("Invalid URL format")
+
+        output_format = job.options.get('output_format', 'png')
+        if output_format not in CONTENT_TYPES:
+            raise ValueError(f"Invalid format: {output_format}")
+        job.options['output_path'] = default_output_path(
+            parsed_url, output_format, self.output_dir, suffix=job.id
+        )
+
+        self.pool.submit(job, block=False)
+        evicted = []
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep_jobs:
+                evicted.append(self._jobs.popitem(last=False)[1])
+        for old in evicted:
+            self._discard(old)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def forget(self, job):
+        """Drop a job and its artifact once it has been delivered"""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        self._discard(job)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        stats = {'workers': self.pool.workers, 'pending': self.pool.pending, 'jobs': counts}
+        http_cache = self.pool.capture_options.get('http_cache')
+        if http_cache:
+            stats['http_cache'] = http_cache.stats()
+        return stats
+
+    def _discard(self, job):
+        """Remove a job's artifact now, or when it finishes if it is still running"""
+        with self._lock:
+            if not job.done:
+                self._orphans.add(job.id)
+                return
+        self._remove_artifact(job)
+
+    def _job_done(self, job):
+        with self._lock:
+            if job.id not in self._orphans:
+                return
+            self._orphans.discard(job.id)
+        self._remove_artifact(job)
+
+    def _remove_artifact(self, job):
+        # Cached or deduplicated results may point at files shared with other jobs
+        if job.result and _inside(job.result, self.output_dir):
+            try:
+                os.remove(job.result)
+            except OSError:
+                pass
+
+
+def _inside(path, directory):
+    """Whether path is within directory, after resolving symlinks"""
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    try:
+        return os.path.commonpath([path, directory]) == directory
+    except ValueError:
+        return False
+
+
+class CaptureRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API:
+
+        POST /capture            capture synchronously, respond with the artifact
+                                 (or JSON metadata with ?response=json)
+        POST /jobs               queue a capture, respond 202 with the job id
+        GET  /jobs/<id>          job status
+        GET  /jobs/<id>/artifact stream a finished artifact
+        GET  /health             worker and queue status
+        GET  /metrics            capture metrics in Prometheus text format
+
+    Requests that would overflow the queue are rejected with 429.
+    """
+
+    service = None
+    sync_timeout = 120
+
+    def do_POST(self):
+        path = urlparse(self.path)
+        if path.path not in ('/capture', '/jobs'):
+            return self._send_json(404, {'error': 'Not found'})
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            data = json.loads(self.rfile.read(length) or b'{}')
+            job = self.service.submit(data)
+        except ValueError as e:
+            return self._send_json(400, {'error': str(e)})
+        except queue.Full:
+            return self._send_json(429, {'error': 'Capture queue is full'}, {'Retry-After': '1'})
+
+        if path.path == '/jobs':
+            return self._send_json(202, job.to_dict(), {'Location': f"/jobs/{job.id}"})
+
+        if not job.wait(self.sync_timeout):
+            return self._send_json(504, job.to_dict(), {'Location': f"/jobs/{job.id}"})
+        if not job.ok:
+            self.service.forget(job)
+            return self._send_json(502, job.to_dict())
+        if parse_qs(path.query).get('response') == ['json']:
+            return self._send_json(200, job.to_dict(), {'Location': f"/jobs/{job.id}/artifact"})
+
+        try:
+            self._send_artifact(job)
+        finally:
+            self.service.forget(job)
+
+    def do_GET(self):
+        parts = [part for part in urlparse(self.path).path.split('/') if part]
+        if parts == ['health']:
+            return self._send_json(200, self.service.stats())
+        if parts == ['metrics']:
+            return self._send_text(200, self.service.metrics.render(), 'text/plain; version=0.0.4')
+        if len(parts) not in (2, 3) or parts[0] != 'jobs':
+            return self._send_json(404, {'error': 'Not found'})
+
+        job = self.service.get(parts[1])
+        if job is None:
+            return self._send_json(404, {'error': 'Unknown job'})
+        if len(parts) == 2:
+            return self._send_json(200, job.to_dict())
+        if parts[2] != 'artifact':
+            return self._send_json(404, {'error': 'Not found'})
+        if not job.done:
+            return self._send_json(409, job.to_dict())
+        if not job.ok:
+            return self._send_json(410, job.to_dict())
+        self._send_artifact(job)
+
+    def _send_artifact(self, job):
+        """Stream the artifact file in chunks rather than loading it"""
+        output_format = job.options.get('output_format', 'png')
+        with open(job.result, 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPES.get(output_format, 'application/octet-stream'))
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.send_header('X-Job-Id', job.id)
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, STREAM_CHUNK)
+
+    def _send_json(self, status, payload, headers=None):
+        self._send_text(status, json.dumps(payload), 'application/json', headers)
+
+    def _send_text(self, status, text, content_type, headers=None):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def add_server_arguments(parser):
+    """Add the arguments of the HTTP capture service"""
+    parser.add_argument('--serve', action='store_true', help='Run the HTTP capture service')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help='Pending jobs accepted before answering 429')
+    parser.add_argument('--output-dir', help='Directory for artifacts (defaults to a temporary one)')
+    add_pool_arguments(parser)
+    add_capture_arguments(parser, retries=2)
+
+
+def run_server(argv=None):
+    """
+    Run the capture HTTP service until interrupted
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(description='Serve webpage captures over HTTP')
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.queue_size < 1:
+        parser.error("--queue-size must be at least 1")
+    try:
+        request_filter = filter_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    output_dir = os.path.abspath(args.output_dir or tempfile.mkdtemp(prefix="webcapture-serve-"))
+    service = CaptureService(
+        output_dir, workers=args.workers, queue_size=args.queue_size,
+        headless=True, timeout=args.timeout,
+        idle_time=args.idle_ms / 1000.0, max_wait=args.max_wait,
+        request_filter=request_filter, metrics=metrics_from_args(args),
+        pdf_options=pdf_options_from_args(args), retry=retry_from_args(args),
+        scheduler=scheduler_from_args(args, args.queue_size),
+        isolation=None if args.isolation == 'none' else args.isolation,
+        max_captures=args.recycle_after, max_memory_mb=args.max_browser_mb,
+        http_cache=http_cache_from_args(args)
+    )
+    CaptureRequestHandler.service = service
+    # Queue wait plus a generous allowance for the capture itself
+    CaptureRequestHandler.sync_timeout = args.timeout * (args.queue_size // args.workers + 2)
+
+    httpd = ThreadingHTTPServer((args.host, args.port), CaptureRequestHandler)
+    service.start()
+    print(f"Serving captures on http://{args.host}:{args.port} "
+          f"({args.workers} workers, queue {args.queue_size}, output in {output_dir})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down")
+    finally:
+        httpd.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_server())
@@ -0,0 +1,96 @@
+import io
+import asyncio
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import async_capture
+import batch
+from batch import CaptureJob, CapturePool, read_jobs, run_in_tabs
+from failures import RetryPolicy
+from metrics import CaptureResult
+from scheduler import HostScheduler
+
+
+class FakeAsyncCapture:
+    """Stands in for AsyncWebPageCapture with the same capture_result() signature"""
+
+    def __init__(self, concurrency=4, **options):
+        self.captured = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def capture_result(self, url, output_format='png', output_path=None, quality=90, width=1920,
+                             height=None):
+        self.captured.append(url)
+        result = CaptureResult(url, output_format, output_path)
+        result.succeed(output_path)
+        return result
+
+
+def test_tabs_drop_tile_options(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(async_capture, 'AsyncWebPageCapture', FakeAsyncCapture)
+    lines = io.StringIO(
+        '{"url": "https://example.com", "output": "%s", "tile_height": 4096, "tiles_dir": "%s"}\n'
+        % (tmp_path / 'example.png', tmp_path / 'tiles')
+    )
+    jobs = list(read_jobs(lines))
+    asyncio.run(run_in_tabs(iter(jobs), tabs=1))
+
+    assert jobs[0].error is None
+    assert jobs[0].result == str(tmp_path / 'example.png')
+    assert 'tile_height, tiles_dir not supported with --tabs' in capsys.readouterr().out
+
+
+def test_tabs_keep_supported_options(monkeypatch, tmp_path):
+    monkeypatch.setattr(async_capture, 'AsyncWebPageCapture', FakeAsyncCapture)
+    job = CaptureJob('https://example.com', output_path=str(tmp_path / 'a.jpg'), output_format='jpg',
+                     width=800)
+    asyncio.run(run_in_tabs(iter([job]), tabs=1))
+
+    assert job.error is None
+    assert job.details.output_format == 'jpg'
+
+
+class ThrottledOnceCapture:
+    """Stands in for WebPageCapture; the first load of every URL answers 429"""
+
+    loads = []
+
+    def __init__(self, retry=None, **options):
+        self.retry = retry
+        self.on_phase = None
+
+    def capture_result(self, url, output_path=None, **options):
+        self.loads.append(url)
+        result = CaptureResult(url, 'png', output_path)
+        result.http_status = 429 if self.loads.count(url) == 1 else 200
+        result.retry_after = '0'
+        return result.succeed(output_path)
+
+    def close(self):
+        pass
+
+
+def test_throttled_retries_go_through_the_scheduler(monkeypatch, tmp_path):
+    monkeypatch.setattr(batch, 'WebPageCapture', ThrottledOnceCapture)
+    ThrottledOnceCapture.loads = []
+    scheduler = HostScheduler(rate=50, burst=5, max_per_host=2)
+    job = CaptureJob('https://example.com', output_path=str(tmp_path / 'a.png'))
+    with CapturePool(workers=1, scheduler=scheduler, retry=RetryPolicy(attempts=3)) as pool:
+        # Workers leave Throttled to the pool, which requeues behind the backoff
+        assert 'Throttled' not in pool.capture_options['retry'].retry_on
+        pool.submit(job)
+        assert job.wait(5)
+
+    assert ThrottledOnceCapture.loads == ['https://example.com', 'https://example.com']
+    assert job.details.http_status == 200
+    assert job.details.attempts == 2
+    stats = scheduler.stats()['example.com']
+    assert stats['throttled'] == 1
+    assert stats['rate'] < 50
@@ -0,0 +1,68 @@
+import pytest
+
+import cache
+from cache import CaptureCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    return clock
+
+
+def artifact(tmp_path, name, size=100):
+    path = tmp_path / name
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+def test_key_covers_capture_options():
+    base = CaptureCache.key('https://example.com', 'png')
+    assert CaptureCache.key('https://example.com/', 'png') == base
+    # Quality only matters for lossy formats
+    assert CaptureCache.key('https://example.com', 'png', quality=10) == base
+    assert CaptureCache.key('https://example.com', 'jpg', quality=10) != CaptureCache.key('https://example.com', 'jpg')
+    assert CaptureCache.key('https://example.com', 'png', blocked=['b', 'a']) == \
+        CaptureCache.key('https://example.com', 'png', blocked=['a', 'b'])
+    assert CaptureCache.key('https://example.com', 'png', blocked=['a']) != base
+
+
+def test_hit_until_ttl_expires(tmp_path, clock):
+    store = CaptureCache(str(tmp_path / 'cache'), ttl=60)
+    store.store(artifact(tmp_path, 'page.png'), 'https://example.com')
+    out = str(tmp_path / 'out' / 'hit.png')
+
+    clock.now += 59
+    assert store.fetch('https://example.com', output_path=out) == out
+    clock.now += 2
+    assert store.fetch('https://example.com', output_path=out) is None
+    assert store.stats()['entries'] == 0
+    assert (store.hits, store.misses) == (1, 1)
+    store.close()
+
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    store = CaptureCache(str(tmp_path / 'cache'), ttl=3600, max_bytes=250)
+    out = str(tmp_path / 'out.png')
+    for name in ('a', 'b'):
+        clock.now += 1
+        store.store(artifact(tmp_path, f'{name}.png'), f'https://{name}.test/')
+    clock.now += 1
+    assert store.fetch('https://a.test/', output_path=out)
+
+    clock.now += 1
+    store.store(artifact(tmp_path, 'c.png'), 'https://c.test/')
+    assert store.fetch('https://a.test/', output_path=out)
+    assert store.fetch('https://b.test/', output_path=out) is None
+    assert store.fetch('https://c.test/', output_path=out)
+    assert store.stats()['bytes'] == 200
+    store.close()
@@ -0,0 +1,31 @@
+from changes import ChangeTracker, DocumentValidators
+
+
+def validators(etag=None):
+    result = DocumentValidators()
+    result.etag = etag
+    return result
+
+
+def test_key_covers_capture_options():
+    base = ChangeTracker.key('https://example.com', 'jpg', 80, 1280, None)
+    assert ChangeTracker.key('https://example.com/', 'jpg', 80, 1280, None) == base
+    assert ChangeTracker.key('https://example.com', 'jpg', 60, 1280, None) != base
+    assert ChangeTracker.key('https://example.com', 'jpg', 80, 1280, None, user_agent='bot') != base
+    assert ChangeTracker.key('https://example.com', 'jpg', 80, 1280, None, blocked=['*ads*']) != base
+
+
+def test_unchanged_after_record(tmp_path):
+    artifact = tmp_path / 'page.png'
+    artifact.write_bytes(b'png')
+    tracker = ChangeTracker(str(tmp_path / 'state.db'))
+    key = ChangeTracker.key('https://example.com', 'png')
+    try:
+        assert tracker.unchanged(key, validators('"v1"'), 'abc:10') is None
+        tracker.record(key, validators('"v1"'), 'abc:10', str(artifact))
+        assert tracker.unchanged(key, validators('"v1"'), 'abc:10') == str(artifact)
+        assert tracker.unchanged(key, validators('"v2"'), 'abc:10') is None
+        assert tracker.unchanged(key, validators('"v1"'), 'def:10') is None
+    finally:
+        tracker.close()
+    assert (tracker.skipped, tracker.changed) == (1, 3)
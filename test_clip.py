@@ -0,0 +1,19 @@
+import pytest
+
+from clip import parse_clip
+
+
+def test_parse_clip_forms():
+    expected = {'x': 10.0, 'y': 20.0, 'width': 300.0, 'height': 150.0, 'scale': 1}
+    assert parse_clip('10,20,300,150') == expected
+    assert parse_clip([10, 20, 300, 150]) == expected
+    assert parse_clip({'x': 10, 'y': 20, 'width': 300, 'height': 150}) == expected
+
+
+@pytest.mark.parametrize('spec', [
+    '10,20,300', '10,20,300,150,1', 'a,b,c,d', '-1,0,10,10', '0,0,0,10', '0,0,10,-5',
+    {'x': 0, 'y': 0, 'width': 10},
+])
+def test_parse_clip_rejects_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_clip(spec)
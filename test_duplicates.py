@@ -0,0 +1,53 @@
+import pytest
+
+from duplicates import dhash, hamming, DuplicateIndex, BANDS, HASH_BITS, _bands, _signed, _unsigned
+
+
+def test_hamming():
+    assert hamming(0, 0) == 0
+    assert hamming(0b1011, 0b0010) == 2
+    assert hamming(0, (1 << HASH_BITS) - 1) == HASH_BITS
+
+
+def test_bands_split_and_sign_round_trip():
+    value = 0xFEDCBA9876543210
+    assert _bands(value) == [0x3210, 0x7654, 0xBA98, 0xFEDC]
+    assert _signed(value) < 0
+    assert _unsigned(_signed(value)) == value
+
+
+def test_hashes_within_bands_minus_one_bits_share_a_band():
+    value = 0x0123456789ABCDEF
+    # Flip one bit in each of BANDS - 1 bands; the last band still matches
+    near = value
+    for band in range(BANDS - 1):
+        near ^= 1 << (band * (HASH_BITS // BANDS))
+    assert hamming(value, near) == BANDS - 1
+    assert any(a == b for a, b in zip(_bands(value), _bands(near)))
+
+
+def test_index_finds_near_duplicates_of_the_same_size(tmp_path):
+    index = DuplicateIndex(str(tmp_path / 'index.db'), max_distance=3)
+    value = 0x0123456789ABCDEF
+    index.add(value, 'https://a.test/', 'a.png', (100, 200))
+    index.add(value ^ 0b111, 'https://b.test/', 'b.png', (100, 200))
+    index.add(value ^ 0b11111, 'https://c.test/', 'c.png', (100, 200))
+    index.add(value, 'https://d.test/', 'd.png', (100, 300))
+
+    matches = index.find(value ^ 1, size=(100, 200))
+    assert matches == [(1, 'https://a.test/', 'a.png'), (2, 'https://b.test/', 'b.png')]
+    index.close()
+
+
+def test_dhash_ignores_reencoding(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    image = Image.linear_gradient('L').resize((320, 240)).convert('RGB')
+    image.paste((0, 0, 0), (40, 40, 120, 100))
+    png, jpg = str(tmp_path / 'page.png'), str(tmp_path / 'page.jpg')
+    image.save(png)
+    image.save(jpg, quality=60)
+    assert hamming(dhash(png), dhash(jpg)) <= 3
+
+    other = str(tmp_path / 'other.png')
+    Image.linear_gradient('L').rotate(90).resize((320, 240)).convert('RGB').save(other)
+    assert hamming(dhash(png), dhash(other)) > 3
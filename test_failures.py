@@ -0,0 +1,83 @@
+import pytest
+
+from failures import classify, classify_status, storable, RetryPolicy, RETRYABLE
+
+
+class WebDriverException(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+
+
+class TimeoutException(WebDriverException):
+    pass
+
+
+class Result:
+    def __init__(self, ok=True, error_type=None, status=200, source='capture', deferred=False):
+        self.ok = ok
+        self.error_type = error_type
+        self.http_status = status
+        self.source = source
+        self.deferred = deferred
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('unknown error: net::ERR_NAME_NOT_RESOLVED', 'DNS'),
+    ('net::ERR_CERT_DATE_INVALID', 'TLS'),
+    ('net::ERR_CONNECTION_RESET', 'Network'),
+    ('tab crashed', 'RendererCrash'),
+    ('invalid session id', 'DriverCrash'),
+    ('Timed out receiving message from renderer', 'Timeout'),
+])
+def test_classify_messages(message, expected):
+    assert classify(WebDriverException(message)) == expected
+
+
+def test_classify_exception_classes():
+    assert classify(TimeoutException('')) == 'Timeout'
+    assert classify(KeyError('x')) == 'KeyError'
+    assert classify(KeyError('x'), default='Unknown') == 'Unknown'
+
+
+def test_classify_status():
+    assert classify_status(None) is None
+    assert classify_status(304) is None
+    assert classify_status(429) == 'Throttled'
+    assert classify_status(503) == 'Throttled'
+    assert classify_status(500) == 'ServerError'
+    assert classify_status(404) == 'HTTPError'
+
+
+def test_storable():
+    assert storable(200)
+    assert storable(None)
+    assert not storable(404)
+    assert not storable(503, RetryPolicy())
+
+
+def test_failure_only_for_retryable_classes():
+    policy = RetryPolicy(attempts=3)
+    assert policy.failure([Result(ok=False, error_type='Timeout')], 1) == 'Timeout'
+    assert policy.failure([Result(ok=False, error_type='DNS')], 1) is None
+    assert policy.failure([Result(status=429)], 1) == 'Throttled'
+    assert policy.failure([Result(status=429, source='cache')], 1) is None
+    assert policy.failure([Result(ok=False, error_type='Timeout')], 3) is None
+    assert policy.failure([Result(ok=False, error_type='Timeout', deferred=True)], 1) is None
+
+
+def test_without_leaves_classes_to_the_caller():
+    policy = RetryPolicy(attempts=3).without('Throttled')
+    assert policy.failure([Result(status=429)], 1) is None
+    assert policy.failure([Result(ok=False, error_type='Timeout')], 1) == 'Timeout'
+    assert policy.retry_statuses == RetryPolicy().retry_statuses
+    assert 'Throttled' in RETRYABLE
+
+
+def test_delay_backoff_and_retry_after(monkeypatch):
+    monkeypatch.setattr('random.uniform', lambda low, high: high)
+    policy = RetryPolicy(backoff=1.0, max_backoff=5.0)
+    assert [policy.delay(attempt) for attempt in (1, 2, 3, 4)] == [1.0, 2.0, 4.0, 5.0]
+    assert policy.delay(1, retry_after='3') == 3.0
+    assert policy.delay(1, retry_after='60') == 5.0
+    assert policy.delay(1, retry_after='Wed, 21 Oct 2026 07:28:00 GMT') == 1.0
@@ -0,0 +1,39 @@
+import argparse
+
+import pytest
+
+import main
+
+
+def test_version_and_help(capsys):
+    assert main.main(['--version']) == 0
+    assert main.main(['--help']) == 0
+    assert '--serve --help' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('argv, mode', [
+    (['https://example.com', '--format', 'jpg'], 'screenshot.run_cli'),
+    (['--batch', 'urls.txt', '--recycle-after', '50'], 'batch.run_batch'),
+    (['--serve', '--queue-size', '4'], 'server.run_server'),
+])
+def test_mode_parser_gets_every_argument(monkeypatch, argv, mode):
+    pytest.importorskip("selenium")
+    module_name, function = mode.split('.')
+    module = pytest.importorskip(module_name)
+    calls = []
+    monkeypatch.setattr(module, function, lambda argv=None: calls.append(argv) or 0)
+    assert main.main(argv) == 0
+    assert calls == [argv]
+
+
+@pytest.mark.parametrize('mode, argv', [
+    ('screenshot.add_cli_arguments', ['https://example.com', '--tile-height', '4096', '--retries', '1']),
+    ('batch.add_batch_arguments', ['--batch', 'urls.txt', '--recycle-after', '50', '--postprocess-workers', '2']),
+    ('server.add_server_arguments', ['--serve', '--recycle-after', '50', '--http-cache-dir', 'cache']),
+])
+def test_mode_parsers_accept_their_options(mode, argv):
+    pytest.importorskip("selenium")
+    module_name, function = mode.split('.')
+    parser = argparse.ArgumentParser()
+    getattr(pytest.importorskip(module_name), function)(parser)
+    parser.parse_args(argv)
@@ -0,0 +1,64 @@
+import pytest
+
+from manifest import in_shard, job_fingerprint, parse_shard, shard_of, ProgressStore
+
+
+class Job:
+    def __init__(self, job_id, url, fields=None, result=None, error=None):
+        self.id = job_id
+        self.url = url
+        self.fingerprint = job_fingerprint(url, fields)
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.result is not None
+
+
+def test_parse_shard():
+    assert parse_shard('1/1') == (1, 1)
+    assert parse_shard('3/4') == (3, 4)
+
+
+@pytest.mark.parametrize('spec', ['0/4', '5/4', '1/0', '1', 'a/b', '-1/2'])
+def test_parse_shard_rejects_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_shard(spec)
+
+
+def test_shards_split_jobs_without_overlap():
+    jobs = [Job(str(number), f'https://example.com/{number}') for number in range(200)]
+    shards = [[job.id for job in in_shard(jobs, (index, 3))] for index in (1, 2, 3)]
+    assert sorted(sum(shards, [])) == sorted(job.id for job in jobs)
+    assert all(shards)
+    # Stable across runs and processes
+    assert shard_of('42', 3) == shard_of('42', 3)
+
+
+def test_progress_resume(tmp_path):
+    path = str(tmp_path / 'progress.db')
+    store = ProgressStore(path)
+    store.record(Job('1', 'https://example.com/a', result='a.png'))
+    store.record(Job('2', 'https://example.com/b', error='Timeout'))
+    store.close()
+
+    store = ProgressStore(path)
+    jobs = [
+        Job('1', 'https://example.com/a'),
+        Job('2', 'https://example.com/b'),
+        Job('3', 'https://example.com/c'),
+    ]
+    assert [job.id for job in store.pending(jobs)] == ['2', '3']
+    assert store.skipped == 1
+    assert store.stats() == {'done': 1, 'failed': 1}
+    store.close()
+
+
+def test_progress_reruns_edited_lines(tmp_path):
+    store = ProgressStore(str(tmp_path / 'progress.db'))
+    store.record(Job('1', 'https://example.com/a', {'format': 'png'}, result='a.png'))
+    assert store.status(Job('1', 'https://example.com/a', {'format': 'png'})) == 'done'
+    assert store.status(Job('1', 'https://example.com/a', {'format': 'jpg'})) == 'pending'
+    assert store.status(Job('1', 'https://example.com/z', {'format': 'png'})) == 'pending'
+    store.close()
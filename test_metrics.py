@@ -0,0 +1,35 @@
+import os
+
+from metrics import CaptureMetrics, CaptureResult
+
+
+def finished(url, path=None):
+    result = CaptureResult(url, 'png', path)
+    return result.succeed(path) if path else result.fail('Timed out', 'Timeout')
+
+
+def test_prometheus_file_written_on_interval_and_close(tmp_path):
+    path = str(tmp_path / 'metrics.prom')
+    metrics = CaptureMetrics(prometheus_path=path, write_interval=3600)
+    metrics.observe(finished('https://a.test/1'))
+    with open(path) as f:
+        first = f.read()
+    metrics.observe(finished('https://a.test/2'))
+    with open(path) as f:
+        assert f.read() == first
+    metrics.close()
+    with open(path) as f:
+        assert 'webcapture_host_capture_seconds_count{host="a.test"} 2' in f.read()
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_hosts_beyond_the_top_n_are_other():
+    metrics = CaptureMetrics(max_hosts=2)
+    for host, count in (('a.test', 3), ('b.test', 2), ('c.test', 1), ('d.test', 1)):
+        for _ in range(count):
+            metrics.observe(finished(f'https://{host}/'))
+    text = metrics.render()
+    assert 'webcapture_host_capture_seconds_count{host="a.test"} 3' in text
+    assert 'webcapture_host_capture_seconds_count{host="b.test"} 2' in text
+    assert 'webcapture_host_capture_seconds_count{host="other"} 2' in text
+    assert 'c.test' not in text
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from scheduler import HostScheduler, HostState
+
+
+class Job:
+    def __init__(self, url):
+        self.url = url
+
+
+class Result:
+    def __init__(self, status=200, seconds=1.0, ok=True, retry_after=None):
+        self.http_status = status
+        self.retry_after = retry_after
+        self.phases = {'navigate': seconds}
+        self.ok = ok
+
+
+def test_token_bucket_refill_and_wait():
+    state = HostState(rate=2.0, burst=3, max_active=2)
+    assert state.wait_time(state.updated) == 0
+    state.tokens = 0.0
+    assert state.wait_time(state.updated) == pytest.approx(0.5)
+    state.refill(state.updated + 0.25)
+    assert state.tokens == pytest.approx(0.5)
+    # Never more than the burst
+    state.refill(state.updated + 100)
+    assert state.tokens == 3
+    state.active = 2
+    assert state.wait_time(state.updated) is None
+
+
+def test_get_interleaves_hosts():
+    scheduler = HostScheduler(rate=100, burst=10, max_per_host=10)
+    for url in ('https://a.test/1', 'https://a.test/2', 'https://b.test/1', 'https://b.test/2'):
+        scheduler.put(Job(url))
+    hosts = [HostScheduler.host(scheduler.get()) for _ in range(4)]
+    assert hosts == ['a.test', 'b.test', 'a.test', 'b.test']
+
+
+def run_one(scheduler, url, result):
+    scheduler.put(Job(url))
+    job = scheduler.get()
+    scheduler.finished(job, [result])
+    return scheduler.stats()[HostScheduler.host(job)]
+
+
+def test_throttling_halves_rate_and_concurrency():
+    scheduler = HostScheduler(rate=4.0, burst=10, max_per_host=3)
+    stats = run_one(scheduler, 'https://a.test/', Result(status=429, retry_after='2'))
+    assert stats['rate'] == 2.0
+    assert stats['max_active'] == 2
+    assert stats['throttled'] == 1
+    state = scheduler._hosts['a.test']
+    assert state.blocked_until - time.monotonic() == pytest.approx(2, abs=0.1)
+
+
+def test_rate_never_drops_below_floor():
+    scheduler = HostScheduler(rate=1.0, burst=10, max_per_host=1, min_rate=0.3)
+    state = scheduler._hosts.setdefault('a.test', HostState(1.0, 10, 1))
+    for _ in range(5):
+        state.blocked_until, state.tokens = 0, 10.0
+        run_one(scheduler, 'https://a.test/', Result(status=503))
+    assert state.rate == 0.3
+    assert state.max_active == 1
+
+
+def test_clean_captures_recover_additively():
+    scheduler = HostScheduler(rate=1.0, burst=10, max_per_host=2)
+    state = scheduler._hosts.setdefault('a.test', HostState(1.0, 10, 2))
+    state.rate, state.max_active = 0.5, 1
+    stats = run_one(scheduler, 'https://a.test/', Result())
+    assert stats['rate'] == pytest.approx(0.6)
+    assert stats['max_active'] == 1
+    for _ in range(5):
+        stats = run_one(scheduler, 'https://a.test/', Result())
+    assert stats['rate'] == 1.0
+    assert stats['max_active'] == 2
+
+
+def test_slow_pages_cut_rate_by_a_quarter():
+    scheduler = HostScheduler(rate=1.0, burst=10, max_per_host=2)
+    run_one(scheduler, 'https://a.test/', Result(seconds=1.0))
+    stats = run_one(scheduler, 'https://a.test/', Result(seconds=3.0))
+    assert stats['rate'] == 0.75
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+pytest.importorskip("selenium")
+
+from server import _inside
+
+
+def test_inside_output_dir(tmp_path):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    assert _inside(str(output_dir / 'a.png'), str(output_dir))
+    assert _inside(str(output_dir / 'sub' / 'a.png'), str(output_dir))
+
+
+def test_sibling_with_same_prefix_is_outside(tmp_path):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    assert not _inside(str(tmp_path / 'out-other' / 'a.png'), str(output_dir))
+    assert not _inside(str(output_dir / '..' / 'a.png'), str(output_dir))
+
+
+def test_symlink_out_of_output_dir_is_outside(tmp_path):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    os.symlink(str(tmp_path), str(output_dir / 'link'))
+    assert not _inside(str(output_dir / 'link' / 'a.png'), str(output_dir))
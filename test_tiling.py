@@ -0,0 +1,95 @@
+import zlib
+import struct
+
+import pytest
+
+from tiling import (
+    check_height, PageTooTall, PNGStreamReader, PNGStreamWriter, AUTO_TILE_HEIGHT, MAX_HEIGHT, PNG_SIGNATURE,
+    _png_chunk,
+)
+
+
+def test_webp_accepts_every_page_captured_in_one_piece():
+    check_height('webp', AUTO_TILE_HEIGHT)
+
+
+def test_webp_rejects_every_page_that_would_be_tiled():
+    with pytest.raises(PageTooTall):
+        check_height('webp', AUTO_TILE_HEIGHT + 1)
+
+
+def test_check_height_boundaries():
+    check_height('jpg', MAX_HEIGHT['jpg'])
+    with pytest.raises(PageTooTall):
+        check_height('jpg', MAX_HEIGHT['jpg'] + 1)
+    # PNG is streamed, so it has no limit of its own
+    check_height('png', 10 * MAX_HEIGHT['jpg'])
+
+
+def test_png_writer_round_trip(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    path = str(tmp_path / 'out.png')
+    pixels = bytes((x * 7 + y * 13) % 256 for y in range(50) for x in range(20 * 3))
+    with PNGStreamWriter(path, 20, 50) as writer:
+        writer.write_rows(pixels[:20 * 3 * 30])
+        writer.write_rows(pixels[20 * 3 * 30:])
+
+    with Image.open(path) as image:
+        assert image.size == (20, 50)
+        assert image.mode == 'RGB'
+        assert image.tobytes() == pixels
+
+
+def test_png_writer_pads_missing_rows_white(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    path = str(tmp_path / 'out.png')
+    with PNGStreamWriter(path, 4, 3, mode='RGBA') as writer:
+        writer.write_image(Image.new('RGBA', (4, 1), (1, 2, 3, 4)))
+
+    with Image.open(path) as image:
+        assert image.getpixel((0, 0)) == (1, 2, 3, 4)
+        assert image.getpixel((3, 2)) == (255, 255, 255, 255)
+
+
+def test_png_writer_rejects_partial_rows(tmp_path):
+    writer = PNGStreamWriter(str(tmp_path / 'out.png'), 4, 2)
+    with pytest.raises(ValueError):
+        writer.write_rows(b"\x00" * 5)
+    writer.abort()
+
+
+def test_png_reader_round_trip_in_strips(tmp_path):
+    # The reader hands strips to Pillow to undo the filters
+    pytest.importorskip("PIL.Image")
+    path = str(tmp_path / 'out.png')
+    pixels = bytes((x * 5 + y * 11) % 256 for y in range(37) for x in range(9 * 4))
+    with PNGStreamWriter(path, 9, 37, mode='RGBA') as writer:
+        writer.write_rows(pixels)
+
+    with PNGStreamReader(path) as reader:
+        assert reader.size == (9, 37)
+        strips = [reader.read_rows(10) for _ in range(4)]
+    assert [strip.size for strip in strips] == [(9, 10), (9, 10), (9, 10), (9, 7)]
+    assert b"".join(strip.tobytes() for strip in strips) == pixels
+
+
+def test_png_reader_undoes_pillow_filters(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    path = str(tmp_path / 'pillow.png')
+    image = Image.frombytes('RGB', (64, 48), bytes((x * y + x) % 256 for y in range(48) for x in range(64 * 3)))
+    # Pillow picks adaptive (Sub/Up/Average/Paeth) filters per row
+    image.save(path, optimize=True)
+
+    with PNGStreamReader(path) as reader:
+        rows = b"".join(reader.read_rows(5).tobytes() for _ in range(10))
+    assert rows == image.tobytes()
+
+
+@pytest.mark.parametrize('depth, interlace', [(8, 1), (16, 0)])
+def test_png_reader_rejects_what_it_cannot_stream(tmp_path, depth, interlace):
+    path = tmp_path / 'unsupported.png'
+    ihdr = struct.pack(">IIBBBBB", 8, 8, depth, 2, 0, 0, interlace)
+    path.write_bytes(PNG_SIGNATURE + _png_chunk(b"IHDR", ihdr) + _png_chunk(b"IDAT", zlib.compress(b""))
+                     + _png_chunk(b"IEND", b""))
+    with pytest.raises(ValueError):
+        PNGStreamReader(str(path))
@@ -0,0 +1,43 @@
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from visualdiff import VisualDiffStore
+
+
+def save(path, box=None):
+    image = Image.new('RGB', (128, 96), (255, 255, 255))
+    if box:
+        image.paste((0, 0, 0), box)
+    image.save(path)
+    return str(path)
+
+
+def test_first_capture_becomes_the_baseline(tmp_path):
+    store = VisualDiffStore(str(tmp_path / 'diffs'))
+    diff = store.compare('key', 'png', save(tmp_path / 'a.png'))
+    assert not diff.compared
+    assert store.compared == 0
+
+
+def test_unchanged_and_changed_captures(tmp_path):
+    store = VisualDiffStore(str(tmp_path / 'diffs'), highlight=True)
+    store.compare('key', 'png', save(tmp_path / 'a.png'))
+
+    same = store.compare('key', 'png', save(tmp_path / 'b.png'))
+    assert same.compared and not same.changed
+    assert not (tmp_path / 'b.diff.png').exists()
+
+    changed = store.compare('key', 'png', save(tmp_path / 'c.png', (40, 30, 50, 40)))
+    assert changed.changed
+    assert changed.changed_pixels == 100
+    assert changed.boxes
+    assert (tmp_path / 'c.diff.png').exists()
+    assert (store.compared, store.changed) == (2, 1)
+
+
+def test_baselines_are_per_key(tmp_path):
+    store = VisualDiffStore(str(tmp_path / 'diffs'))
+    store.compare('one', 'png', save(tmp_path / 'a.png'))
+    diff = store.compare('two', 'png', save(tmp_path / 'b.png', (0, 0, 10, 10)))
+    assert not diff.compared
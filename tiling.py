@@ -0,0 +1,347 @@
+import os
+import zlib
+import base64
+import struct
+from io import BytesIO
+
+from metrics import timed
+
+# Largest image dimension libwebp can encode
+WEBP_MAX_HEIGHT = 16383
+
+# Full-page captures taller than this are tiled automatically; Chrome's
+# compositor can't rasterize a single surface much beyond it. Derived from
+# the WebP limit so every page WebP can encode is captured in one piece and
+# every page tall enough to be tiled is rejected for WebP up front.
+AUTO_TILE_HEIGHT = WEBP_MAX_HEIGHT
+DEFAULT_TILE_HEIGHT = 4096
+
+# Largest image height each stitched (non-streamed) format can encode
+MAX_HEIGHT = {'jpg': 65500, 'webp': WEBP_MAX_HEIGHT}
+PIL_FORMATS = {'jpg': 'JPEG', 'webp': 'WEBP'}
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class PageTooTall(ValueError):
+    """A page is taller than its output format can encode"""
+
+
+class PNGStreamWriter:
+    """
+    Write an 8-bit RGB or RGBA PNG row by row
+
+    Rows are compressed as they arrive and flushed as IDAT chunks, so memory
+    use depends on the rows passed in at once rather than the image height.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, path, width, height, mode='RGB', compress_level=6):
+        if mode not in ('RGB', 'RGBA'):
+            raise ValueError(f"Unsupported mode: {mode}")
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.row_bytes = width * len(mode)
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_size = 0
+
+        self._file = open(path, "wb")
+        self._file.write(PNG_SIGNATURE)
+        color_type = 2 if mode == 'RGB' else 6
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+    def write_rows(self, data):
+        """Append raw pixel rows (a whole number of rows, top to bottom)"""
+        rows = len(data) // self.row_bytes
+        if rows * self.row_bytes != len(data):
+            raise ValueError("Data is not a whole number of rows")
+        rows = min(rows, self.height - self.rows_written)
+
+        view = memoryview(data)
+        for row in range(rows):
+            start = row * self.row_bytes
+            # Filter type 0 (None) keeps the encoder a simple stream
+            self._compress(b"\x00")
+            self._compress(view[start:start + self.row_bytes])
+        self.rows_written += rows
+
+    def write_image(self, image):
+        """Append all rows of a PIL image of the same width"""
+        if image.size[0] != self.width:
+            raise ValueError(f"Tile width {image.size[0]} does not match {self.width}")
+        if image.mode != self.mode:
+            image = image.convert(self.mode)
+        self.write_rows(image.tobytes())
+
+    def close(self):
+        """Pad any missing rows with white and finish the file"""
+        if self._file is None:
+            return
+        blank = b"\xff" * self.row_bytes
+        while self.rows_written < self.height:
+            self.write_rows(blank)
+        self._pending.append(self._compressor.flush())
+        self._flush_idat()
+        self._write_chunk(b"IEND", b"")
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        """Close the file without finishing it"""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _compress(self, data):
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self._pending.append(compressed)
+            self._pending_size += len(compressed)
+            if self._pending_size >= self.CHUNK_SIZE:
+                self._flush_idat()
+
+    def _flush_idat(self):
+        data = b"".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        if data:
+            self._write_chunk(b"IDAT", data)
+
+    def _write_chunk(self, kind, data):
+        self._file.write(_png_chunk(kind, data))
+
+
+class PNGStreamReader:
+    """
+    Read a non-interlaced 8-bit PNG a strip of rows at a time
+
+    IDAT data is inflated only as far as the rows asked for. The strip's
+    still-filtered scanlines are wrapped, after the previous strip's last
+    row, into a small uncompressed PNG that Pillow decodes, so memory use
+    depends on the strip height rather than the image height.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    # Samples per pixel of each PNG color type
+    CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+    def __init__(self, path):
+        """
+        Raises:
+            ValueError: If the file isn't a PNG this reader can stream
+        """
+        self._file = open(path, "rb")
+        try:
+            self._read_header()
+        except (ValueError, struct.error):
+            self._file.close()
+            raise
+        self.rows_read = 0
+        self._inflater = zlib.decompressobj()
+        self._buffer = bytearray()
+        # Filters refer to the row above; the first row's is all zeros
+        self._previous = bytes(self.row_bytes)
+
+    def _read_header(self):
+        if self._file.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            raise ValueError("Not a PNG file")
+        self._chunks = []
+        while True:
+            length, kind = struct.unpack(">I4s", self._file.read(8))
+            if kind == b"IDAT":
+                self._idat_left = length
+                break
+            data = self._file.read(length)
+            self._file.read(4)
+            if kind == b"IHDR":
+                self._ihdr = data
+            elif kind in (b"PLTE", b"tRNS"):
+                self._chunks.append((kind, data))
+            elif kind == b"IEND":
+                raise ValueError("PNG has no image data")
+        width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", self._ihdr)
+        if depth != 8 or interlace or color_type not in self.CHANNELS:
+            raise ValueError("Only non-interlaced 8-bit PNGs can be streamed")
+        self.size = (width, height)
+        self.row_bytes = width * self.CHANNELS[color_type]
+
+    def read_rows(self, count):
+        """
+        Decode the next rows
+
+        Returns:
+            PIL.Image.Image: The rows, in the PNG's own mode
+        """
+        from PIL import Image
+
+        count = min(count, self.size[1] - self.rows_read)
+        needed = count * (self.row_bytes + 1)
+        while len(self._buffer) < needed:
+            data = self._inflater.unconsumed_tail or self._read_idat()
+            if not data:
+                raise ValueError("PNG image data is truncated")
+            self._buffer += self._inflater.decompress(data, needed - len(self._buffer))
+        scanlines = bytes(self._buffer[:needed])
+        del self._buffer[:needed]
+
+        ihdr = struct.pack(">II", self.size[0], count + 1) + self._ihdr[8:]
+        png = [PNG_SIGNATURE, _png_chunk(b"IHDR", ihdr)]
+        png.extend(_png_chunk(kind, data) for kind, data in self._chunks)
+        png.append(_png_chunk(b"IDAT", zlib.compress(b"\x00" + self._previous + scanlines, 0)))
+        png.append(_png_chunk(b"IEND", b""))
+        with Image.open(BytesIO(b"".join(png))) as image:
+            image.load()
+            rows = image.crop((0, 1, self.size[0], count + 1))
+        self._previous = rows.crop((0, count - 1, self.size[0], count)).tobytes()
+        self.rows_read += count
+        return rows
+
+    def _read_idat(self):
+        """Next piece of compressed image data, b'' after the last IDAT chunk"""
+        while not self._idat_left:
+            if self._idat_left is None:
+                return b""
+            self._file.read(4)
+            length, kind = struct.unpack(">I4s", self._file.read(8))
+            self._idat_left = length if kind == b"IDAT" else None
+        data = self._file.read(min(self.CHUNK_SIZE, self._idat_left))
+        if not data:
+            self._idat_left = None
+            return b""
+        self._idat_left -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _png_chunk(kind, data):
+    return (struct.pack(">I", len(data)) + kind + data
+            + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff))
+
+
+def check_height(format_choice, total_height):
+    """
+    Fail before any capture work if a page is too tall for the output format
+
+    Raises:
+        PageTooTall: If total_height exceeds the format's MAX_HEIGHT
+    """
+    max_height = MAX_HEIGHT.get(format_choice)
+    if max_height and total_height > max_height:
+        raise PageTooTall(f"Page is {total_height}px tall but {format_choice} images are limited to "
+                         f"{max_height}px; capture it as png or set a viewport height")
+
+
+def tile_path(output_path, tiles_dir, index):
+    """Path for the index-th tile of output_path inside tiles_dir"""
+    base = os.path.splitext(os.path.basename(output_path))[0]
+    return os.path.join(tiles_dir, f"{base}_tile_{index:04d}.png")
+
+
+def capture_tiled(execute_cdp_cmd, output_path, width, total_height, format_choice='png',
+                  quality=90, tile_height=DEFAULT_TILE_HEIGHT, tiles_dir=None, timer=None):
+    """
+    Capture a full page as a series of clipped screenshots
+
+    Each tile is requested with Page.captureScreenshot and a clip rectangle
+    and decoded. PNG output is streamed row by row, so its peak memory is
+    bounded by the tile size instead of the page height. JPG and WebP
+    output is not streamed: the tiles are pasted into one full-height RGB
+    canvas, which Pillow's encoders need, so tiling only keeps Chrome from
+    rasterizing the whole page at once. Their MAX_HEIGHT is checked first.
+
+    Args:
+        execute_cdp_cmd (callable): Runs a CDP command, e.g. driver.execute_cdp_cmd
+        output_path (str): Stitched output file
+        width (int): Page width in CSS pixels
+        total_height (int): Page height in CSS pixels
+        format_choice (str): 'png', 'jpg' or 'webp'
+        quality (int): JPEG/WebP quality (1-100) if jpg or webp format
+        tile_height (int): Height of each clip in CSS pixels
+        tiles_dir (str): Also save every tile as a PNG in this directory
+        timer (CaptureResult): Accumulates screenshot/decode/encode/write phase times
+
+    Returns:
+        int: Number of tiles captured
+    """
+    from PIL import Image
+
+    check_height(format_choice, total_height)
+    if tiles_dir:
+        os.makedirs(tiles_dir, exist_ok=True)
+
+    writer = None
+    canvas = None
+    offset = 0
+    tiles = 0
+    try:
+        for y in range(0, total_height, tile_height):
+            clip_height = min(tile_height, total_height - y)
+            with timed(timer, 'screenshot'):
+                screenshot = execute_cdp_cmd("Page.captureScreenshot", {
+                    "format": "png",
+                    "captureBeyondViewport": True,
+                    "fromSurface": True,
+                    "clip": {"x": 0, "y": y, "width": width, "height": clip_height, "scale": 1},
+                })
+            with timed(timer, 'decode'):
+                data = base64.b64decode(screenshot['data'])
+                del screenshot
+
+            if tiles_dir:
+                with timed(timer, 'write'), open(tile_path(output_path, tiles_dir, tiles), "wb") as f:
+                    f.write(data)
+
+            with timed(timer, 'decode'):
+                tile = Image.open(BytesIO(data)).convert('RGB')
+                del data
+
+            # Size the output from the first tile so device scale is honoured
+            if writer is None and canvas is None:
+                scale = tile.size[1] / float(clip_height)
+                pixel_height = int(round(total_height * scale))
+                if format_choice in PIL_FORMATS:
+                    canvas = Image.new('RGB', (tile.size[0], pixel_height), 'white')
+                else:
+                    writer = PNGStreamWriter(output_path, tile.size[0], pixel_height)
+
+            with timed(timer, 'encode'):
+                if canvas is not None:
+                    canvas.paste(tile, (0, offset))
+                else:
+                    writer.write_image(tile)
+            offset += tile.size[1]
+            tiles += 1
+
+        with timed(timer, 'encode'):
+            if canvas is not None:
+                canvas.save(output_path, PIL_FORMATS[format_choice], quality=quality)
+            elif writer is not None:
+                writer.close()
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    return tiles
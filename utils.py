@@ -0,0 +1,242 @@
+import os
+import time
+import base64
+import datetime
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+DEFAULT_USER_AGENT = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+                      "(KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36")
+
+
+def normalize_url(url):
+    """Add a scheme to bare URLs and return (url, parsed) or (url, None) if invalid"""
+    url = url.strip()
+    if not url.startswith(("http://", "https://")):
+        url = "https://" + url
+
+    try:
+        parsed_url = urlparse(url)
+    except Exception:
+        return url, None
+
+    if not parsed_url.netloc:
+        return url, None
+    return url, parsed_url
+
+
+def canonical_url(url):
+    """
+    Normalize a URL for use as a cache key
+
+    Lower-cases the scheme and host, drops default ports and the fragment,
+    and sorts query parameters, so equivalent spellings map to one key.
+    """
+    url, parsed = normalize_url(url)
+    if parsed is None:
+        return url
+
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    port = parsed.port
+    if port and not (scheme == 'http' and port == 80) and not (scheme == 'https' and port == 443):
+        host = f"{host}:{port}"
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse((scheme, host, parsed.path or '/', parsed.params, query, ''))
+
+
+def origin(url):
+    """scheme://host[:port] of a URL, the unit browsers scope storage to"""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def default_output_path(parsed_url, output_format, directory=None, suffix=None):
+    """
+    Build the auto-generated output path for a capture
+
+    Args:
+        parsed_url: Result of urlparse() for the captured URL
+        output_format (str): File extension to use
+        directory (str): Target directory, or None for the desktop
+        suffix (str): Optional tag appended to the file name (e.g. a job id)
+
+    Returns:
+        str: Output path of the form <domain>_<timestamp>[_<suffix>].<format>
+    """
+    domain = parsed_url.netloc.replace("www.", "")
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    if directory is None:
+        directory = os.path.join(os.path.expanduser("~"), "Desktop")
+
+    name = f"{domain}_{timestamp}"
+    if suffix is not None:
+        name = f"{name}_{suffix}"
+    return os.path.join(directory, f"{name}.{output_format}")
+
+
+# Named viewports: (width, height, device scale factor, mobile)
+VIEWPORTS = {
+    'mobile': (390, 844, 3, True),
+    'tablet': (820, 1180, 2, True),
+    'laptop': (1366, 768, 1, False),
+    'desktop': (1920, 1080, 1, False),
+}
+
+
+def parse_viewport(spec):
+    """
+    Parse a viewport spec into a dict of name, width, height, scale and mobile
+
+    A spec is a VIEWPORTS name, a width ('1280'), a size ('1440x900') or a
+    size with a device scale factor ('1440x900@2'). Dicts are returned as-is.
+    """
+    if isinstance(spec, dict):
+        return spec
+    name = spec.strip().lower()
+    if name in VIEWPORTS:
+        width, height, scale, mobile = VIEWPORTS[name]
+    else:
+        size, _, scale = name.partition('@')
+        width, _, height = size.partition('x')
+        try:
+            width = int(width)
+            height = int(height) if height else 1080
+            scale = float(scale) if scale else 1
+        except ValueError:
+            raise ValueError(f"Invalid viewport: {spec}")
+        if width <= 0 or height <= 0 or scale <= 0:
+            raise ValueError(f"Invalid viewport: {spec}")
+        mobile = False
+    return {'name': name, 'width': width, 'height': height, 'scale': scale, 'mobile': mobile}
+
+
+def viewport_output_path(output_path, parsed_url, output_format, name):
+    """Output path for one viewport: name inserted before the extension of output_path"""
+    if not output_path:
+        return default_output_path(parsed_url, output_format, suffix=name)
+    root, extension = os.path.splitext(output_path)
+    return f"{root}_{name}{extension or '.' + output_format}"
+
+
+# Output formats, and the Page.captureScreenshot format for each image format
+OUTPUT_FORMATS = ['png', 'jpg', 'webp', 'pdf']
+CDP_IMAGE_FORMATS = {'png': 'png', 'jpg': 'jpeg', 'webp': 'webp'}
+
+
+def screenshot_params(format_choice, quality=90):
+    """Page.captureScreenshot parameters that make Chrome encode format_choice natively"""
+    params = {"format": CDP_IMAGE_FORMATS.get(format_choice, 'png')}
+    if params["format"] != 'png':
+        params["quality"] = max(0, min(100, int(quality)))
+    return params
+
+
+def write_base64(data, output_path, chunk_size=1 << 20, timer=None):
+    """
+    Decode base64 text straight to a file in fixed-size chunks
+
+    Avoids holding a second full-size decoded copy of large CDP payloads.
+    If a timer (e.g. a CaptureResult) is given, the time spent decoding and
+    writing is added to its 'decode' and 'write' phases.
+
+    Returns:
+        int: Number of bytes written
+    """
+    # Decode on 4-character boundaries so every chunk is valid on its own
+    chunk_size -= chunk_size % 4
+    written = 0
+    decoding = writing = 0.0
+    with open(output_path, "wb") as f:
+        for start in range(0, len(data), chunk_size):
+            started = time.monotonic()
+            chunk = base64.b64decode(data[start:start + chunk_size])
+            decoded = time.monotonic()
+            written += f.write(chunk)
+            decoding += decoded - started
+            writing += time.monotonic() - decoded
+    if timer is not None:
+        timer.add_time('decode', decoding)
+        timer.add_time('write', writing)
+    return written
+
+
+def process_tree_rss(pid, include_root=True):
+    """
+    Total RSS in bytes of a process and all its descendants
+
+    Uses psutil when installed and /proc otherwise.
+
+    Returns:
+        int: Bytes, or None if memory can't be measured on this platform
+    """
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            processes = root.children(recursive=True) + ([root] if include_root else [])
+        except psutil.Error:
+            return None
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+    if not os.path.isdir('/proc'):
+        return None
+
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+            parents[int(entry)] = int(fields[1])
+        except (OSError, IndexError, ValueError):
+            pass
+
+    family = {pid}
+    added = True
+    while added:
+        added = False
+        for child, parent in parents.items():
+            if parent in family and child not in family:
+                family.add(child)
+                added = True
+    if not include_root:
+        family.discard(pid)
+
+    total = 0
+    for member in family:
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
+
+
+def pid_running(pid):
+    """
+    Whether a process with this id is running
+
+    Uses psutil when installed and /proc otherwise.
+
+    Returns:
+        bool: The answer, or None if it can't be told on this platform
+    """
+    if psutil is not None:
+        return psutil.pid_exists(pid)
+    if not os.path.isdir('/proc'):
+        return None
+    return os.path.exists(f"/proc/{pid}")
@@ -0,0 +1,173 @@
+import os
+import shutil
+from io import BytesIO
+
+from metrics import timed
+from tiling import PIL_FORMATS
+from utils import default_output_path, OUTPUT_FORMATS
+
+def _flag(value):
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(value)
+
+
+SPEC_KEYS = {'quality': int, 'width': int, 'height': int, 'scale': float, 'optimize': _flag, 'path': str}
+
+
+def parse_output_spec(spec):
+    """
+    Parse an output spec into a dict of format, quality, width, height, scale, optimize and path
+
+    A spec is a format optionally followed by ':' and comma-separated
+    key=value options, e.g. 'png', 'jpg:quality=70,width=400' or
+    'pdf:path=page.pdf'. Dicts are returned with missing keys filled in.
+
+    width alone scales the image to that width; width and height make a
+    thumbnail of the top of the page cropped to that aspect ratio; scale
+    multiplies both dimensions. optimize trades encoding time for size:
+    maximum PNG compression, optimized progressive JPEG, slowest WebP method.
+    """
+    if isinstance(spec, dict):
+        parsed = dict(spec)
+    else:
+        output_format, _, options = spec.strip().partition(':')
+        parsed = {'format': output_format.lower()}
+        for option in filter(None, options.split(',')):
+            key, _, value = option.partition('=')
+            key = key.strip().lower()
+            if key not in SPEC_KEYS or not value:
+                raise ValueError(f"Invalid output option: {option}")
+            try:
+                parsed[key] = SPEC_KEYS[key](value.strip())
+            except ValueError:
+                raise ValueError(f"Invalid output option: {option}")
+
+    if parsed.get('format') not in OUTPUT_FORMATS:
+        raise ValueError(f"Invalid format: {parsed.get('format')}")
+    for key in SPEC_KEYS:
+        parsed.setdefault(key, None)
+    if parsed['quality'] is None:
+        parsed['quality'] = 90
+    parsed['optimize'] = bool(parsed['optimize'])
+    return parsed
+
+
+def resized(spec):
+    """True if the spec asks for anything other than the full-size render"""
+    return bool(spec['width'] or spec['height'] or (spec['scale'] and spec['scale'] != 1))
+
+
+def passthrough(spec):
+    """True if Chrome's own full-size encoding satisfies the spec as-is"""
+    return not resized(spec) and not spec['optimize']
+
+
+def save_options(spec):
+    """PIL save() arguments for a spec's format and optimize setting"""
+    if spec['format'] == 'png':
+        return {'format': 'PNG', 'optimize': spec['optimize']}
+    options = {'format': PIL_FORMATS[spec['format']], 'quality': spec['quality']}
+    if spec['optimize'] and spec['format'] == 'jpg':
+        options.update(optimize=True, progressive=True)
+    elif spec['optimize']:
+        options['method'] = 6
+    return options
+
+
+def spec_tag(spec):
+    """Short file name tag describing a spec's size and optimization, or None for full size"""
+    tag = None
+    if spec['width'] and spec['height']:
+        tag = f"{spec['width']}x{spec['height']}"
+    elif spec['width']:
+        tag = f"{spec['width']}w"
+    elif spec['height']:
+        tag = f"{spec['height']}h"
+    elif resized(spec):
+        tag = f"x{spec['scale']:g}"
+    if spec['optimize']:
+        tag = f"{tag}_opt" if tag else "opt"
+    return tag
+
+
+def variant_output_path(output_path, parsed_url, spec):
+    """
+    Output path for one spec
+
+    The spec's own path wins; otherwise output_path (with or without an
+    extension) is used as a template, or the path is auto-generated.
+    """
+    if spec['path']:
+        return spec['path']
+    tag = spec_tag(spec)
+    if not output_path:
+        return default_output_path(parsed_url, spec['format'], suffix=tag)
+    root = os.path.splitext(output_path)[0]
+    return f"{root}_{tag}.{spec['format']}" if tag else f"{root}.{spec['format']}"
+
+
+def target_size(size, spec):
+    """Pixel size of a variant of an image of the given size"""
+    width, height = size
+    if spec['scale']:
+        width, height = width * spec['scale'], height * spec['scale']
+    if spec['width'] and spec['height']:
+        return spec['width'], spec['height']
+    if spec['width']:
+        return spec['width'], height * spec['width'] / width
+    if spec['height']:
+        return width * spec['height'] / height, spec['height']
+    return width, height
+
+
+def derive(image, spec):
+    """Resize (and for thumbnails crop) a decoded screenshot to a spec"""
+    from PIL import Image
+
+    width, height = (max(1, int(round(value))) for value in target_size(image.size, spec))
+    if (width, height) == image.size:
+        return image
+    if spec['width'] and spec['height']:
+        # Crop the top of the page to the thumbnail's aspect ratio first
+        crop_height = min(image.size[1], int(round(image.size[0] * height / float(width))))
+        image = image.crop((0, 0, image.size[0], crop_height))
+    # reducing_gap shrinks in cheap integer steps before the final resample
+    return image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+
+
+def write_variants(source, specs, paths, timer=None, timers=None):
+    """
+    Write every image spec from one PNG render
+
+    The source is decoded at most once, and only if some spec needs more
+    than a byte-for-byte copy of it.
+
+    Args:
+        source (bytes or str): PNG screenshot data, or the path of a PNG file
+        specs (list): Parsed image output specs
+        paths (list): Output path for each spec
+        timer (CaptureResult): Accumulates the shared decode time
+        timers (list): CaptureResult per spec for its own encode/write time
+    """
+    timers = timers or [timer] * len(specs)
+    image = None
+    for spec, path, spec_timer in zip(specs, paths, timers):
+        if spec['format'] == 'png' and passthrough(spec):
+            with timed(spec_timer, 'write'):
+                if isinstance(source, str):
+                    if os.path.abspath(source) != os.path.abspath(path):
+                        shutil.copyfile(source, path)
+                else:
+                    with open(path, "wb") as f:
+                        f.write(source)
+            continue
+
+        if image is None:
+            from PIL import Image
+            with timed(timer, 'decode'):
+                image = Image.open(source if isinstance(source, str) else BytesIO(source)).convert('RGB')
+        with timed(spec_timer, 'encode'):
+            derive(image, spec).save(path, **save_options(spec))
@@ -0,0 +1,494 @@
+import os
+import shutil
+import struct
+import hashlib
+import threading
+
+from tiling import PNGStreamReader, PNGStreamWriter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Side of the square blocks that are hashed and compared, in pixels
+BLOCK_SIZE = 32
+
+# Rows decoded and compared at once; a multiple of BLOCK_SIZE
+STRIP_HEIGHT = 512
+
+# Largest per-channel difference that still counts as the same pixel, so
+# anti-aliasing and lossy re-encoding noise don't register as changes
+TOLERANCE = 16
+
+# Colour blended over changed pixels in highlight images
+HIGHLIGHT = (255, 0, 64)
+
+# Header of a block hash file: magic, width, height, block size
+HASHES_HEADER = struct.Struct(">4sIII")
+HASHES_MAGIC = b"WCBH"
+HASH_SIZE = 8
+
+# Baselines are locked by stripe, so memory doesn't grow with the number of URLs
+LOCK_STRIPES = 64
+
+
+class VisualDiff:
+    """
+    How a capture differs from the previous one
+
+    `score` is the fraction of pixels that changed (pixels outside the
+    overlap of differently sized captures count as changed), `boxes` the
+    bounding boxes (left, top, right, bottom) of connected changed regions.
+    """
+
+    def __init__(self, width, height, block_size=BLOCK_SIZE):
+        self.width = width
+        self.height = height
+        self.block_size = block_size
+        self.compared = False
+        self.changed_pixels = 0
+        self.total_pixels = width * height
+        self.changed_blocks = 0
+        self.boxes = []
+        self.highlight = None
+        self.hashes = []
+        self._block_boxes = {}
+
+    @property
+    def score(self):
+        if not self.total_pixels:
+            return 0.0
+        return self.changed_pixels / self.total_pixels
+
+    @property
+    def changed(self):
+        return self.changed_pixels > 0
+
+    def to_dict(self):
+        return {
+            'compared': self.compared,
+            'score': round(self.score, 6),
+            'changed_pixels': self.changed_pixels,
+            'changed_blocks': self.changed_blocks,
+            'boxes': [list(box) for box in self.boxes],
+            'highlight': self.highlight,
+        }
+
+    def _mark(self, row, column, box, pixels):
+        """Record changed pixels inside block (row, column), box in image coordinates"""
+        self.changed_blocks += 1
+        self.changed_pixels += pixels
+        self._block_boxes[(row, column)] = box
+
+    def _merge_boxes(self):
+        """Group changed blocks that touch (including diagonally) into one box each"""
+        remaining = dict(self._block_boxes)
+        boxes = []
+        while remaining:
+            start, box = remaining.popitem()
+            left, top, right, bottom = box
+            stack = [start]
+            while stack:
+                row, column = stack.pop()
+                for neighbour in ((row + dr, column + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)):
+                    other = remaining.pop(neighbour, None)
+                    if other is not None:
+                        stack.append(neighbour)
+                        left, top = min(left, other[0]), min(top, other[1])
+                        right, bottom = max(right, other[2]), max(bottom, other[3])
+            boxes.append((left, top, right, bottom))
+        self.boxes = sorted(boxes, key=lambda box: (box[1], box[0]))
+        self._block_boxes = {}
+
+
+def diff_images(previous_path, current_path, highlight_path=None, previous_hashes=None,
+                block_size=BLOCK_SIZE, tolerance=TOLERANCE, strip_height=STRIP_HEIGHT):
+    """
+    Compare a capture with an earlier one of the same page
+
+    Both images are walked in row strips. Every block of the current strip
+    is hashed and checked against the previous capture's block hashes;
+    only blocks whose hash changed are compared pixel by pixel (vectorized
+    with NumPy when it is installed). With `previous_hashes` from an
+    earlier diff, the previous image isn't decoded at all unless a block
+    changed. PNGs are decoded strip by strip too (other formats are
+    decoded whole), so working memory is a few strips of each image,
+    and the highlight image is streamed to disk strip by strip.
+
+    Args:
+        previous_path (str): Earlier capture, or None to only hash the current one
+        current_path (str): New capture
+        highlight_path (str): Write a PNG of the new capture with changed
+            pixels tinted here, if given
+        previous_hashes (tuple): (width, height, block_size, hashes) as
+            returned by read_hashes()
+        block_size (int): Side of the compared blocks in pixels
+        tolerance (int): Largest per-channel difference treated as equal
+        strip_height (int): Rows processed at once
+
+    Returns:
+        VisualDiff: The comparison; its `hashes` are the current capture's
+            block hashes, row by row
+    """
+    strip_height = max(block_size, strip_height // block_size * block_size)
+    current = _Strips(current_path)
+    try:
+        return _diff_strips(current, previous_path, highlight_path, previous_hashes, block_size,
+                            tolerance, strip_height)
+    finally:
+        current.close()
+
+
+def _diff_strips(current, previous_path, highlight_path, previous_hashes, block_size, tolerance,
+                 strip_height):
+    width, height = current.size
+    diff = VisualDiff(width, height, block_size)
+
+    previous = None
+    previous_size = None
+    if previous_hashes is not None and previous_hashes[2] != block_size:
+        previous_hashes = None
+    if previous_hashes is not None:
+        previous_size = previous_hashes[:2]
+    elif previous_path is not None:
+        previous = _Strips(previous_path)
+        previous_size = previous.size
+
+    if previous_size is not None:
+        diff.compared = True
+        previous_width, previous_height = previous_size
+        if previous_width != width:
+            # A different viewport width reflows the whole page
+            diff.total_pixels = max(width * height, previous_width * previous_height)
+            diff.changed_pixels = diff.total_pixels
+            diff.changed_blocks = _blocks(width, block_size) * _blocks(height, block_size)
+            diff.boxes = [(0, 0, max(width, previous_width), max(height, previous_height))]
+            previous_size = None
+        else:
+            diff.total_pixels = width * max(height, previous_height)
+
+    writer = PNGStreamWriter(highlight_path, width, height) if highlight_path else None
+    try:
+        for top in range(0, height, strip_height):
+            bottom = min(height, top + strip_height)
+            data = current.rows(top, bottom)
+            hashes = block_hashes(data, width, bottom - top, block_size)
+            diff.hashes.extend(hashes)
+            tinted = None
+
+            if previous_size is not None:
+                changed = _changed_blocks(hashes, top // block_size, previous_hashes)
+                if changed:
+                    old = None
+                    previous_bottom = min(bottom, previous_size[1])
+                    if previous_bottom > top:
+                        if previous is None:
+                            previous = _Strips(previous_path)
+                        old = previous.rows(top, previous_bottom)
+                    tinted = _compare_blocks(diff, data, old, width, top, bottom, previous_bottom,
+                                             changed, block_size, tolerance, writer is not None)
+            if writer:
+                writer.write_rows(tinted if tinted is not None else data)
+    finally:
+        if writer:
+            writer.close()
+        if previous is not None:
+            previous.close()
+
+    if previous_size is not None and previous_size[1] > height:
+        # Content removed from the end of the page
+        diff.changed_pixels += width * (previous_size[1] - height)
+        diff._block_boxes[(_blocks(height, block_size), 0)] = (0, height, width, previous_size[1])
+    if diff._block_boxes:
+        diff._merge_boxes()
+    if highlight_path:
+        diff.highlight = highlight_path
+    return diff
+
+
+def block_hashes(data, width, rows, block_size=BLOCK_SIZE):
+    """
+    Hash every block of a strip of RGB pixel rows
+
+    Returns:
+        list: A list of 8-byte digests per block row, left to right
+    """
+    row_bytes = width * 3
+    columns = range(0, width, block_size)
+    hashed = []
+    if numpy is not None:
+        pixels = numpy.frombuffer(data, dtype=numpy.uint8).reshape(rows, width, 3)
+        for top in range(0, rows, block_size):
+            band = pixels[top:top + block_size]
+            hashed.append([_hash(band[:, left:left + block_size].tobytes()) for left in columns])
+        return hashed
+
+    view = memoryview(data)
+    for top in range(0, rows, block_size):
+        bottom = min(rows, top + block_size)
+        row_hashes = []
+        for left in columns:
+            start, end = left * 3, min(width, left + block_size) * 3
+            digest = hashlib.blake2b(digest_size=HASH_SIZE)
+            for row in range(top, bottom):
+                digest.update(view[row * row_bytes + start:row * row_bytes + end])
+            row_hashes.append(digest.digest())
+        hashed.append(row_hashes)
+    return hashed
+
+
+def write_hashes(path, diff):
+    """Store the block hashes of a VisualDiff's current capture"""
+    partial = f"{path}.tmp"
+    with open(partial, "wb") as f:
+        f.write(HASHES_HEADER.pack(HASHES_MAGIC, diff.width, diff.height, diff.block_size))
+        for row in diff.hashes:
+            f.write(b"".join(row))
+    os.replace(partial, path)
+
+
+def read_hashes(path):
+    """
+    Read block hashes written by write_hashes()
+
+    Returns:
+        tuple: (width, height, block_size, hashes), or None if the file is
+            missing or unreadable
+    """
+    try:
+        with open(path, "rb") as f:
+            magic, width, height, block_size = HASHES_HEADER.unpack(f.read(HASHES_HEADER.size))
+            data = f.read()
+    except (OSError, struct.error):
+        return None
+    columns, rows = _blocks(width, block_size), _blocks(height, block_size)
+    if magic != HASHES_MAGIC or len(data) != rows * columns * HASH_SIZE:
+        return None
+    row_size = columns * HASH_SIZE
+    hashes = [[data[offset + i:offset + i + HASH_SIZE] for i in range(0, row_size, HASH_SIZE)]
+              for offset in range(0, len(data), row_size)]
+    return width, height, block_size, hashes
+
+
+class VisualDiffStore:
+    """
+    Diff every capture of a URL against the previous one
+
+    For each URL, output format and viewport the store keeps the last
+    capture as a baseline together with its block hashes. compare() diffs
+    a new capture against the baseline and then makes it the new baseline.
+    Captures of different URLs are compared concurrently.
+    """
+
+    def __init__(self, directory, highlight=False, block_size=BLOCK_SIZE, tolerance=TOLERANCE):
+        """
+        Args:
+            directory (str): Where baselines and their hashes are kept
+            highlight (bool): Write '<capture>.diff.png' next to changed captures
+            block_size (int): Side of the compared blocks in pixels
+            tolerance (int): Largest per-channel difference treated as equal
+        """
+        self.directory = directory
+        self.highlight = highlight
+        self.block_size = block_size
+        self.tolerance = tolerance
+        self.compared = 0
+        self.changed = 0
+        self._lock = threading.Lock()
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        os.makedirs(directory, exist_ok=True)
+        if numpy is None:
+            print("NumPy is not installed; changed blocks are compared in pure Python, "
+                  "which is much slower on pages that change a lot")
+
+    def _paths(self, key, output_format):
+        base = os.path.join(self.directory, key)
+        return f"{base}.{output_format}", f"{base}.blocks"
+
+    def compare(self, key, output_format, path):
+        """
+        Diff a fresh capture against the previous capture of the same page
+
+        Args:
+            key (str): ChangeTracker.key() of the capture, which identifies
+                the page and the options it was captured with
+            output_format (str): 'png', 'jpg' or 'webp'
+            path (str): The fresh capture
+
+        Returns:
+            VisualDiff: The comparison (`compared` is False for a first
+                capture), or None if the capture couldn't be diffed
+        """
+        baseline, hashes_path = self._paths(key, output_format)
+        with self._locks[hash(baseline) % len(self._locks)]:
+            have_baseline = os.path.isfile(baseline)
+            highlight_path = None
+            if self.highlight and have_baseline:
+                highlight_path = f"{os.path.splitext(path)[0]}.diff.png"
+            try:
+                diff = diff_images(
+                    baseline if have_baseline else None, path, highlight_path,
+                    read_hashes(hashes_path) if have_baseline else None,
+                    self.block_size, self.tolerance
+                )
+                _copy(path, baseline)
+                write_hashes(hashes_path, diff)
+            except Exception as e:
+                print(f"Could not diff {path}: {e}")
+                return None
+
+        if highlight_path and not diff.changed:
+            os.remove(highlight_path)
+            diff.highlight = None
+        with self._lock:
+            if diff.compared:
+                self.compared += 1
+                self.changed += diff.changed
+        return diff
+
+
+def diffs_from_args(args):
+    """Build a VisualDiffStore from --diff-dir/--diff-highlight, or None"""
+    if not getattr(args, 'diff_dir', None):
+        return None
+    return VisualDiffStore(args.diff_dir, highlight=getattr(args, 'diff_highlight', False))
+
+
+def _blocks(size, block_size):
+    return (size + block_size - 1) // block_size
+
+
+def _hash(data):
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).digest()
+
+
+class _Strips:
+    """Rows of an image as RGB bytes, read top to bottom; PNGs are streamed"""
+
+    def __init__(self, path):
+        self._reader = None
+        self._image = None
+        try:
+            self._reader = PNGStreamReader(path)
+            self.size = self._reader.size
+        except ValueError:
+            from PIL import Image
+
+            self._image = Image.open(path)
+            self.size = self._image.size
+
+    def rows(self, top, bottom):
+        """Rows [top, bottom); top may skip ahead but never go back"""
+        if self._reader is None:
+            strip = self._image.crop((0, top, self.size[0], bottom))
+        else:
+            while self._reader.rows_read < top:
+                self._reader.read_rows(min(STRIP_HEIGHT, top - self._reader.rows_read))
+            strip = self._reader.read_rows(bottom - top)
+        if strip.mode != 'RGB':
+            strip = strip.convert('RGB')
+        return strip.tobytes()
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+        if self._image is not None:
+            self._image.close()
+
+
+def _changed_blocks(hashes, first_row, previous_hashes):
+    """(row, column) of the blocks in a strip whose hash differs from the previous capture's"""
+    previous_rows = previous_hashes[3] if previous_hashes is not None else None
+    changed = []
+    for offset, row_hashes in enumerate(hashes):
+        row = first_row + offset
+        if previous_rows is not None:
+            # A partial last block hashes fewer rows, so it never matches a full one
+            old = previous_rows[row] if row < len(previous_rows) else None
+            changed.extend((row, column) for column, digest in enumerate(row_hashes)
+                           if old is None or old[column] != digest)
+        else:
+            changed.extend((row, column) for column in range(len(row_hashes)))
+    return changed
+
+
+def _compare_blocks(diff, data, old, width, top, bottom, previous_bottom, blocks, block_size,
+                    tolerance, tint):
+    """
+    Compare the given blocks of a strip pixel by pixel and record them in diff
+
+    Without hashes of the previous capture every block is passed in, and
+    identical ones are weeded out here. Rows beyond previous_bottom are new
+    content and count as changed.
+
+    Returns:
+        bytes: The strip with changed pixels tinted if tint is set, else None
+    """
+    rows = bottom - top
+    old_rows = previous_bottom - top if old is not None else 0
+    if numpy is not None:
+        return _compare_blocks_numpy(diff, data, old, width, top, rows, old_rows, blocks, block_size,
+                                     tolerance, tint)
+
+    row_bytes = width * 3
+    out = bytearray(data) if tint else None
+    for row, column in blocks:
+        y0, x0 = row * block_size - top, column * block_size
+        y1, x1 = min(rows, y0 + block_size), min(width, x0 + block_size)
+        count = 0
+        left, upper, right, lower = width, rows, 0, 0
+        for y in range(y0, y1):
+            base = y * row_bytes
+            for x in range(x0, x1):
+                i = base + x * 3
+                if y < old_rows and (abs(data[i] - old[i]) <= tolerance
+                                     and abs(data[i + 1] - old[i + 1]) <= tolerance
+                                     and abs(data[i + 2] - old[i + 2]) <= tolerance):
+                    continue
+                count += 1
+                left, upper, right, lower = min(left, x), min(upper, y), max(right, x + 1), max(lower, y + 1)
+                if out is not None:
+                    for channel in range(3):
+                        out[i + channel] = (out[i + channel] + HIGHLIGHT[channel]) // 2
+        if count:
+            diff._mark(row, column, (left, top + upper, right, top + lower), count)
+    return bytes(out) if out is not None else None
+
+
+def _compare_blocks_numpy(diff, data, old, width, top, rows, old_rows, blocks, block_size, tolerance, tint):
+    current = numpy.frombuffer(data, dtype=numpy.uint8).reshape(rows, width, 3)
+    previous = numpy.frombuffer(old, dtype=numpy.uint8).reshape(old_rows, width, 3) if old_rows else None
+    out = current.copy() if tint else None
+    highlight = numpy.array(HIGHLIGHT, dtype=numpy.uint16)
+    for row, column in blocks:
+        y0, x0 = row * block_size - top, column * block_size
+        y1, x1 = min(rows, y0 + block_size), min(width, x0 + block_size)
+        mask = numpy.ones((y1 - y0, x1 - x0), dtype=bool)
+        overlap = max(0, min(y1, old_rows) - y0)
+        if overlap:
+            a = current[y0:y0 + overlap, x0:x1].astype(numpy.int16)
+            b = previous[y0:y0 + overlap, x0:x1].astype(numpy.int16)
+            mask[:overlap] = numpy.abs(a - b).max(axis=2) > tolerance
+        count = int(mask.sum())
+        if not count:
+            continue
+        ys, xs = numpy.nonzero(mask)
+        box = (x0 + int(xs.min()), top + y0 + int(ys.min()), x0 + int(xs.max()) + 1, top + y0 + int(ys.max()) + 1)
+        diff._mark(row, column, box, count)
+        if out is not None:
+            block = out[y0:y1, x0:x1]
+            block[mask] = ((block[mask].astype(numpy.uint16) + highlight) // 2).astype(numpy.uint8)
+    return out.tobytes() if out is not None else None
+
+
+def _copy(source, destination):
+    """
+    Replace destination with a copy of source
+
+    Not a hard link: the capture's path may be overwritten in place by the
+    next run, which would change the baseline along with it.
+    """
+    partial = f"{destination}.tmp"
+    shutil.copyfile(source, partial)
+    os.replace(partial, destination)